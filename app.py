@@ -1,25 +1,96 @@
-from dash import Dash, html, dash_table, dcc, Input, Output, State, ctx
+from dash import Dash, html, dash_table, dcc, Input, Output, State, ctx, no_update
 import dash_bootstrap_components as dbc
-import pandas as pd
-import plotly.express as px
+import uuid
 
-from mongodb_utils import mongo_get_top_10_keywords
-from neoj4_utils import get_top_10_cited_research_paper_by_keyword, get_top_10_faculty_by_keywords, get_top_10_keywords_by_School, get_all_keywords, get_all_universities
-from mysql_utils import retrieve_all_favorite_keywords, add_favorite_keywords, delete_favorite_keywords, favorite_keywords_score
+from snapshot_utils import snapshot_config
+if snapshot_config['path']:
+    ## Embedded analytics mode: the widgets read a memory-mapped snapshot instead of the stores
+    ## (favorites are still kept in MySQL)
+    from snapshot_utils import mongo_get_top_10_keywords, mongo_get_top_10_keywords_range, mongo_keyword_popularity
+    from snapshot_utils import get_keyword_details_records, get_top_10_keywords_by_School_records, get_all_keywords, get_all_universities, get_university_popularity
+    from snapshot_utils import get_top_10_cited_research_paper_by_keyword_batch, get_top_10_faculty_by_keyword_batch
+    from snapshot_utils import keyword_stats_records
+else:
+    from mongodb_utils import mongo_get_top_10_keywords, mongo_get_top_10_keywords_range, mongo_keyword_popularity
+    from neoj4_utils import get_keyword_details_records, get_top_10_keywords_by_School_records, get_all_keywords, get_all_universities, get_university_popularity
+    from neoj4_utils import get_top_10_cited_research_paper_by_keyword_batch, get_top_10_faculty_by_keyword_batch
+    from mysql_utils import keyword_stats_records
+from mysql_utils import favorite_keywords_score_records
+from recommend_utils import recommend_keywords
+from favorites_utils import favorites_service, favorites_config
+from fanout_utils import fan_out, fanout_timings
+from metrics_utils import metrics, register_metrics_endpoint, timed, timer
+from figure_utils import base_figure, favorite_histogram, keyword_dot_plot, krc_pie, patch_figure
+from cache_utils import cache_stats
+from concurrency_utils import concurrency_stats
+from mysql_utils import pool_stats
+from suggest_utils import build_index, register_refresher, search_options, suggest_config
+from search_utils import search_config, search_publications
+from dash.exceptions import PreventUpdate
 
 app = Dash(__name__, external_stylesheets = [dbc.themes.BOOTSTRAP])
 
+## Latency histograms, slow queries, cache/pool/fan-out/admission statistics at /metrics (when enabled)
+register_metrics_endpoint(app.server)
+metrics.register_source('cache', cache_stats)
+metrics.register_source('mysql_pool', pool_stats)
+metrics.register_source('fanout', fanout_timings)
+metrics.register_source('concurrency', concurrency_stats)
+
+## Startup data from all three stores, fetched in parallel
+startup_data = fan_out({
+    'keywords': ('neo4j', get_all_keywords),
+    'universities': ('neo4j', get_all_universities),
+    'keywords_by_year': ('mongodb', mongo_get_top_10_keywords, 1982),
+    'favorite_keywords': ('mysql', favorites_service.keywords, ''),
+    'keyword_popularity': ('mongodb', mongo_keyword_popularity),
+    'university_popularity': ('neo4j', get_university_popularity),
+})
+
 ## Neo4j Query Data
-keywords_selection = [{'label': name, 'value': name} for name in get_all_keywords()]
-universities_selection = [{'label': school, 'value': school} for school in get_all_universities()]
+keywords_selection = [{'label': name, 'value': name} for name in startup_data['keywords']]
+universities_selection = [{'label': school, 'value': school} for school in startup_data['universities']]
+
+## Search-as-you-type: the dropdowns ship only the most popular options and fetch matches
+## from an in-process prefix index as the user types, instead of the full option lists.
+## Rebuilt in the background once suggest_config['max_age'] has passed; a list that failed
+## to load keeps its previous index
+def refresh_suggestions(data = None):
+    data = data or fan_out({
+        'keywords': ('neo4j', get_all_keywords),
+        'universities': ('neo4j', get_all_universities),
+        'keyword_popularity': ('mongodb', mongo_keyword_popularity),
+        'university_popularity': ('neo4j', get_university_popularity),
+    })
+    if data['keywords'] is not None:
+        build_index('keywords', data['keywords'], data['keyword_popularity'])
+    if data['universities'] is not None:
+        build_index('universities', data['universities'], data['university_popularity'])
+
+refresh_suggestions(startup_data)
+register_refresher(refresh_suggestions)
+
+def initial_options(name, selection, value):
+    return search_options(name, '', value) if suggest_config['enabled'] else selection
 
 ## MongoDB Query Data
-mongo_data_1 = mongo_get_top_10_keywords(1982)
+mongo_data_1 = startup_data['keywords_by_year']
 ## Store keywords into dictionary list for easy lookup 
 table_10_keywords_year = [] 
 for row in mongo_data_1:
     table_10_keywords_year.append({'Keyword': row['keyword'], 'Publication Count': row['publication count']})
 
+## MySQL Query Data (per-session favorites are loaded once the browser session is known)
+favorite_keywords_selection = [] if favorites_config['per_session'] else startup_data['favorite_keywords']
+
+## Warm the shared query cache for the first paint so the initial callbacks don't queue on each store
+if not snapshot_config['path']:
+    fan_out({
+        'keyword_details': ('neo4j', get_keyword_details_records, keywords_selection[0]['value']),
+        'school_keywords': ('neo4j', get_top_10_keywords_by_School_records, universities_selection[0]['value']),
+        'favorite_stats': ('mysql', favorite_keywords_score_records, ''),
+    }, raise_errors = False)
+
 ## Title 
 app.layout = dbc.Container([
     ## Title Row
@@ -31,7 +102,7 @@ app.layout = dbc.Container([
         html.H2('Keywords Exploration', style = {'textAlign': 'center'}),
         html.H6('Keywords Selection'),
         dcc.Dropdown(id = 'keyword-dropdown',
-                     options = keywords_selection,
+                     options = initial_options('keywords', keywords_selection, keywords_selection[0]['value']),
                      value = keywords_selection[0]['value']),
         ## Query1: By selecting the keyword, display the 10 most cited research paper.
         dbc.Col([
@@ -68,20 +139,28 @@ app.layout = dbc.Container([
                 html.H6('University Selection'),
                 dcc.Dropdown(
                     id = 'university',
-                    options = universities_selection,
+                    options = initial_options('universities', universities_selection, universities_selection[0]['value']),
                     value = universities_selection[0]['value'],
                 )
             ]),
             html.Div([
                 dcc.Graph(
                     id = 'krc-scores',
-                    figure = {}
+                    figure = base_figure('krc_pie')
                 )
             ]),
         ], width = 5),
          ## Query 4: Top 10 keywords for selected year
         dbc.Col([
             html.H3('Top 10 Most Popular Keywords fo Year', style = {'textAlign': 'center'}),
+            dbc.Row([
+                dcc.RadioItems(
+                    id = 'year-mode',
+                    options = [{'label': 'Single Year', 'value': 'year'}, {'label': 'Year Range', 'value': 'range'}],
+                    value = 'year',
+                    inline = True
+                )
+            ], class_name = 'my-widget'),
             dbc.Row([
                 dcc.Slider(
                     min = 1982,
@@ -92,10 +171,22 @@ app.layout = dbc.Container([
                     marks = {str(year): str(year) for year in range(1982, 2022, 5)},
                     tooltip = {"placement": "top", "always_visible": True}
                 )
-            ], class_name = 'my-widget'),
+            ], id = 'year-slide-row', class_name = 'my-widget'),
+            dbc.Row([
+                dcc.RangeSlider(
+                    min = 1982,
+                    max = 2023,
+                    step = 1,
+                    id = 'year_range',
+                    value = [1982, 2023],
+                    marks = {str(year): str(year) for year in range(1982, 2022, 5)},
+                    tooltip = {"placement": "top", "always_visible": True}
+                )
+            ], id = 'year-range-row', class_name = 'my-widget', style = {'display': 'none'}),
             html.Div([
                 dcc.Graph(
-                    id = 'top10-keyword-dot-plot'
+                    id = 'top10-keyword-dot-plot',
+                    figure = base_figure('keyword_dot_plot')
                 )
             ]),
         ], width = 5),
@@ -111,11 +202,12 @@ app.layout = dbc.Container([
         ## Query 5: Add favorite keyword(s) and display the favorite keyword table
         dbc.Col([
             html.H3("Favorite Keywords"),
+            dcc.Store(id = 'favorites-session', storage_type = 'session'),
             dbc.Row([
                 dbc.Col([
                     dcc.Dropdown(
                         id='keyword-dropdown-all',
-                        options=keywords_selection,
+                        options=initial_options('keywords', keywords_selection, None),
                         value='',
                     ),
                 ]),
@@ -128,7 +220,7 @@ app.layout = dbc.Container([
                 id='favorite-keywords-table',
                 columns=[{"name": "Favorite Keywords", "id": "keywords"}],
                 data=[{"keywords": k}
-                      for k in retrieve_all_favorite_keywords()],
+                      for k in favorite_keywords_selection],
                 editable=True,
                 sort_action="native",
                 sort_mode="multi",
@@ -139,123 +231,222 @@ app.layout = dbc.Container([
                 style_header={
                     'backgroundColor': 'rgb(30, 30, 30)', 'color': 'white', 'textAlign': 'center'},
             ),
-        ], width = 5),
+        ], width = 4),
+        ## Keywords that co-occur most with the favorites in publications
+        dbc.Col([
+            html.H3("Recommended Keywords"),
+            dash_table.DataTable(
+                id = 'keyword-recommendations',
+                columns = [{'name': 'Keyword', 'id': 'Keyword'}, {'name': 'Score', 'id': 'Score'}, {'name': 'Related To', 'id': 'Related To'}],
+                data = [],
+                editable = False,
+                row_deletable = False,
+                page_size = 10,
+                style_cell = {'textAlign': 'left', 'whiteSpace': 'normal', 'height': 'auto'},
+                style_header = {'backgroundColor': 'rgb(30, 30, 30)', 'color': 'white', 'textAlign': 'center'},
+            ),
+        ], width = 3),
         ## Query 6: Display line graph to compare statistic between each favorite keywords
         dbc.Col([
             html.H3("Favorite Keywords Statistic", style = {'textAlign': 'center'}),
             html.Div([
                 dcc.Graph(
-                    id = 'favorite-keywords-stats'
+                    id = 'favorite-keywords-stats',
+                    figure = base_figure('favorite_histogram')
                 )
             ]),
-        ], width = 5),
+        ], width = 4),
+    ], class_name = 'p-3 d-flex justify-content-around'),
+
+    dbc.Row([
+        ## Query 7: Compare the top publications or professors of every favorite keyword side by side
+        dbc.Col([
+            html.H3("Favorite Keywords Comparison", style = {'textAlign': 'center'}),
+            dcc.RadioItems(
+                id = 'comparison-mode',
+                options = [{'label': 'Top Publications', 'value': 'papers'}, {'label': 'Top Professors', 'value': 'faculty'}],
+                value = 'papers',
+                inline = True
+            ),
+            dash_table.DataTable(
+                id = 'favorite-keywords-comparison',
+                columns = [{'name': 'Rank', 'id': 'rank'}],
+                data = [],
+                editable = False,
+                row_deletable = False,
+                style_cell = {'textAlign': 'left', 'whiteSpace': 'normal', 'height': 'auto'},
+                style_header = {'backgroundColor': 'rgb(30, 30, 30)', 'color': 'white', 'textAlign': 'center'},
+            ),
+        ], width = 10),
+    ], class_name = 'p-3 d-flex justify-content-around'),
+
+    dbc.Row([
+        ## Query 8: Free-text search over publication titles, keywords and authors
+        dbc.Col([
+            html.H3("Publication Search", style = {'textAlign': 'center'}),
+            dcc.Input(id = 'publication-search', type = 'search', value = '', debounce = False,
+                      placeholder = 'Search publications by title, keyword or professor', style = {'width': '100%'}),
+            dash_table.DataTable(
+                id = 'publication-search-results',
+                columns = [{'name': 'Publication', 'id': 'title'}, {'name': 'Year', 'id': 'year'}, {'name': 'Citations', 'id': 'citations'}],
+                data = [],
+                editable = False,
+                row_deletable = False,
+                style_cell = {'textAlign': 'left', 'whiteSpace': 'normal', 'height': 'auto'},
+                style_header = {'backgroundColor': 'rgb(30, 30, 30)', 'color': 'white', 'textAlign': 'center'},
+            ),
+        ], width = 10),
     ], class_name = 'p-3 d-flex justify-content-around'),
 ], fluid = True)
 
-## Call Back: Query 1
+## Call Back: Search-as-you-type options for the keyword and university dropdowns
+def register_search_callback(dropdown, index):
+    @app.callback(
+        Output(dropdown, 'options'),
+        Input(dropdown, 'search_value'),
+        State(dropdown, 'value'),
+        prevent_initial_call = True
+    )
+    @timed('dash', f"search_{dropdown.replace('-', '_')}", kind = 'callback')
+    def update_search_options(search_value, value):
+        ## Clearing the search keeps the current options
+        if not suggest_config['enabled'] or not search_value:
+            raise PreventUpdate
+        return search_options(index, search_value, value)
+
+for dropdown, index in (('keyword-dropdown', 'keywords'), ('keyword-dropdown-all', 'keywords'), ('university', 'universities')):
+    register_search_callback(dropdown, index)
+
+## Call Back: Query 1 + 2
 @app.callback(
     Output('top-10-cited-paper', 'data'),
+    Output('top-10-faculty', 'data'),
     Input('keyword-dropdown', 'value')
 )
-def update_cited_paper(keyword):
-    # Retrieve data from Neo4j based on selected keyword 
-    dataframe = get_top_10_cited_research_paper_by_keyword(keyword)
-    return dataframe.to_dict('records')
-
-## Call Back: Query 2
-@app.callback(
-        Output('top-10-faculty', 'data'),
-        Input('keyword-dropdown', 'value')
-)
-def update_professors(keyword):
-    # Retrieve data from Neo4j based on selected keyword
-    dataframe = get_top_10_faculty_by_keywords(keyword)
-    return dataframe.to_dict('records')
+@timed('dash', kind = 'callback')
+def update_keyword_details(keyword):
+    # Retrieve top papers and top professors from Neo4j in one query for the selected keyword
+    ## A shed or failed query comes back as None and is not cached
+    papers, faculty = get_keyword_details_records(keyword) or ([], [])
+    return papers, faculty
 
 ## Call back: Query 3
 @app.callback(
     Output(component_id = 'krc-scores', component_property = 'figure'),
     Input(component_id = 'university', component_property = 'value')
 )
+@timed('dash', kind = 'callback')
 def update_krc_score(university):
-    df = get_top_10_keywords_by_School(university)
-    
-    pie = {
-        'data': [{
-            'values': df['krc score'],
-            'labels': df['keyword'],
-            'type': 'pie',
-            'marker': {'colors': ['pink', 'red', 'orange', 'yellow', 'green', 'blue', 'purple', 'teal', 'brown', 'grey']}
-        }],
-        'layout': {'title': f'Top 10 Keywords and KRC Score for {university}'}
-    }
-    return pie
+    records = get_top_10_keywords_by_School_records(university) or []
+    ## Only the slices and title change; the pie itself is already on the page
+    return patch_figure(krc_pie(records), f'Top 10 Keywords and KRC Score for {university}')
+
+## Call Back: Query 4 - Show the slider for the selected mode
+@app.callback(
+    Output('year-slide-row', 'style'),
+    Output('year-range-row', 'style'),
+    Input('year-mode', 'value')
+)
+@timed('dash', kind = 'callback')
+def toggle_year_mode(mode):
+    if mode == 'range':
+        return {'display': 'none'}, {}
+    return {}, {'display': 'none'}
 
 ## Call Back: Query 4
 @app.callback(
     Output('top10-keyword-dot-plot', 'figure'),
-    Input('year_slide', 'value')
+    Input('year-mode', 'value'),
+    Input('year_slide', 'value'),
+    Input('year_range', 'value')
 )
-def update_keyword_plot(year):
-    # Retrieve keywords from MongoDB based on selected year range
-    datas = mongo_get_top_10_keywords(year)
-    datas = pd.DataFrame(datas)
-    #print("datas: ", datas)
-    scatter = px.scatter(datas, x = "keyword", y = "publication count", 
-                         color = 'keyword', size = 'publication count',
-                         title = f'Top 10 Keywords in {year}')
+@timed('dash', kind = 'callback')
+def update_keyword_plot(mode, year, year_range):
+    # Retrieve keywords from the in-memory year x keyword cube for the selected year or year range
+    if mode == 'range':
+        datas = mongo_get_top_10_keywords_range(*year_range)
+        title = f'Top 10 Keywords in {year_range[0]} - {year_range[1]}'
+    else:
+        datas = mongo_get_top_10_keywords(year)
+        title = f'Top 10 Keywords in {year}'
+    with timer('figure', 'plotly', 'update_keyword_plot'):
+        ## Send only the new points and title as a partial update of the dot plot
+        scatter = patch_figure(keyword_dot_plot(datas), title)
     return scatter
 
+## Call Back: Query 5 - Assign a favorites session and load its favorites
+## (data_previous is set along with data, so the edit callback doesn't mistake the load for an edit)
+@app.callback(
+    Output('favorites-session', 'data'),
+    Output('favorite-keywords-table', 'data', allow_duplicate = True),
+    Output('favorite-keywords-table', 'data_previous', allow_duplicate = True),
+    Input('favorites-session', 'data'),
+    prevent_initial_call = 'initial_duplicate'
+)
+@timed('dash', kind = 'callback')
+def load_favorites_session(session_id):
+    if session_id is None:
+        session_id = uuid.uuid4().hex if favorites_config['per_session'] else ''
+    table_data = [{'keywords': keyword} for keyword in favorites_service.keywords(session_id)]
+    return session_id, table_data, table_data
+
 ## Call Back: Query 5 - Add Favorite Keywords 
 @app.callback(
     Output('favorite-keywords-table', 'data', allow_duplicate = True),
+    Output('favorite-keywords-table', 'data_previous', allow_duplicate = True),
     Input('add-favorite-button', 'n_clicks'),
     State('keyword-dropdown-all', 'value'),
     State('favorite-keywords-table', 'data'),
+    State('favorites-session', 'data'),
     prevent_initial_call = True
 )
-def update_favorite_keywords(n_clicks, selected_keyword, table_data):
+@timed('dash', kind = 'callback')
+def update_favorite_keywords(n_clicks, selected_keyword, table_data, session_id):
     if n_clicks is None: ## Triggered by something unexpectable (not button clicked)
         print("No Click")
-        return table_data
+        return no_update, no_update
     
-    if 'add-favorite-button' == ctx.triggered_id and selected_keyword:
+    if 'add-favorite-button' == ctx.triggered_id and selected_keyword and session_id is not None:
         print('Button Clicked')
-        if {'keywords': selected_keyword} not in table_data:
-            add_favorite_keywords(selected_keyword)
+        ## Only show the keyword once it is stored (the write may be shed under load)
+        if {'keywords': selected_keyword} not in table_data and selected_keyword in favorites_service.add(session_id, [selected_keyword]):
             table_data.append({'keywords': selected_keyword})
 
-            return table_data
+            return table_data, table_data
     print('Error: Unexpected Error Occured')
-    return table_data
+    return no_update, no_update
 
-## Callback: Query 5 - Delete Favorite Keywords
+## Callback: Query 5 - Delete / Edit Favorite Keywords
 @app.callback(
     Output('favorite-keywords-table', 'data', allow_duplicate = True),
+    Output('favorite-keywords-table', 'data_previous', allow_duplicate = True),
     Input('favorite-keywords-table', 'data'),
+    State('favorite-keywords-table', 'data_previous'),
+    State('favorites-session', 'data'),
     prevent_initial_call = True
 )
-def delete_favorite_keywords_update(data):
-    ## Keywords in table before deletion 
-    favorite_origin = retrieve_all_favorite_keywords()
-    
-    ## keywords in table after deletion
-    #print("Original data: ", favorite_origin)
-    #print("Delete data: ", data)
-    favorite_delete = [d['keywords'] for d in data]
-
-    ## Retrieve delet keyword
-    deleted_keyword = None
-    if len(set(favorite_origin).difference(set(favorite_delete))) > 0:
-        deleted_keyword = set(favorite_origin).difference(set(favorite_delete)).pop()
-
-    ## Delete keyword from the database (SQL)
-    if deleted_keyword:
-        delete_favorite_keywords(deleted_keyword)
-        return data
-    
-    print('Error: Unexpected Error Occured')
-    return data
+@timed('dash', kind = 'callback')
+def delete_favorite_keywords_update(data, data_previous, session_id):
+    if session_id is None:
+        return no_update, no_update
+
+    ## Apply only this tab's edit (a deleted row, or a cell edit replacing one keyword), never the
+    ## whole table, so favorites other tabs changed since this one loaded are left alone. Without a
+    ## previous table there is no edit to apply.
+    if data_previous is not None:
+        previous = [d['keywords'] for d in data_previous if d['keywords']]
+        current = [d['keywords'] for d in data if d['keywords']]
+        previous_set, current_set = set(previous), set(current)
+        deleted = [keyword for keyword in previous if keyword not in current_set]
+        added = [keyword for keyword in current if keyword not in previous_set]
+        if deleted:
+            favorites_service.remove(session_id, deleted)
+        if added:
+            favorites_service.add(session_id, added)
+
+    ## Drop blank rows left by cell edits; otherwise the table is already up to date
+    cleaned = [d for d in data if d['keywords']]
+    return (cleaned, cleaned) if len(cleaned) != len(data) else (no_update, no_update)
 
 ## Callback: Query 6 - Update histogram based on favorite keywords
 @app.callback(
@@ -263,13 +454,66 @@ def delete_favorite_keywords_update(data):
     Input('favorite-keywords-table', 'data'), 
     prevent_initial_call = False
 )
+@timed('dash', kind = 'callback')
 def update_favorite_keyword_histogram(favorite_keywords):
-    stats = favorite_keywords_score()
-    #stats = pd.DataFrame(stats)
-    #print("Statistic: ", stats)
-    histogram = px.histogram(stats, x = "Keyword", y = "KRC", color = "Publication Count")
+    ## Read precomputed keyword_stats rows for just the keywords in the table
+    keywords = [row['keywords'] for row in favorite_keywords or [] if row.get('keywords')]
+    records = keyword_stats_records(keywords) or []
+    with timer('figure', 'plotly', 'update_favorite_keyword_histogram'):
+        histogram = patch_figure(favorite_histogram(records), '')
     
     return histogram
 
+## Callback: Recommend keywords from the precomputed co-occurrence neighbors of the favorites
+@app.callback(
+    Output('keyword-recommendations', 'data'),
+    Input('favorite-keywords-table', 'data')
+)
+@timed('dash', kind = 'callback')
+def update_keyword_recommendations(favorite_keywords):
+    keywords = [row['keywords'] for row in favorite_keywords or [] if row.get('keywords')]
+    return recommend_keywords(keywords)
+
+## Callback: Query 7 - Compare favorite keywords, one batched Neo4j query for all of them
+@app.callback(
+    Output('favorite-keywords-comparison', 'columns'),
+    Output('favorite-keywords-comparison', 'data'),
+    Input('favorite-keywords-table', 'data'),
+    Input('comparison-mode', 'value')
+)
+@timed('dash', kind = 'callback')
+def update_favorite_keywords_comparison(favorite_keywords, mode):
+    keywords = list(dict.fromkeys(row['keywords'] for row in favorite_keywords or [] if row.get('keywords')))
+    columns = [{'name': 'Rank', 'id': 'rank'}] + [{'name': keyword, 'id': f'keyword-{index}'} for index, keyword in enumerate(keywords)]
+    if not keywords:
+        return columns, []
+    if mode == 'faculty':
+        results = get_top_10_faculty_by_keyword_batch(keywords)
+        def cell(record):
+            return f"{record['faculty']} ({record['school']})"
+    else:
+        results = get_top_10_cited_research_paper_by_keyword_batch(keywords)
+        def cell(record):
+            return record['publication']
+    results = results or {}
+    data = []
+    for rank in range(10):
+        row = {'rank': rank + 1}
+        for index, keyword in enumerate(keywords):
+            records = results.get(keyword) or []
+            row[f'keyword-{index}'] = cell(records[rank]) if rank < len(records) else ''
+        data.append(row)
+    return columns, data
+
+## Callback: Query 8 - Publication search, answered from the in-process inverted index
+@app.callback(
+    Output('publication-search-results', 'data'),
+    Input('publication-search', 'value'),
+    prevent_initial_call = True
+)
+@timed('dash', kind = 'callback')
+def update_publication_search(query):
+    return [{'title': record['title'], 'year': record['year'], 'citations': record['citations']} for record in search_publications(query)]
+
 if __name__ == '__main__':
     app.run(debug=True)
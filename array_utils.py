@@ -0,0 +1,41 @@
+## Vectorized group-by and sparse-join helpers over NumPy int arrays, shared by the columnar
+## snapshot (snapshot_utils) and the keyword recommender (recommend_utils).
+
+## Sum values per distinct key tuple; keys are int arrays with known cardinalities (sizes)
+def group_sum(keys, sizes, values):
+    import numpy as np
+    combined = np.zeros(len(values), dtype = np.int64)
+    for key, size in zip(keys, sizes):
+        combined = combined * max(size, 1) + key
+    unique, inverse = np.unique(combined, return_inverse = True)
+    sums = np.bincount(inverse.ravel(), weights = values, minlength = len(unique))
+    columns = []
+    for size in reversed(sizes):
+        columns.append(unique % max(size, 1))
+        unique = unique // max(size, 1)
+    return columns[::-1], sums
+
+## CSR offsets for rows grouped by an int key
+def csr_offsets(groups, group_count):
+    import numpy as np
+    offsets = np.zeros(group_count + 1, dtype = np.int64)
+    np.cumsum(np.bincount(groups, minlength = group_count), out = offsets[1:])
+    return offsets
+
+## Join rows against CSR rows: for every rows[i], each position in offsets[rows[i]]:offsets[rows[i] + 1].
+## Returns (index into rows, position) pairs.
+def expand_rows(offsets, rows):
+    import numpy as np
+    starts = offsets[rows]
+    counts = offsets[rows + 1] - starts
+    repeat = np.repeat(np.arange(len(rows)), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+    return repeat, positions
+
+## Keep the k largest values of each group; returns the kept positions, grouped and by value descending
+def top_k_per_group(groups, values, k):
+    import numpy as np
+    order = np.lexsort((-values, groups))
+    sorted_groups = groups[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_groups, sorted_groups, side = 'left')
+    return order[rank < k]
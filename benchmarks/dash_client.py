@@ -0,0 +1,36 @@
+## Builds _dash-update-component request bodies straight from app.callback_map, so the
+## benchmarks exercise the same dispatch, serialization and callback code a browser does.
+
+def find_callback(app, name):
+    for output, spec in app.callback_map.items():
+        if getattr(spec.get('callback'), '__name__', None) == name:
+            return output, spec
+    raise KeyError(f"No Dash callback named {name}")
+
+def _split_output(output):
+    def parse(item):
+        component_id, component_property = item.rsplit('.', 1)
+        return {'id': component_id, 'property': component_property}
+    if output.startswith('..'):
+        return [parse(item) for item in output[2:-2].split('...')]
+    return parse(output)
+
+## values maps "component-id.property" to the value sent for that input or state
+def callback_payload(app, name, values, changed = None):
+    output, spec = find_callback(app, name)
+    def entries(items):
+        return [{'id': item['id'], 'property': item['property'], 'value': values.get(f"{item['id']}.{item['property']}")} for item in items]
+    inputs = entries(spec.get('inputs', []))
+    return {
+        'output': output,
+        'outputs': _split_output(output),
+        'inputs': inputs,
+        'state': entries(spec.get('state', [])),
+        'changedPropIds': changed if changed is not None else [f"{item['id']}.{item['property']}" for item in inputs]
+    }
+
+def post_callback(client, app, name, values, changed = None, url = ''):
+    ## Flask test client, or requests.Session with the server's url; returns the HTTP status code and response body size in bytes
+    response = client.post(f"{url}/_dash-update-component", json = callback_payload(app, name, values, changed))
+    body = response.data if hasattr(response, 'data') else response.content
+    return response.status_code, len(body)
@@ -0,0 +1,303 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.run import SIZES, summarize
+from benchmarks.synthetic import default_size, generate
+
+## Concurrent-user load test. Virtual users replay browser sessions (page load, year scrubbing,
+## keyword and university switches typed through the search box, favorite edits, publication
+## search) against the _dash-update-component endpoint of a real HTTP server running app.py on
+## top of the local store stand-ins. The server can fork several worker processes sharing one
+## listening socket, as a pre-forking deploy does, so worker, thread and pool settings can be sized
+## on one box without a browser or any database.
+
+## Relative frequency of each user action after the page load
+LOAD_ACTIONS = {
+    'scrub_years': 3,
+    'switch_keyword': 3,
+    'switch_university': 2,
+    'search_publications': 2,
+    'year_range': 1,
+    'add_favorite': 1,
+    'delete_favorite': 1
+}
+
+class Recorder:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, name, seconds, ok):
+        with self.__lock:
+            self.samples.setdefault(name, []).append(seconds)
+            self.errors[name] = self.errors.get(name, 0) + (not ok)
+
+class UserSession:
+    ## One browser tab: its own HTTP connection, favorites session and table state
+    def __init__(self, index, url, app, world, defaults, recorder, rng, think_time):
+        import requests
+        self.client = requests.Session()
+        self.url = url
+        self.app = app
+        self.world = world
+        self.defaults = defaults
+        self.recorder = recorder
+        self.rng = rng
+        self.think_time = think_time
+        self.session_id = f"load-{index}"
+        self.favorites = []
+        self.clicks = 0
+
+    def call(self, name, values, changed = None):
+        from benchmarks.dash_client import post_callback
+        start = time.perf_counter()
+        try:
+            status, _ = post_callback(self.client, self.app, name, values, changed, self.url)
+            ok = status in (200, 204)
+        except Exception as error:
+            logging.debug(f"{name} failed: {error}")
+            ok = False
+        self.recorder.record(name, time.perf_counter() - start, ok)
+
+    ## Exponentially distributed pause, the think time by default
+    def pause(self, mean = None):
+        mean = self.think_time if mean is None else mean
+        if mean > 0:
+            time.sleep(self.rng.expovariate(1 / mean))
+
+    def table(self):
+        return [{'keywords': keyword} for keyword in self.favorites]
+
+    ## previous is the table before a user edit (None when the server set the table)
+    def table_changed(self, previous = None):
+        table = self.table()
+        self.call('delete_favorite_keywords_update', {'favorite-keywords-table.data': table, 'favorite-keywords-table.data_previous': previous,
+                                                      'favorites-session.data': self.session_id})
+        self.call('update_favorite_keyword_histogram', {'favorite-keywords-table.data': table})
+        self.call('update_favorite_keywords_comparison', {'favorite-keywords-table.data': table, 'comparison-mode.value': 'papers'})
+        self.call('update_keyword_recommendations', {'favorite-keywords-table.data': table})
+
+    ## Everyone lands on the same defaults: the first keyword, university and year
+    def page_load(self):
+        first_year = self.world.size['first_year']
+        self.call('update_keyword_details', {'keyword-dropdown.value': self.defaults['keyword']})
+        self.call('update_krc_score', {'university.value': self.defaults['university']})
+        self.call('update_keyword_plot', {'year-mode.value': 'year', 'year_slide.value': first_year,
+                                          'year_range.value': [first_year, self.world.size['last_year']]})
+        self.call('load_favorites_session', {'favorites-session.data': self.session_id})
+        self.table_changed()
+
+    def scrub_years(self):
+        first_year, last_year = self.world.size['first_year'], self.world.size['last_year']
+        year = self.rng.randint(first_year, last_year)
+        for _ in range(self.rng.randint(3, 8)):
+            year = min(last_year, max(first_year, year + self.rng.choice((-1, 1))))
+            self.call('update_keyword_plot', {'year-mode.value': 'year', 'year_slide.value': year, 'year_range.value': [first_year, last_year]},
+                      ['year_slide.value'])
+            self.pause(0.05)
+
+    def year_range(self):
+        first_year, last_year = self.world.size['first_year'], self.world.size['last_year']
+        self.call('update_keyword_plot', {'year-mode.value': 'range', 'year_slide.value': first_year,
+                                          'year_range.value': sorted(self.rng.sample(range(first_year, last_year + 1), 2))}, ['year_range.value'])
+
+    ## Type a few characters into the dropdown, then pick the keyword
+    def switch_keyword(self):
+        keyword = self.rng.choice(self.world.keywords)['name']
+        for length in range(1, min(len(keyword), self.rng.randint(1, 4)) + 1):
+            self.call('update_search_options', {'keyword-dropdown.search_value': keyword[:length], 'keyword-dropdown.value': self.defaults['keyword']})
+            self.pause(0.1)
+        self.call('update_keyword_details', {'keyword-dropdown.value': keyword})
+
+    def switch_university(self):
+        self.call('update_krc_score', {'university.value': self.rng.choice(self.world.institutes)['name']})
+
+    def search_publications(self):
+        title = self.rng.choice(self.world.publications)['title']
+        for length in range(3, min(len(title), self.rng.randint(4, 12)) + 1):
+            self.call('update_publication_search', {'publication-search.value': title[:length]})
+            self.pause(0.1)
+
+    def add_favorite(self):
+        keyword = self.rng.choice(self.world.keywords)['name']
+        self.clicks += 1
+        self.call('update_favorite_keywords', {'add-favorite-button.n_clicks': self.clicks, 'keyword-dropdown-all.value': keyword,
+                                               'favorite-keywords-table.data': self.table(), 'favorites-session.data': self.session_id},
+                  ['add-favorite-button.n_clicks'])
+        if keyword not in self.favorites:
+            self.favorites.append(keyword)
+        self.table_changed()
+
+    def delete_favorite(self):
+        if not self.favorites:
+            return self.add_favorite()
+        previous = self.table()
+        self.favorites.remove(self.rng.choice(self.favorites))
+        self.table_changed(previous)
+
+    def run(self, deadline):
+        self.page_load()
+        actions, weights = list(LOAD_ACTIONS), list(LOAD_ACTIONS.values())
+        while time.monotonic() < deadline:
+            self.pause()
+            action = self.rng.choices(actions, weights)[0]
+            if action == 'add_favorite' and len(self.favorites) >= 10:
+                action = 'delete_favorite'
+            getattr(self, action)()
+        self.client.close()
+
+## Serve app.server on an ephemeral localhost port: in this process (workers = 0) or in forked
+## worker processes sharing the listening socket. Returns (url, stop).
+def start_server(app, workers):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app.server, threaded = True)
+    url = f"http://127.0.0.1:{server.server_port}"
+    if workers <= 0:
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        def stop():
+            server.shutdown()
+            server.server_close()
+        return url, stop
+
+    ## The same fork hooks a pre-forking deploy runs (serving_utils); the in-memory stand-ins survive the
+    ## fork, so each worker only points its freshly reset clients back at them
+    from benchmarks import stores
+    from serving_utils import after_fork, before_fork
+    before_fork()
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            after_fork()
+            stores.attach()
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    server.socket.close()
+    stores.attach()
+    def stop():
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+    return url, stop
+
+def report(recorder, elapsed):
+    callbacks = {}
+    for name, samples in sorted(recorder.samples.items()):
+        errors = recorder.errors.get(name, 0)
+        callbacks[name] = {**summarize(samples), 'throughput_rps': len(samples) / elapsed, 'errors': errors, 'error_rate': errors / len(samples)}
+    samples = [sample for name in recorder.samples for sample in recorder.samples[name]]
+    errors = sum(recorder.errors.values())
+    totals = {**summarize(samples), 'throughput_rps': len(samples) / elapsed, 'errors': errors, 'error_rate': errors / len(samples)} if samples else {}
+    return {'elapsed_s': elapsed, 'totals': totals, 'callbacks': callbacks}
+
+def run_load(size, users, duration, ramp_up, think_time, workers, seed, snapshot):
+    from benchmarks import stores
+    import recommend_utils
+    import snapshot_utils
+
+    world = generate(seed = seed, **size)
+    directory = stores.install(world)
+    stop = None
+    try:
+        if snapshot:
+            path = os.path.join(directory, 'snapshot')
+            snapshot_utils.export_snapshot(path)
+            snapshot_utils.snapshot_config['path'] = path
+        recommend_utils.refresh_keyword_neighbors()
+        import app as dashboard
+        from serving_utils import preload
+        preload()
+        defaults = {'keyword': dashboard.keywords_selection[0]['value'], 'university': dashboard.universities_selection[0]['value']}
+        url, stop = start_server(dashboard.app, workers)
+
+        recorder = Recorder()
+        start = time.monotonic()
+        deadline = start + duration
+        threads = []
+        for index in range(users):
+            user = UserSession(index, url, dashboard.app, world, defaults, recorder, random.Random(seed + index), think_time)
+            thread = threading.Thread(target = user.run, args = (deadline, ), daemon = True)
+            threads.append(thread)
+            thread.start()
+            time.sleep(ramp_up / users)
+        for thread in threads:
+            thread.join()
+        return report(recorder, time.monotonic() - start)
+    finally:
+        if stop is not None:
+            stop()
+        stores.uninstall(directory)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Replay concurrent user sessions against the Dash callbacks on local store stand-ins.")
+    parser.add_argument('--size', default = 'small', help = f"data size from {', '.join(SIZES)}")
+    parser.add_argument('--users', type = int, default = 20, help = "concurrent virtual users")
+    parser.add_argument('--duration', type = float, default = 30, help = "seconds of load after the first user starts")
+    parser.add_argument('--ramp-up', type = float, default = 5, help = "seconds over which the users start")
+    parser.add_argument('--think-time', type = float, default = 0.5, help = "mean seconds between user actions (0 for none)")
+    parser.add_argument('--workers', type = int, default = 2, help = "forked server processes (0 serves from this process)")
+    parser.add_argument('--seed', type = int, default = 411)
+    parser.add_argument('--cache', action = 'store_true', help = "turn the shared query cache on (off by default)")
+    parser.add_argument('--snapshot', action = 'store_true', help = "serve the widgets from the columnar snapshot instead of the stores")
+    parser.add_argument('--output', help = "write the JSON report here instead of stdout")
+    for field in default_size:
+        parser.add_argument(f"--{field.replace('_', '-')}", type = int, help = f"override {field}")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level = logging.WARNING, stream = sys.stderr)
+
+    size = {**SIZES[args.size], **{field: getattr(args, field) for field in default_size if getattr(args, field) is not None}}
+    with tempfile.TemporaryDirectory() as directory:
+        ## The cache settings are read when cache_utils is first imported
+        if args.cache:
+            os.environ['KEYWORD_EXPLORE_CACHE'] = os.path.join(directory, 'cache.sqlite3')
+        else:
+            os.environ['KEYWORD_EXPLORE_CACHE_DISABLED'] = '1'
+        ## The app prints while it starts up; keep stdout for the report
+        stdout, sys.stdout = sys.stdout, sys.stderr
+        try:
+            result = run_load(size, args.users, args.duration, args.ramp_up, args.think_time, args.workers, args.seed, args.snapshot)
+        finally:
+            sys.stdout = stdout
+
+    output = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'size': size,
+            'users': args.users,
+            'duration': args.duration,
+            'ramp_up': args.ramp_up,
+            'think_time': args.think_time,
+            'workers': args.workers,
+            'seed': args.seed,
+            'cache': args.cache,
+            'snapshot': args.snapshot
+        },
+        **result
+    }
+    text = json.dumps(output, indent = 2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
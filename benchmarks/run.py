@@ -0,0 +1,243 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import default_size, generate
+
+## Named data sizes; any field can be overridden from the command line
+SIZES = {
+    'small': {'keywords': 200, 'institutes': 20, 'faculty': 300, 'publications': 5000},
+    'medium': {},
+    'large': {'keywords': 2000, 'institutes': 200, 'faculty': 5000, 'publications': 100000}
+}
+
+def summarize(samples):
+    samples = sorted(samples)
+    def percentile(fraction):
+        return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+    return {
+        'n': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': percentile(0.50) * 1000,
+        'p95_ms': percentile(0.95) * 1000,
+        'p99_ms': percentile(0.99) * 1000,
+        'min_ms': samples[0] * 1000,
+        'max_ms': samples[-1] * 1000
+    }
+
+def time_calls(function, arguments, repeats):
+    samples = []
+    for index in range(repeats):
+        args = arguments(index)
+        start = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def benchmark_functions(world, repeats, rng):
+    import mongodb_utils
+    import mysql_utils
+    import neoj4_utils
+    import recommend_utils
+    import search_utils
+    import snapshot_utils
+
+    keywords = [keyword['name'] for keyword in world.keywords]
+    universities = [institute['name'] for institute in world.institutes]
+    years = (world.size['first_year'], world.size['last_year'])
+    picks = [rng.choice(keywords) for _ in range(repeats)]
+    schools = [rng.choice(universities) for _ in range(repeats)]
+    spans = [sorted(rng.sample(range(years[0], years[1] + 1), 2)) for _ in range(repeats)]
+    favorites = [rng.sample(keywords, min(10, len(keywords))) for _ in range(repeats)]
+    changed = [[rng.choice(world.keywords)['id']] for _ in range(repeats)]
+    queries = [" ".join(rng.choice(world.publications)['title'].split()[:1 + index % 3]) for index in range(repeats)]
+
+    cases = [
+        ('neo4j', 'get_all_keywords', neoj4_utils.get_all_keywords, lambda index: ()),
+        ('neo4j', 'get_all_universities', neoj4_utils.get_all_universities, lambda index: ()),
+        ('neo4j', 'get_top_10_cited_research_paper_by_keyword', neoj4_utils.get_top_10_cited_research_paper_by_keyword, lambda index: (picks[index], )),
+        ('neo4j', 'get_top_10_faculty_by_keywords', neoj4_utils.get_top_10_faculty_by_keywords, lambda index: (picks[index], )),
+        ('neo4j', 'get_top_10_keywords_by_School', neoj4_utils.get_top_10_keywords_by_School, lambda index: (schools[index], )),
+        ('neo4j', 'get_keyword_details_records', neoj4_utils.get_keyword_details_records, lambda index: (picks[index], )),
+        ('neo4j', 'get_top_10_cited_research_paper_by_keyword_batch', neoj4_utils.get_top_10_cited_research_paper_by_keyword_batch, lambda index: (favorites[index], )),
+        ('neo4j', 'get_top_10_faculty_by_keyword_batch', neoj4_utils.get_top_10_faculty_by_keyword_batch, lambda index: (favorites[index], )),
+        ('mongodb', 'mongo_keyword_year_counts', mongodb_utils.mongo_keyword_year_counts, lambda index: years),
+        ('mongodb', 'refresh_keyword_cube', mongodb_utils.refresh_keyword_cube, lambda index: ()),
+        ('mongodb', 'mongo_get_top_10_keywords', mongodb_utils.mongo_get_top_10_keywords, lambda index: (spans[index][0], )),
+        ('mongodb', 'mongo_get_top_10_keywords_range', mongodb_utils.mongo_get_top_10_keywords_range, lambda index: spans[index]),
+        ('mysql', 'retrieve_all_keywords', mysql_utils.retrieve_all_keywords, lambda index: ()),
+        ('mysql', 'retrieve_all_favorite_keywords', mysql_utils.retrieve_all_favorite_keywords, lambda index: ('bench', )),
+        ('mysql', 'apply_favorite_keyword_changes', mysql_utils.apply_favorite_keyword_changes, lambda index: ('bench', favorites[index], favorites[index - 1])),
+        ('mysql', 'keyword_stats_records', mysql_utils.keyword_stats_records, lambda index: (favorites[index], )),
+        ('mysql', 'favorite_keywords_score', mysql_utils.favorite_keywords_score, lambda index: ('bench', )),
+        ('mysql', 'retrieve_keyword_neighbors', mysql_utils.retrieve_keyword_neighbors, lambda index: (favorites[index], )),
+        ('recommend', 'recommend_keywords', recommend_utils.recommend_keywords, lambda index: (favorites[index], )),
+        ('search', 'search_publications', search_utils.search_publications, lambda index: (queries[index], )),
+        ('recommend', 'refresh_keyword_neighbors[incremental]', recommend_utils.refresh_keyword_neighbors, lambda index: (changed[index], )),
+        ('snapshot', 'snapshot.get_keyword_details_records', snapshot_utils.get_keyword_details_records, lambda index: (picks[index], )),
+        ('snapshot', 'snapshot.get_top_10_keywords_by_School_records', snapshot_utils.get_top_10_keywords_by_School_records, lambda index: (schools[index], )),
+        ('snapshot', 'snapshot.mongo_get_top_10_keywords', snapshot_utils.mongo_get_top_10_keywords, lambda index: (spans[index][0], )),
+        ('snapshot', 'snapshot.mongo_get_top_10_keywords_range', snapshot_utils.mongo_get_top_10_keywords_range, lambda index: spans[index]),
+        ('snapshot', 'snapshot.keyword_stats_records', snapshot_utils.keyword_stats_records, lambda index: (favorites[index], )),
+    ]
+    return {name: {'store': store, **time_calls(function, arguments, repeats)} for store, name, function, arguments in cases}
+
+def benchmark_callbacks(world, repeats, rng):
+    from benchmarks.dash_client import post_callback
+    import app as dashboard
+
+    client = dashboard.app.server.test_client()
+    keywords = [keyword['name'] for keyword in world.keywords]
+    universities = [institute['name'] for institute in world.institutes]
+    first_year, last_year = world.size['first_year'], world.size['last_year']
+    table = []
+
+    def favorite_table(index):
+        return [{'keywords': keyword} for keyword in rng.sample(keywords, min(1 + index % 10, len(keywords)))]
+
+    ## A user deleting the first row of a favorites table
+    def favorite_deletion(index):
+        previous = favorite_table(index)
+        return {'favorite-keywords-table.data': previous[1:], 'favorite-keywords-table.data_previous': previous, 'favorites-session.data': 'bench'}
+
+    cases = {
+        'update_keyword_details': lambda index: ({'keyword-dropdown.value': rng.choice(keywords)}, None),
+        'update_krc_score': lambda index: ({'university.value': rng.choice(universities)}, None),
+        'update_keyword_plot': lambda index: ({'year-mode.value': 'year', 'year_slide.value': rng.randint(first_year, last_year),
+                                               'year_range.value': [first_year, last_year]}, ['year_slide.value']),
+        'update_keyword_plot[range]': lambda index: ({'year-mode.value': 'range', 'year_slide.value': first_year,
+                                                      'year_range.value': sorted(rng.sample(range(first_year, last_year + 1), 2))}, ['year_range.value']),
+        'update_favorite_keywords': lambda index: ({'add-favorite-button.n_clicks': index + 1, 'keyword-dropdown-all.value': rng.choice(keywords),
+                                                    'favorite-keywords-table.data': table, 'favorites-session.data': 'bench'}, ['add-favorite-button.n_clicks']),
+        'delete_favorite_keywords_update': lambda index: (favorite_deletion(index), None),
+        'update_favorite_keyword_histogram': lambda index: ({'favorite-keywords-table.data': favorite_table(index)}, None),
+        'update_favorite_keywords_comparison': lambda index: ({'favorite-keywords-table.data': favorite_table(index),
+                                                              'comparison-mode.value': ('papers', 'faculty')[index % 2]}, None),
+        'update_publication_search': lambda index: ({'publication-search.value': rng.choice(world.publications)['title'][:3 + index % 12]}, None),
+        'update_keyword_recommendations': lambda index: ({'favorite-keywords-table.data': favorite_table(index)}, None),
+        'update_search_options': lambda index: ({'keyword-dropdown.search_value': rng.choice(keywords)[:1 + index % 8],
+                                                 'keyword-dropdown.value': keywords[0]}, None),
+    }
+
+    results = {}
+    for label, arguments in cases.items():
+        name = label.split('[')[0]
+        samples = []
+        sizes = []
+        errors = 0
+        for index in range(repeats):
+            values, changed = arguments(index)
+            start = time.perf_counter()
+            status, size = post_callback(client, dashboard.app, name, values, changed)
+            samples.append(time.perf_counter() - start)
+            sizes.append(size)
+            errors += status not in (200, 204)
+        results[label] = {**summarize(samples), 'mean_response_bytes': statistics.fmean(sizes), 'errors': errors}
+    return results
+
+def run_child(size, repeats, seed, callbacks, snapshot):
+    from benchmarks import stores
+    import recommend_utils
+    import search_utils
+    import snapshot_utils
+
+    start = time.perf_counter()
+    world = generate(seed = seed, **size)
+    generated = time.perf_counter() - start
+    directory = stores.install(world)
+    try:
+        ## Export the stand-in stores to a columnar snapshot; the app serves from it with --snapshot
+        start = time.perf_counter()
+        path = os.path.join(directory, 'snapshot')
+        snapshot_utils.export_snapshot(path)
+        exported = time.perf_counter() - start
+        snapshot_utils._engine = snapshot_utils.SnapshotEngine(path)
+        ## Full keyword_neighbors build, as on first use of the recommender
+        start = time.perf_counter()
+        recommend_utils.refresh_keyword_neighbors()
+        neighbors_built = time.perf_counter() - start
+        start = time.perf_counter()
+        search_utils.build_publication_index()
+        search_built = time.perf_counter() - start
+        if snapshot:
+            snapshot_utils.snapshot_config['path'] = path
+        rng = random.Random(seed)
+        result = {'size': world.size, 'generate_s': generated, 'snapshot_export_s': exported, 'keyword_neighbors_build_s': neighbors_built, 'publication_index_build_s': search_built, 'functions': benchmark_functions(world, repeats, rng)}
+        if callbacks:
+            result['callbacks'] = benchmark_callbacks(world, repeats, rng)
+    finally:
+        stores.uninstall(directory)
+    return result
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Time every query function and Dash callback against synthetic local stores.")
+    parser.add_argument('--sizes', default = 'small,medium', help = f"comma separated sizes from {', '.join(SIZES)}")
+    parser.add_argument('--repeats', type = int, default = 20)
+    parser.add_argument('--seed', type = int, default = 411)
+    parser.add_argument('--cache', action = 'store_true', help = "leave the shared query cache on (off by default to time raw queries)")
+    parser.add_argument('--no-callbacks', action = 'store_true', help = "skip the end-to-end Dash callback timings")
+    parser.add_argument('--snapshot', action = 'store_true', help = "serve the Dash callbacks from the columnar snapshot instead of the stores")
+    parser.add_argument('--output', help = "write the JSON report here instead of stdout")
+    for field in default_size:
+        parser.add_argument(f"--{field.replace('_', '-')}", type = int, help = f"override {field} for every size")
+    parser.add_argument('--child', help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level = logging.WARNING, stream = sys.stderr)
+
+    if args.child:
+        ## The app prints to stdout, so the child hands its results back through a file
+        size, path = json.loads(args.child)
+        with open(path, 'w') as output:
+            json.dump(run_child(size, args.repeats, args.seed, not args.no_callbacks, args.snapshot), output)
+        return 0
+
+    overrides = {field: getattr(args, field) for field in default_size if getattr(args, field) is not None}
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeats': args.repeats,
+            'seed': args.seed,
+            'cache': args.cache,
+            'snapshot': args.snapshot
+        },
+        'results': []
+    }
+    ## Each size runs in a fresh process so module-level startup data and caches don't leak between sizes
+    for name in args.sizes.split(','):
+        size = {**SIZES[name], **overrides}
+        environment = dict(os.environ)
+        with tempfile.TemporaryDirectory() as directory:
+            if args.cache:
+                environment['KEYWORD_EXPLORE_CACHE'] = os.path.join(directory, 'cache.sqlite3')
+            else:
+                environment['KEYWORD_EXPLORE_CACHE_DISABLED'] = '1'
+            path = os.path.join(directory, 'result.json')
+            command = [sys.executable, '-m', 'benchmarks.run', '--child', json.dumps([size, path]), '--repeats', str(args.repeats), '--seed', str(args.seed)]
+            if args.no_callbacks:
+                command.append('--no-callbacks')
+            if args.snapshot:
+                command.append('--snapshot')
+            subprocess.run(command, env = environment, stdout = subprocess.DEVNULL, check = True)
+            with open(path) as result:
+                report['results'].append({'name': name, **json.load(result)})
+
+    text = json.dumps(report, indent = 2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
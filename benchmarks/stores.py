@@ -0,0 +1,388 @@
+import collections
+import heapq
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+
+## Local stand-ins for the three academicworld stores, built from a synthetic world.
+## They are installed underneath the real query modules, so the module code, caching,
+## result shaping and Dash callbacks run unchanged; only the database work is replaced.
+
+class FakeGraph:
+    ## Answers the Cypher issued by neoj4_utils with the same semantics, computed in Python
+    def __init__(self, world):
+        self.world = world
+        self.keyword_by_name = {keyword['name']: keyword for keyword in world.keywords}
+        self.keyword_name = {keyword['id']: keyword['name'] for keyword in world.keywords}
+        self.institute_by_name = collections.defaultdict(list)
+        for institute in world.institutes:
+            self.institute_by_name[institute['name']].append(institute)
+        self.institute_name = {institute['id']: institute['name'] for institute in world.institutes}
+        self.faculty = {faculty['id']: faculty for faculty in world.faculty}
+        self.keyword_publications = collections.defaultdict(list)
+        self.faculty_publications = collections.defaultdict(list)
+        self.institute_faculty = collections.defaultdict(list)
+        for faculty in world.faculty:
+            self.institute_faculty[faculty['institute_id']].append(faculty)
+        for publication in world.publications:
+            for keyword_id, score in publication['keywords']:
+                self.keyword_publications[keyword_id].append((publication, score))
+            for faculty_id in publication['faculty']:
+                self.faculty_publications[faculty_id].append(publication)
+        self.handlers = [
+            ("k.id AS id, k.name AS name", self.snapshot_keywords),
+            ("i.id AS id, i.name AS name", self.snapshot_institutes),
+            ("f.id AS id, f.name AS name", self.snapshot_faculty),
+            ("p.numCitations AS citations", self.snapshot_publications),
+            ("f.id AS faculty, i.id AS institute", self.snapshot_affiliations),
+            ("f.id AS faculty, p.id AS publication", self.snapshot_publishes),
+            ("k.id AS keyword, l.score AS score", self.snapshot_labels),
+            ("KRC_INDEX {name: 'krc'}) RETURN", self.krc_index),
+            ("KRC_INDEX {name: 'krc'}) DETACH DELETE", self.no_op),
+            ("krcInstitutes", self.no_op),
+            ("FACULTY_KRC|INSTITUTE_KRC", self.no_op),
+            ("CREATE (", self.no_op),
+            ("SET l.krcCitations", self.no_op),
+            ("MERGE (m:KRC_INDEX", self.no_op),
+            ("RETURN keyword, papers", self.batch_papers),
+            ("RETURN keyword, faculty", self.batch_faculty),
+            ("RETURN papers, faculty", self.keyword_details),
+            ("AS publication, SUM(", self.top_papers),
+            ("AS faculty, i.name AS school", self.top_faculty),
+            ("`krc score`", self.school_keywords),
+            ("MATCH (k:KEYWORD)", self.all_keywords),
+            ("COUNT(f) AS faculty", self.university_popularity),
+            ("MATCH (n:INSTITUTE)", self.all_universities),
+        ]
+
+    def close(self):
+        pass
+
+    def query_validation(self, query, db = None, parameters = None):
+        from concurrency_utils import Overloaded, run_query
+        from metrics_utils import read_only
+        for pattern, handler in self.handlers:
+            if pattern in query:
+                ## Same coalescing and admission as Neo4jConnect
+                key = (db, query, repr(sorted((parameters or {}).items()))) if read_only(query) else None
+                try:
+                    return run_query('neo4j', key, handler, parameters or {})
+                except Overloaded as error:
+                    logging.warning(f"Query shed: {error}")
+                    return None
+        logging.error(f"FakeGraph has no handler for query: {query.strip()[:80]}")
+        return None
+
+    @staticmethod
+    def top(scores, limit = 10):
+        return heapq.nlargest(limit, scores.items(), key = lambda item: item[1])
+
+    def krc_index(self, parameters):
+        return [{'refreshed': None}]
+
+    def no_op(self, parameters):
+        return []
+
+    def all_keywords(self, parameters):
+        return [{'name': name} for name in sorted(self.keyword_by_name)]
+
+    def all_universities(self, parameters):
+        return [{'name': name} for name in sorted(self.institute_by_name)]
+
+    def snapshot_keywords(self, parameters):
+        return [{'id': keyword['id'], 'name': keyword['name']} for keyword in self.world.keywords]
+
+    def snapshot_institutes(self, parameters):
+        return [{'id': institute['id'], 'name': institute['name']} for institute in self.world.institutes]
+
+    def snapshot_faculty(self, parameters):
+        return [{'id': faculty['id'], 'name': faculty['name']} for faculty in self.world.faculty]
+
+    def snapshot_publications(self, parameters):
+        return [{'id': publication['id'], 'title': publication['title'], 'year': publication['year'], 'citations': publication['numCitations']}
+                for publication in self.world.publications]
+
+    def snapshot_affiliations(self, parameters):
+        return [{'faculty': faculty['id'], 'institute': faculty['institute_id']} for faculty in self.world.faculty]
+
+    def snapshot_publishes(self, parameters):
+        return [{'faculty': faculty_id, 'publication': publication['id']} for publication in self.world.publications for faculty_id in publication['faculty']]
+
+    def snapshot_labels(self, parameters):
+        return [{'publication': publication['id'], 'keyword': keyword_id, 'score': score}
+                for publication in self.world.publications for keyword_id, score in publication['keywords']]
+
+    def university_popularity(self, parameters):
+        return [{'name': institute['name'], 'faculty': len(self.institute_faculty[institute['id']])} for institute in self.world.institutes]
+
+    def papers(self, keyword):
+        counts = collections.Counter()
+        keyword = self.keyword_by_name.get(keyword)
+        for publication, _ in self.keyword_publications[keyword['id']] if keyword else []:
+            if publication['faculty']:
+                counts[publication['title']] += publication['numCitations'] * len(publication['faculty'])
+        return [{'publication': title, 'count': count} for title, count in self.top(counts)]
+
+    def professors(self, keyword):
+        scores = collections.Counter()
+        keyword = self.keyword_by_name.get(keyword)
+        for publication, score in self.keyword_publications[keyword['id']] if keyword else []:
+            for faculty_id in publication['faculty']:
+                faculty = self.faculty[faculty_id]
+                scores[(faculty['name'], self.institute_name[faculty['institute_id']])] += score * publication['numCitations']
+        return [{'faculty': faculty, 'school': school, 'total_score': total} for (faculty, school), total in self.top(scores)]
+
+    def top_papers(self, parameters):
+        return self.papers(parameters['keyword'])
+
+    def top_faculty(self, parameters):
+        return self.professors(parameters['keyword'])
+
+    def keyword_details(self, parameters):
+        if parameters['keyword'] not in self.keyword_by_name:
+            return []
+        return [{'papers': self.papers(parameters['keyword']), 'faculty': self.professors(parameters['keyword'])}]
+
+    def batch_papers(self, parameters):
+        return [{'keyword': keyword, 'papers': self.papers(keyword)} for keyword in parameters['keywords'] if keyword in self.keyword_by_name]
+
+    def batch_faculty(self, parameters):
+        return [{'keyword': keyword, 'faculty': self.professors(keyword)} for keyword in parameters['keywords'] if keyword in self.keyword_by_name]
+
+    def school_keywords(self, parameters):
+        scores = collections.Counter()
+        for institute in self.institute_by_name.get(parameters['university'], []):
+            for faculty in self.institute_faculty[institute['id']]:
+                for publication in self.faculty_publications[faculty['id']]:
+                    for keyword_id, score in publication['keywords']:
+                        scores[self.keyword_name[keyword_id]] += score * publication['numCitations']
+        return [{'keyword': keyword, 'krc score': total} for keyword, total in self.top(scores)]
+
+class FakeCollection:
+    ## Minimal aggregation pipeline interpreter: $match, $unwind, $group ($sum), $sort, $limit
+    def __init__(self, documents):
+        self.documents = documents
+
+    @staticmethod
+    def field(document, path):
+        for part in path.split('.'):
+            document = document.get(part) if isinstance(document, dict) else None
+        return document
+
+    @classmethod
+    def expression(cls, document, expression):
+        if isinstance(expression, str) and expression.startswith('$'):
+            return cls.field(document, expression[1:])
+        if isinstance(expression, dict):
+            return {key: cls.expression(document, value) for key, value in expression.items()}
+        return expression
+
+    @classmethod
+    def matches(cls, document, condition):
+        for path, test in condition.items():
+            value = cls.field(document, path)
+            if not isinstance(test, dict):
+                test = {'$eq': test}
+            for operator, operand in test.items():
+                if value is None and operator != '$eq':
+                    return False
+                if operator == '$eq' and value != operand or operator == '$gte' and value < operand \
+                        or operator == '$lte' and value > operand or operator == '$gt' and value <= operand \
+                        or operator == '$lt' and value >= operand or operator == '$in' and value not in operand:
+                    return False
+        return True
+
+    def aggregate(self, pipeline):
+        documents = iter(self.documents)
+        for stage in pipeline:
+            (operator, argument), = stage.items()
+            if operator == '$match':
+                documents = [document for document in documents if self.matches(document, argument)]
+            elif operator == '$unwind':
+                path = argument[1:]
+                documents = [{**document, path: item} for document in documents for item in (self.field(document, path) or [])]
+            elif operator == '$group':
+                groups = {}
+                for document in documents:
+                    key = self.expression(document, argument['_id'])
+                    group_key = repr(key)
+                    group = groups.setdefault(group_key, {'_id': key, **{name: 0 for name in argument if name != '_id'}})
+                    for name, accumulator in argument.items():
+                        if name != '_id':
+                            group[name] += self.expression(document, accumulator['$sum']) or 0
+                documents = list(groups.values())
+            elif operator == '$sort':
+                for path, direction in reversed(list(argument.items())):
+                    documents = sorted(documents, key = lambda document: self.field(document, path), reverse = direction < 0)
+            elif operator == '$limit':
+                documents = list(documents)[:argument]
+            else:
+                raise NotImplementedError(f"FakeCollection does not support {operator}")
+        return iter(list(documents))
+
+class FakeMongoClient:
+    def __init__(self, world):
+        keyword_name = {keyword['id']: keyword['name'] for keyword in world.keywords}
+        publications = [{
+            'id': publication['id'],
+            'title': publication['title'],
+            'year': publication['year'],
+            'numCitations': publication['numCitations'],
+            'keywords': [{'name': keyword_name[keyword_id], 'score': score} for keyword_id, score in publication['keywords']]
+        } for publication in world.publications]
+        self.databases = {'academicworld': {'publications': FakeCollection(publications)}}
+
+    def __getitem__(self, name):
+        return self.databases[name]
+
+    def close(self):
+        pass
+
+class FakeCursor:
+    ## mysql.connector-style cursor over sqlite, translating the MySQL-only statements mysql_utils issues
+    VERSION_BUMP = re.compile(r"INSERT INTO favorite_keywords_version .* LAST_INSERT_ID", re.S)
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.lastrowid = None
+        self.rows = []
+
+    def execute(self, query, values = None):
+        values = tuple(values or ())
+        if self.VERSION_BUMP.search(query):
+            self.cursor.execute("INSERT INTO favorite_keywords_version (session_id, version) VALUES (?, 1) "
+                                "ON CONFLICT (session_id) DO UPDATE SET version = version + 1", values)
+            self.lastrowid = self.cursor.execute("SELECT version FROM favorite_keywords_version WHERE session_id = ?", values).fetchone()[0]
+            self.rows = []
+            return
+        query = query.replace('%s', '?').replace("ON DUPLICATE KEY UPDATE name = name", "ON CONFLICT DO NOTHING")
+        self.cursor.execute(query, values)
+        self.rows = self.cursor.fetchall()
+        self.lastrowid = self.cursor.lastrowid
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        self.cursor.close()
+
+class FakeSQLDatabase:
+    ## Drop-in for CS411SQLDatabase backed by a temporary sqlite file (one connection per thread)
+    path = None
+    local = threading.local()
+
+    def __init__(self, config):
+        self.config = config
+        self.connection = None
+        self.cursor = None
+
+    @classmethod
+    def connect(cls):
+        connection = getattr(cls.local, 'connection', None)
+        if connection is None or cls.local.path != cls.path:
+            connection = sqlite3.connect(cls.path, timeout = 30, check_same_thread = False)
+            cls.local.connection = connection
+            cls.local.path = cls.path
+        return connection
+
+    def __enter__(self):
+        self.connection = self.connect()
+        self.cursor = FakeCursor(self.connection)
+        return self
+
+    def __exit__(self, execution_type, execution_val, execution_tb):
+        self.cursor.close()
+        self.connection.rollback()
+
+    def query_execution(self, query, values = None):
+        try:
+            self.cursor.execute(query, values)
+            self.connection.commit()
+            return True
+        except sqlite3.Error as error:
+            logging.error(f"Query Invalid: {error}")
+            self.connection.rollback()
+            return False
+
+    def retrieve_data(self, query, values = None, prepared = True):
+        self.cursor.execute(query, values)
+        return self.cursor.fetchall()
+
+    def transaction_execution(self, statements):
+        try:
+            for query, values in statements:
+                self.cursor.execute(query, values)
+            self.connection.commit()
+            return True
+        except sqlite3.Error as error:
+            logging.error(f"Transaction Invalid: {error}")
+            self.connection.rollback()
+            return False
+
+def build_sql_database(world, path):
+    connection = sqlite3.connect(path)
+    connection.executescript('''
+        CREATE TABLE keyword (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+        CREATE INDEX idx_keyword_name ON keyword (name);
+        CREATE TABLE publication (id INTEGER PRIMARY KEY, title TEXT, year INTEGER, num_citations INTEGER);
+        CREATE TABLE publication_keyword (publication_id INTEGER, keyword_id INTEGER, score REAL, PRIMARY KEY (publication_id, keyword_id));
+        CREATE INDEX idx_publication_keyword_keyword ON publication_keyword (keyword_id, publication_id);
+        CREATE TABLE favorite_keywords (session_id TEXT NOT NULL DEFAULT '', name TEXT NOT NULL, PRIMARY KEY (session_id, name));
+        CREATE TABLE favorite_keywords_version (session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE keyword_stats (keyword_id INTEGER PRIMARY KEY, name TEXT NOT NULL, publication_count INTEGER NOT NULL DEFAULT 0, krc REAL NOT NULL DEFAULT 0);
+        CREATE INDEX idx_keyword_stats_name ON keyword_stats (name);
+        CREATE TABLE keyword_neighbors (keyword_id INTEGER NOT NULL, neighbor_id INTEGER NOT NULL, similarity REAL NOT NULL, PRIMARY KEY (keyword_id, neighbor_id));
+        CREATE INDEX idx_keyword_neighbors_neighbor ON keyword_neighbors (neighbor_id);
+    ''')
+    connection.executemany("INSERT INTO keyword (id, name) VALUES (?, ?)", [(keyword['id'], keyword['name']) for keyword in world.keywords])
+    connection.executemany("INSERT INTO publication (id, title, year, num_citations) VALUES (?, ?, ?, ?)",
+                           [(publication['id'], publication['title'], publication['year'], publication['numCitations']) for publication in world.publications])
+    connection.executemany("INSERT INTO publication_keyword (publication_id, keyword_id, score) VALUES (?, ?, ?)",
+                           [(publication['id'], keyword_id, score) for publication in world.publications for keyword_id, score in publication['keywords']])
+    connection.execute("INSERT INTO keyword_stats (keyword_id, name, publication_count, krc) "
+                       "SELECT keyword.id, keyword.name, COUNT(publication.id), COALESCE(SUM(publication_keyword.score * publication.num_citations), 0) "
+                       "FROM keyword LEFT JOIN publication_keyword ON publication_keyword.keyword_id = keyword.id "
+                       "LEFT JOIN publication ON publication.id = publication_keyword.publication_id GROUP BY keyword.id, keyword.name")
+    connection.commit()
+    connection.close()
+
+## Point mysql_utils, mongodb_utils and neoj4_utils at stand-ins built from the world.
+## Returns the temporary directory holding the sqlite file; call uninstall() when done.
+def install(world):
+    import mongodb_utils
+    import mysql_utils
+    import neoj4_utils
+
+    directory = tempfile.mkdtemp(prefix = 'keyword_explore_bench_')
+    FakeSQLDatabase.path = os.path.join(directory, 'academicworld.sqlite3')
+    build_sql_database(world, FakeSQLDatabase.path)
+
+    mysql_utils.CS411SQLDatabase = FakeSQLDatabase
+    mysql_utils._favorite_keywords_table_exists = True
+    mysql_utils._keyword_stats_table_exists = True
+    mysql_utils._keyword_neighbors_table_exists = True
+    _clients['neo4j'] = FakeGraph(world)
+    _clients['mongodb'] = FakeMongoClient(world)
+    attach()
+    neoj4_utils._krc_index_ready = True
+    mongodb_utils.refresh_keyword_cube()
+    return directory
+
+_clients = {}
+
+## Point the Neo4j and MongoDB modules at the installed stand-ins. Call it again after anything that
+## drops their clients, e.g. serving_utils.after_fork() in a forked worker.
+def attach():
+    import mongodb_utils
+    import neoj4_utils
+    neoj4_utils._connection = _clients['neo4j']
+    mongodb_utils._mongodb_client = _clients['mongodb']
+
+def uninstall(directory):
+    import shutil
+    shutil.rmtree(directory, ignore_errors = True)
@@ -0,0 +1,64 @@
+import random
+
+## Synthetic academicworld generator. Sizes are configurable so the same benchmark can be
+## run across data scales; the same seed always produces the same world.
+default_size = {
+    'keywords': 500,
+    'institutes': 50,
+    'faculty': 1000,
+    'publications': 20000,
+    'first_year': 1982,
+    'last_year': 2023,
+    'keywords_per_publication': 4,
+    'faculty_per_publication': 2
+}
+
+WORDS = ["learning", "network", "graph", "data", "system", "quantum", "robot", "vision", "language",
+         "security", "privacy", "database", "compiler", "cloud", "energy", "signal", "neural", "optimization",
+         "distributed", "embedded", "wireless", "genome", "protein", "circuit", "software", "model"]
+
+class AcademicWorld:
+    def __init__(self, keywords, institutes, faculty, publications, size):
+        ## keywords: [{'id', 'name'}], institutes: [{'id', 'name'}]
+        ## faculty: [{'id', 'name', 'institute_id'}]
+        ## publications: [{'id', 'title', 'year', 'numCitations', 'keywords': [(keyword_id, score)], 'faculty': [faculty_id]}]
+        self.keywords = keywords
+        self.institutes = institutes
+        self.faculty = faculty
+        self.publications = publications
+        self.size = size
+
+def generate(seed = 411, **size):
+    size = {**default_size, **size}
+    rng = random.Random(seed)
+
+    keywords = []
+    seen = set()
+    while len(keywords) < size['keywords']:
+        name = " ".join(rng.sample(WORDS, rng.randint(1, 3)))
+        if name not in seen:
+            seen.add(name)
+            keywords.append({'id': len(keywords) + 1, 'name': name})
+
+    institutes = [{'id': index + 1, 'name': f"University {index + 1}"} for index in range(size['institutes'])]
+    faculty = [{'id': index + 1, 'name': f"Professor {index + 1}", 'institute_id': rng.randint(1, size['institutes'])}
+               for index in range(size['faculty'])]
+
+    ## Zipf-like keyword popularity so top-k results look like the real data
+    weights = [1.0 / (rank + 1) for rank in range(size['keywords'])]
+    publications = []
+    for index in range(size['publications']):
+        chosen = set()
+        while len(chosen) < min(size['keywords_per_publication'], size['keywords']):
+            chosen.add(rng.choices(range(size['keywords']), weights = weights)[0] + 1)
+        authors = rng.sample(range(1, size['faculty'] + 1), min(size['faculty_per_publication'], size['faculty']))
+        publications.append({
+            'id': index + 1,
+            'title': f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(WORDS)} {index + 1}",
+            'year': rng.randint(size['first_year'], size['last_year']),
+            'numCitations': int(rng.paretovariate(1.2)) - 1,
+            'keywords': [(keyword_id, round(rng.random(), 4)) for keyword_id in sorted(chosen)],
+            'faculty': authors
+        })
+
+    return AcademicWorld(keywords, institutes, faculty, publications, size)
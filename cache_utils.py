@@ -0,0 +1,263 @@
+import functools
+import logging
+import os
+import pickle
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+
+## Query-result cache shared by every Dash worker process through one SQLite file.
+## Entries expire after their TTL and the least recently used ones are evicted past maxsize.
+## A hit is a single read: its LRU touch and the hit/miss counters are kept in process and written
+## in one batch at most every flush_interval seconds. Invalidation bumps the namespace's generation
+## instead of racing deletes against in-flight sets; an entry only hits while its generation is current.
+## None is never cached, so query functions report failures (shed or failed queries) as None.
+## Values are pickled, so the file lives in a directory private to this user by default
+## (KEYWORD_EXPLORE_CACHE overrides it) and a file anyone else could write to is refused.
+cache_config = {
+    'path': os.environ.get('KEYWORD_EXPLORE_CACHE', os.path.join(tempfile.gettempdir(), f"keyword_explore-{os.getuid()}", 'cache.sqlite3')),
+    'maxsize': 2048,
+    'ttl': 600,
+    'flush_interval': 5,
+    'enabled': os.environ.get('KEYWORD_EXPLORE_CACHE_DISABLED') is None
+}
+
+## Raise sqlite3.DatabaseError unless the cache file can only have been written by this user: its
+## directory (created 0700 when missing) belongs to this user or root and others can't replace files
+## in it, and the file and its WAL sidecars belong to this user and aren't writable by anyone else
+def check_private(path):
+    uid = os.getuid()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode = 0o700, exist_ok = True)
+    status = os.stat(directory)
+    if status.st_uid not in (uid, 0) or (status.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not status.st_mode & stat.S_ISVTX):
+        raise sqlite3.DatabaseError(f"Refusing cache directory {directory}: other users can write to it")
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    os.close(descriptor)
+    for name in (path, path + '-wal', path + '-shm'):
+        try:
+            status = os.lstat(name)
+        except FileNotFoundError:
+            continue
+        if status.st_uid != uid or not stat.S_ISREG(status.st_mode) or status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise sqlite3.DatabaseError(f"Refusing cache file {name}: not a regular file owned and only writable by this user")
+
+class QueryCache:
+    def __init__(self, path, maxsize = 2048, flush_interval = 5):
+        self.path = path
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.__local = threading.local()
+        self.__pending_lock = threading.Lock()
+        self.__touched = {}
+        self.__counts = {}
+        self.__flushed = time.monotonic()
+        ## Set, with the reason, once the file is found unsafe to open; the cache then stays off
+        self.refused = None
+
+    def __connection(self):
+        ## sqlite connections can't cross threads or forks, so keep one per thread and process
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None or self.__local.pid != os.getpid():
+            if self.refused is not None:
+                raise sqlite3.DatabaseError(self.refused)
+            try:
+                check_private(self.path)
+            except (OSError, sqlite3.DatabaseError) as error:
+                self.refused = str(error)
+                logging.error(f"Query cache disabled: {error}")
+                raise sqlite3.DatabaseError(self.refused)
+            connection = sqlite3.connect(self.path, timeout = 5, isolation_level = None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            ## A cache file from before generations existed is simply dropped
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(cache)").fetchall()]
+            if columns and 'generation' not in columns:
+                connection.execute("DROP TABLE cache")
+            connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, namespace TEXT NOT NULL, generation INTEGER NOT NULL, "
+                               "value BLOB NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_cache_namespace ON cache (namespace)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed)")
+            connection.execute("CREATE TABLE IF NOT EXISTS generations (namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS stats (namespace TEXT PRIMARY KEY, hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0)")
+            self.__local.connection = connection
+            self.__local.pid = os.getpid()
+        return connection
+
+    def __record(self, namespace, key, hit, now):
+        with self.__pending_lock:
+            counts = self.__counts.setdefault(namespace, [0, 0])
+            counts[0 if hit else 1] += 1
+            if hit:
+                self.__touched[key] = now
+            due = time.monotonic() - self.__flushed >= self.flush_interval
+        if due:
+            self.flush()
+
+    ## In a forked child: fresh pending lock, and the parent's unflushed counters stay with the parent
+    def reset_pending(self):
+        self.__pending_lock = threading.Lock()
+        self.__touched, self.__counts = {}, {}
+
+    ## Write the batched LRU touches and hit/miss counters
+    def flush(self):
+        with self.__pending_lock:
+            touched, counts = self.__touched, self.__counts
+            self.__touched, self.__counts = {}, {}
+            self.__flushed = time.monotonic()
+        if not touched and not counts:
+            return
+        connection = self.__connection()
+        connection.execute("BEGIN")
+        try:
+            connection.executemany("UPDATE cache SET accessed = MAX(accessed, ?) WHERE key = ?", [(now, key) for key, now in touched.items()])
+            connection.executemany("INSERT INTO stats (namespace, hits, misses) VALUES (?, ?, ?) "
+                                   "ON CONFLICT (namespace) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+                                   [(namespace, hits, misses) for namespace, (hits, misses) in counts.items()])
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+
+    ## (hit, value, generation): generation is the namespace's current one, to pass to set() on a miss
+    def get(self, namespace, key):
+        connection = self.__connection()
+        now = time.time()
+        generation, value = connection.execute(
+            "SELECT current.generation, cache.value FROM "
+            "(SELECT COALESCE((SELECT generation FROM generations WHERE namespace = ?), 0) AS generation) AS current "
+            "LEFT JOIN cache ON cache.key = ? AND cache.generation = current.generation AND cache.expires > ?",
+            (namespace, key, now)).fetchone()
+        self.__record(namespace, key, value is not None, now)
+        if value is None:
+            return False, None, generation
+        return True, pickle.loads(value), generation
+
+    ## Store a value computed under generation; a set from before an invalidation never hits, and
+    ## never replaces an entry from a later generation
+    def set(self, namespace, key, value, ttl, generation = 0):
+        connection = self.__connection()
+        now = time.time()
+        connection.execute("INSERT INTO cache (key, namespace, generation, value, expires, accessed) VALUES (?, ?, ?, ?, ?, ?) "
+                           "ON CONFLICT (key) DO UPDATE SET generation = excluded.generation, value = excluded.value, "
+                           "expires = excluded.expires, accessed = excluded.accessed WHERE excluded.generation >= cache.generation",
+                           (key, namespace, generation, pickle.dumps(value, protocol = pickle.HIGHEST_PROTOCOL), now + ttl, now))
+        connection.execute("DELETE FROM cache WHERE expires <= ?", (now, ))
+        excess = connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.maxsize
+        if excess > 0:
+            connection.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)", (excess, ))
+
+    def invalidate(self, namespace):
+        connection = self.__connection()
+        connection.execute("INSERT INTO generations (namespace, generation) VALUES (?, 1) "
+                           "ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1", (namespace, ))
+        ## Entries of older generations can no longer hit; drop them now rather than at eviction
+        connection.execute("DELETE FROM cache WHERE namespace = ? AND generation < (SELECT generation FROM generations WHERE namespace = ?)",
+                           (namespace, namespace))
+
+    def clear(self):
+        connection = self.__connection()
+        with self.__pending_lock:
+            self.__touched, self.__counts = {}, {}
+        connection.execute("DELETE FROM cache")
+        connection.execute("DELETE FROM stats")
+
+    def stats(self):
+        self.flush()
+        connection = self.__connection()
+        entries = dict(connection.execute("SELECT namespace, COUNT(*) FROM cache GROUP BY namespace").fetchall())
+        counters = connection.execute("SELECT namespace, hits, misses FROM stats").fetchall()
+        namespaces = {namespace: {'hits': hits, 'misses': misses, 'entries': entries.get(namespace, 0)} for namespace, hits, misses in counters}
+        hits = sum(namespace['hits'] for namespace in namespaces.values())
+        misses = sum(namespace['misses'] for namespace in namespaces.values())
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': sum(entries.values()),
+            'namespaces': namespaces
+        }
+
+query_cache = QueryCache(cache_config['path'], cache_config['maxsize'], cache_config['flush_interval'])
+
+def reset_locks():
+    query_cache.reset_pending()
+
+## Decorator: cache a query function's result under a namespace that writes can invalidate
+def cached(namespace, ttl = None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not cache_config['enabled'] or query_cache.refused is not None:
+                return function(*args, **kwargs)
+            key = f"{namespace}:{function.__module__}.{function.__qualname__}:{args!r}:{sorted(kwargs.items())!r}"
+            generation = None
+            try:
+                hit, value, generation = query_cache.get(namespace, key)
+                if hit:
+                    return value
+            except (sqlite3.Error, pickle.PickleError, EOFError) as error:
+                logging.warning(f"Cache read failed: {error}")
+            value = function(*args, **kwargs)
+            ## None means the query failed or was shed; the generation read before the query keeps a
+            ## result that raced an invalidation from ever hitting
+            if value is not None and generation is not None:
+                try:
+                    query_cache.set(namespace, key, value, cache_config['ttl'] if ttl is None else ttl, generation)
+                except (sqlite3.Error, pickle.PickleError) as error:
+                    logging.warning(f"Cache write failed: {error}")
+            return value
+        return wrapper
+    return decorator
+
+## Decorator for functions taking a list of keys and returning {key: value}: each key is cached
+## on its own, so only the keys missing from the cache are passed through to the function. Only keys
+## present in the function's result are cached; absent ones come back as None and are asked again.
+def cached_batch(namespace, ttl = None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(keys):
+            keys = list(dict.fromkeys(keys))
+            if not cache_config['enabled'] or query_cache.refused is not None:
+                return function(keys)
+            prefix = f"{namespace}:{function.__module__}.{function.__qualname__}"
+            results = {}
+            missing = []
+            generation = None
+            for key in keys:
+                try:
+                    hit, value, current = query_cache.get(namespace, f"{prefix}:{key!r}")
+                    generation = current if generation is None else min(generation, current)
+                except (sqlite3.Error, pickle.PickleError, EOFError) as error:
+                    logging.warning(f"Cache read failed: {error}")
+                    hit, value = False, None
+                if hit:
+                    results[key] = value
+                else:
+                    missing.append(key)
+            if missing:
+                fetched = function(missing)
+                if fetched is None:
+                    return None
+                for key in missing:
+                    results[key] = fetched.get(key)
+                    if key not in fetched or generation is None:
+                        continue
+                    try:
+                        query_cache.set(namespace, f"{prefix}:{key!r}", results[key], cache_config['ttl'] if ttl is None else ttl, generation)
+                    except (sqlite3.Error, pickle.PickleError) as error:
+                        logging.warning(f"Cache write failed: {error}")
+            return {key: results[key] for key in keys}
+        return wrapper
+    return decorator
+
+def invalidate(namespace):
+    try:
+        query_cache.invalidate(namespace)
+    except sqlite3.Error as error:
+        logging.warning(f"Cache invalidation failed: {error}")
+
+def cache_stats():
+    return query_cache.stats()
@@ -0,0 +1,206 @@
+import collections
+import copy
+import functools
+import logging
+import threading
+import time
+
+## Concurrency layer in front of the stores. Identical queries in flight at the same time are
+## coalesced (single flight): the first caller runs the query and every later caller waits for and
+## shares its result. Each store also has an admission limit: at most 'limits' queries run at once,
+## up to 'queue' more wait for a slot in arrival order, and a waiter gives up after 'deadline'
+## seconds. Callers beyond the queue or past the deadline get Overloaded right away, so a burst of
+## page loads queues briefly or is shed instead of piling concurrent traversals onto the database.
+## A caller sharing another's result waits no longer than the same deadline. MySQL has no gate:
+## its connection pool already bounds it, and raises Overloaded when no connection frees up in
+## time. Limits are per worker process.
+concurrency_config = {
+    'coalesce': True,
+    'limits': {'neo4j': 8, 'mongodb': 4},
+    'queue': {'neo4j': 64, 'mongodb': 32},
+    'deadline': {'neo4j': 5, 'mongodb': 10, 'mysql': 10}
+}
+
+class Overloaded(Exception):
+    pass
+
+class Admission:
+    def __init__(self, store, limit, queue, deadline):
+        self.store = store
+        self.limit = limit
+        self.queue = queue
+        self.deadline = deadline
+        self.__condition = threading.Condition()
+        self.__waiters = collections.deque()
+        self.__active = 0
+        self.__admitted = 0
+        self.__rejected = 0
+        self.__timed_out = 0
+        self.__wait_max = 0.0
+
+    def acquire(self, deadline = None):
+        start = time.monotonic()
+        with self.__condition:
+            if self.__active >= self.limit and len(self.__waiters) >= self.queue:
+                self.__rejected += 1
+                raise Overloaded(f"{self.store}: {self.__active} queries running and {len(self.__waiters)} queued")
+            ## Waiters are admitted in arrival order
+            ticket = object()
+            self.__waiters.append(ticket)
+            expires = start + (self.deadline if deadline is None else deadline)
+            try:
+                while self.__waiters[0] is not ticket or self.__active >= self.limit:
+                    remaining = expires - time.monotonic()
+                    if remaining <= 0:
+                        self.__timed_out += 1
+                        raise Overloaded(f"{self.store}: no query slot within {expires - start:.1f}s")
+                    self.__condition.wait(remaining)
+            finally:
+                self.__waiters.remove(ticket)
+                self.__condition.notify_all()
+            self.__active += 1
+            self.__admitted += 1
+            self.__wait_max = max(self.__wait_max, time.monotonic() - start)
+
+    def release(self):
+        with self.__condition:
+            self.__active -= 1
+            self.__condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, execution_type, execution_val, execution_tb):
+        self.release()
+
+    def stats(self):
+        with self.__condition:
+            return {
+                'limit': self.limit,
+                'queue': self.queue,
+                'active': self.__active,
+                'waiting': len(self.__waiters),
+                'admitted': self.__admitted,
+                'rejected': self.__rejected,
+                'timed_out': self.__timed_out,
+                'wait_max': self.__wait_max
+            }
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+class SingleFlight:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__flights = {}
+        self.__leaders = 0
+        self.__followers = 0
+        self.__timed_out = 0
+
+    ## Run function() once per key at a time; concurrent callers with the same key share the outcome,
+    ## waiting at most timeout seconds for it
+    def run(self, key, function, timeout = None):
+        with self.__lock:
+            flight = self.__flights.get(key)
+            if flight is None:
+                flight = self.__flights[key] = _Flight()
+                self.__leaders += 1
+                leader = True
+            else:
+                flight.followers += 1
+                self.__followers += 1
+                leader = False
+        if not leader:
+            if not flight.done.wait(timeout):
+                with self.__lock:
+                    self.__timed_out += 1
+                raise Overloaded(f"{key[0] if isinstance(key, tuple) else key}: shared query not done within {timeout:.1f}s")
+            if flight.error is not None:
+                raise flight.error
+            ## Followers get their own deep copy, rows included, so no caller can mutate another's result
+            return copy.deepcopy(flight.result)
+        try:
+            flight.result = function()
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self.__lock:
+            return {'executed': self.__leaders, 'coalesced': self.__followers, 'timed_out': self.__timed_out, 'in_flight': len(self.__flights)}
+
+_admissions = {}
+_admissions_lock = threading.Lock()
+_flights = SingleFlight()
+
+def admission(store):
+    with _admissions_lock:
+        gate = _admissions.get(store)
+        if gate is None:
+            gate = _admissions[store] = Admission(store, concurrency_config['limits'][store],
+                                                  concurrency_config['queue'][store], concurrency_config['deadline'][store])
+        return gate
+
+## Run function(*args) under the store's admission limit, coalesced with identical in-flight calls
+## when a key is given (read-only queries only). Only the caller that executes takes a slot; the ones
+## sharing its result don't.
+def run_query(store, key, function, *args):
+    if key is None or not concurrency_config['coalesce']:
+        with admission(store):
+            return function(*args)
+    def admitted():
+        with admission(store):
+            return function(*args)
+    return _flights.run((store, key), admitted, concurrency_config['deadline'][store])
+
+## Decorator: coalesce concurrent calls with equal arguments into one execution. For read-only
+## functions that open their own store connection, so callers sharing a result never take a
+## connection. A caller whose shared result is not ready within the deadline gets None, as a failed
+## lookup does, which @cached never stores.
+def coalesced(store):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not concurrency_config['coalesce']:
+                return function(*args, **kwargs)
+            key = f"{function.__module__}.{function.__qualname__}:{args!r}:{sorted(kwargs.items())!r}"
+            try:
+                return _flights.run((store, key), lambda: function(*args, **kwargs), concurrency_config['deadline'][store])
+            except Overloaded as error:
+                logging.warning(f"Query shed: {error}")
+                return None
+        return wrapper
+    return decorator
+
+## Decorator: report a shed query as None, as a failed one is, so the callback degrades instead of failing
+def shed(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        except Overloaded as error:
+            logging.warning(f"Query shed: {error}")
+            return None
+    return wrapper
+
+def concurrency_stats():
+    with _admissions_lock:
+        gates = dict(_admissions)
+    return {'stores': {store: gate.stats() for store, gate in gates.items()}, 'single_flight': _flights.stats()}
+
+## In a forked child: queries in flight in the parent never finish here, so start with empty state
+def reset_concurrency():
+    global _admissions, _admissions_lock, _flights
+    _admissions = {}
+    _admissions_lock = threading.Lock()
+    _flights = SingleFlight()
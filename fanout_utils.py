@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+## Thread pool used to issue independent Neo4j, MongoDB and MySQL requests in parallel.
+## The drivers release the GIL while waiting on the network, so threads are enough here.
+fanout_config = {
+    'max_workers': 8,
+    'timeout': 60
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_timings = []
+_timings_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers = fanout_config['max_workers'], thread_name_prefix = 'fanout')
+        return _executor
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait = False)
+        _executor = None
+
+## In a forked child: the parent's worker threads don't exist here, so start a fresh pool on next use
+def reset_executor():
+    global _executor, _executor_lock, _timings_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+    _timings_lock = threading.Lock()
+
+def _timed(function, args):
+    start = time.perf_counter()
+    try:
+        return function(*args), None, time.perf_counter() - start
+    except Exception as error:
+        return None, error, time.perf_counter() - start
+
+## Run {name: (store, function, *args)} concurrently and return {name: result}.
+## Wall time is bounded by the slowest call; per-call and per-store timings are logged and kept.
+def fan_out(calls, timeout = None, raise_errors = True):
+    start = time.perf_counter()
+    executor = get_executor()
+    futures = {name: executor.submit(_timed, call[1], call[2:]) for name, call in calls.items()}
+    done, _ = wait(futures.values(), timeout = fanout_config['timeout'] if timeout is None else timeout)
+
+    results = {}
+    timings = []
+    first_error = None
+    for name, future in futures.items():
+        store = calls[name][0]
+        if future in done:
+            result, error, seconds = future.result()
+        else:
+            result, error, seconds = None, TimeoutError(f"{name} did not finish in time"), None
+        if error is not None:
+            logging.error(f"Fan-out call {name} ({store}) failed: {error}")
+            first_error = first_error or error
+        results[name] = result
+        timings.append({'name': name, 'store': store, 'seconds': seconds, 'ok': error is None})
+
+    wall = time.perf_counter() - start
+    per_store = {}
+    for timing in timings:
+        if timing['seconds'] is not None:
+            per_store[timing['store']] = max(per_store.get(timing['store'], 0.0), timing['seconds'])
+    logging.info(f"Fan-out of {len(calls)} calls took {wall:.3f}s; slowest per store: "
+                 + ", ".join(f"{store} {seconds:.3f}s" for store, seconds in sorted(per_store.items())))
+    with _timings_lock:
+        _timings.append({'wall': wall, 'calls': timings})
+        del _timings[:-20]
+
+    if raise_errors and first_error is not None:
+        raise first_error
+    return results
+
+## Timings of the most recent fan-outs, newest last
+def fanout_timings():
+    with _timings_lock:
+        return list(_timings)
@@ -0,0 +1,129 @@
+import collections
+import os
+import threading
+import time
+
+from mysql_utils import retrieve_favorite_keywords_snapshot, retrieve_favorite_keywords_version, apply_favorite_keyword_changes
+
+## Favorites are shared (session '') unless per-session favorites are turned on, in which case each
+## browser tab gets its own list and sessions not changed for session_ttl_days are purged by
+## `python favorites_utils.py purge`. The mirror of each session is bounded LRU and re-validated
+## against MySQL's version counter at most every version_check_interval seconds.
+favorites_config = {
+    'per_session': os.environ.get('KEYWORD_EXPLORE_PER_SESSION_FAVORITES') is not None,
+    'session_ttl_days': 30,
+    'max_sessions': 1024,
+    'version_check_interval': 2
+}
+
+class FavoriteKeywordsMirror:
+    def __init__(self, session_id, version, keywords):
+        self.session_id = session_id
+        self.version = version
+        self.keywords = list(keywords)
+        self.checked = time.monotonic()
+        self.lock = threading.Lock()
+
+    ## A read that was shed or failed (None) keeps the current keywords until the next check
+    def reload(self):
+        snapshot = retrieve_favorite_keywords_snapshot(self.session_id)
+        if snapshot is not None:
+            self.version, self.keywords = snapshot
+        self.checked = time.monotonic()
+
+    def revalidate(self, interval):
+        if time.monotonic() - self.checked < interval:
+            return
+        version = retrieve_favorite_keywords_version(self.session_id)
+        if version is not None and version != self.version:
+            self.reload()
+        self.checked = time.monotonic()
+
+class FavoritesService:
+    def __init__(self, max_sessions = 1024, version_check_interval = 2):
+        self.max_sessions = max_sessions
+        self.version_check_interval = version_check_interval
+        self.__mirrors = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def reset_locks(self):
+        self.__lock = threading.Lock()
+        for mirror in self.__mirrors.values():
+            mirror.lock = threading.Lock()
+
+    def __mirror(self, session_id):
+        with self.__lock:
+            mirror = self.__mirrors.get(session_id)
+            if mirror is not None:
+                self.__mirrors.move_to_end(session_id)
+                return mirror
+        snapshot = retrieve_favorite_keywords_snapshot(session_id)
+        if snapshot is None:
+            ## Not kept, so the next call reads the session again
+            return FavoriteKeywordsMirror(session_id, None, [])
+        version, keywords = snapshot
+        with self.__lock:
+            mirror = self.__mirrors.setdefault(session_id, FavoriteKeywordsMirror(session_id, version, keywords))
+            self.__mirrors.move_to_end(session_id)
+            while len(self.__mirrors) > self.max_sessions:
+                self.__mirrors.popitem(last = False)
+        return mirror
+
+    def __apply(self, mirror, inserts, deletes):
+        if not inserts and not deletes:
+            return True
+        version = apply_favorite_keyword_changes(mirror.session_id, inserts, deletes)
+        if version is None:
+            ## The write failed, so the mirror may no longer match MySQL
+            mirror.reload()
+            return False
+        removed = set(deletes)
+        mirror.keywords = [keyword for keyword in mirror.keywords if keyword not in removed]
+        mirror.keywords += [keyword for keyword in inserts if keyword not in mirror.keywords]
+        mirror.version = version
+        mirror.checked = time.monotonic()
+        return True
+
+    def keywords(self, session_id):
+        mirror = self.__mirror(session_id)
+        with mirror.lock:
+            mirror.revalidate(self.version_check_interval)
+            return list(mirror.keywords)
+
+    def version(self, session_id):
+        mirror = self.__mirror(session_id)
+        with mirror.lock:
+            mirror.revalidate(self.version_check_interval)
+            return mirror.version
+
+    def add(self, session_id, keywords):
+        mirror = self.__mirror(session_id)
+        with mirror.lock:
+            inserts = [keyword for keyword in dict.fromkeys(keywords) if keyword and keyword not in mirror.keywords]
+            self.__apply(mirror, inserts, [])
+            return list(mirror.keywords)
+
+    def remove(self, session_id, keywords):
+        mirror = self.__mirror(session_id)
+        with mirror.lock:
+            deletes = [keyword for keyword in dict.fromkeys(keywords) if keyword in mirror.keywords]
+            self.__apply(mirror, [], deletes)
+            return list(mirror.keywords)
+
+favorites_service = FavoritesService(favorites_config['max_sessions'], favorites_config['version_check_interval'])
+
+## In a forked child: locks another thread held at fork time would stay held forever
+def reset_locks():
+    favorites_service.reset_locks()
+
+if __name__ == '__main__':
+    ## Purge command: python favorites_utils.py purge [days] (defaults to session_ttl_days)
+    import sys
+    if sys.argv[1:2] == ['purge']:
+        from mysql_utils import close_pools, purge_abandoned_favorites
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else favorites_config['session_ttl_days']
+        purged = purge_abandoned_favorites(days)
+        print(f"Purged {purged} abandoned favorites session(s)" if purged is not None else "Purge failed")
+        close_pools()
+    else:
+        print("Usage: python favorites_utils.py purge [days]")
@@ -0,0 +1,91 @@
+import copy
+import functools
+
+## Plain-dict figures for the dashboard graphs. Each graph starts from a cached base figure
+## (layout, template and one trace skeleton) placed in the page layout once; callbacks then send
+## a dash.Patch holding only the trace data and title, instead of a Plotly Express figure
+## rebuilt from a DataFrame and serialized in full on every update.
+figure_config = {
+    ## Largest marker diameter in px on the keyword dot plot (as px.scatter's size_max)
+    'size_max': 20
+}
+
+PALETTE = ['#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A', '#19D3F3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52']
+PIE_COLORS = ['pink', 'red', 'orange', 'yellow', 'green', 'blue', 'purple', 'teal', 'brown', 'grey']
+
+@functools.lru_cache(maxsize = None)
+def _template():
+    import plotly.io as pio
+    return pio.templates['plotly'].to_plotly_json()
+
+@functools.lru_cache(maxsize = None)
+def _base_figure(kind):
+    if kind == 'keyword_dot_plot':
+        trace = {'type': 'scatter', 'mode': 'markers', 'x': [], 'y': [], 'showlegend': False,
+                 'marker': {'size': [], 'sizemode': 'area', 'sizeref': 1, 'color': [], 'symbol': 'circle'},
+                 'hovertemplate': 'keyword=%{x}<br>publication count=%{y}<extra></extra>'}
+        layout = {'template': _template(), 'xaxis': {'title': {'text': 'keyword'}}, 'yaxis': {'title': {'text': 'publication count'}}}
+    elif kind == 'favorite_histogram':
+        trace = {'type': 'bar', 'x': [], 'y': [], 'showlegend': False,
+                 'marker': {'color': [], 'colorscale': 'Plasma', 'colorbar': {'title': {'text': 'Publication Count'}}},
+                 'hovertemplate': 'Keyword=%{x}<br>KRC=%{y}<br>Publication Count=%{marker.color}<extra></extra>'}
+        layout = {'template': _template(), 'xaxis': {'title': {'text': 'Keyword'}}, 'yaxis': {'title': {'text': 'KRC'}}}
+    elif kind == 'krc_pie':
+        trace = {'type': 'pie', 'values': [], 'labels': [], 'marker': {'colors': PIE_COLORS}}
+        layout = {}
+    else:
+        raise ValueError(f"Unknown figure {kind}")
+    return {'data': [trace], 'layout': {**layout, 'title': {'text': ''}}}
+
+## Empty figure to put in the layout; callbacks patch its first trace and title
+def base_figure(kind):
+    return copy.deepcopy(_base_figure(kind))
+
+## Trace updates as {dotted property path: value}
+def keyword_dot_plot(records):
+    keywords = [record['keyword'] for record in records]
+    counts = [record['publication count'] for record in records]
+    return {
+        'x': keywords,
+        'y': counts,
+        'marker.size': counts,
+        'marker.sizeref': 2.0 * max(counts, default = 0) / figure_config['size_max'] ** 2 or 1,
+        'marker.color': [PALETTE[index % len(PALETTE)] for index in range(len(keywords))]
+    }
+
+def favorite_histogram(records):
+    return {
+        'x': [record['Keyword'] for record in records],
+        'y': [record['KRC'] for record in records],
+        'marker.color': [record['Publication Count'] for record in records]
+    }
+
+def krc_pie(records):
+    return {
+        'values': [record['krc score'] for record in records],
+        'labels': [record['keyword'] for record in records]
+    }
+
+def _assign(figure, path, value):
+    *parents, name = path.split('.')
+    target = figure['data'][0]
+    for parent in parents:
+        target = target[parent]
+    target[name] = value
+
+## The whole figure (base plus updates), e.g. for callers without a figure on the page yet
+def full_figure(kind, trace, title):
+    figure = base_figure(kind)
+    for path, value in trace.items():
+        _assign(figure, path, value)
+    figure['layout']['title']['text'] = title
+    return figure
+
+## Partial update of a figure built from base_figure(): only the changed trace data and title are sent
+def patch_figure(trace, title):
+    from dash import Patch
+    patch = Patch()
+    for path, value in trace.items():
+        _assign(patch, path, value)
+    patch['layout']['title']['text'] = title
+    return patch
@@ -0,0 +1,10 @@
+## gunicorn settings for wsgi:server; override with KEYWORD_EXPLORE_BIND / _WORKERS / _THREADS / _TIMEOUT
+from serving_utils import serving_config
+
+bind = serving_config['bind']
+workers = serving_config['workers']
+threads = serving_config['threads']
+worker_class = 'gthread'
+timeout = serving_config['timeout']
+## Load the app (and its read-only startup data) once in the master so workers share it copy-on-write
+preload_app = True
@@ -0,0 +1,246 @@
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+## Latency histograms for Dash callbacks, backend functions and raw queries, a slow-query log
+## and optional plan capture for slow queries. Exposed at /metrics on the Dash Flask server.
+metrics_config = {
+    'slow_query_ms': 200,
+    'slow_query_log_size': 100,
+    'explain_slow_queries': False,
+    ## 'EXPLAIN' only plans the query; 'PROFILE' re-executes read queries to get actual row counts
+    'explain_mode': 'EXPLAIN',
+    ## /metrics is only served when enabled, and then only to loopback clients or to requests
+    ## carrying "Authorization: Bearer <token>"
+    'endpoint_enabled': os.environ.get('KEYWORD_EXPLORE_METRICS') is not None,
+    'token': os.environ.get('KEYWORD_EXPLORE_METRICS_TOKEN')
+}
+
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error = False):
+        milliseconds = seconds * 1000
+        index = 0
+        while index < len(BUCKETS_MS) and milliseconds > BUCKETS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.maximum = max(self.maximum, milliseconds)
+        self.errors += error
+
+    def quantile(self, fraction):
+        ## Upper bound of the bucket holding the quantile
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return BUCKETS_MS[index] if index < len(BUCKETS_MS) else self.maximum
+        return 0.0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.quantile(0.50),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'max_ms': self.maximum,
+            'buckets': dict(zip([str(bound) for bound in BUCKETS_MS] + ['+Inf'], self.buckets))
+        }
+
+class MetricsRegistry:
+    def __init__(self, slow_query_log_size = 100):
+        self.__lock = threading.Lock()
+        self.__histograms = {}
+        self.__slow_queries = deque(maxlen = slow_query_log_size)
+        self.__sources = {}
+
+    ## In a forked child: a lock another thread held at fork time would stay held forever
+    def reset_lock(self):
+        self.__lock = threading.Lock()
+
+    def observe(self, kind, store, name, seconds, error = False):
+        key = (kind, store, name)
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = LatencyHistogram()
+            histogram.observe(seconds, error)
+
+    def slow_query(self, entry):
+        with self.__lock:
+            self.__slow_queries.append(entry)
+
+    ## Extra gauges reported alongside the histograms, e.g. pool or cache statistics
+    def register_source(self, name, function):
+        self.__sources[name] = function
+
+    def reset(self):
+        with self.__lock:
+            self.__histograms.clear()
+            self.__slow_queries.clear()
+
+    def snapshot(self):
+        with self.__lock:
+            histograms = {key: histogram.snapshot() for key, histogram in self.__histograms.items()}
+            slow_queries = [dict(entry) for entry in self.__slow_queries]
+        metrics = {}
+        for (kind, store, name), snapshot in sorted(histograms.items()):
+            metrics.setdefault(kind, {}).setdefault(store, {})[name] = snapshot
+        sources = {}
+        for name, function in list(self.__sources.items()):
+            try:
+                sources[name] = function()
+            except Exception as error:
+                sources[name] = {'error': str(error)}
+        return {'latency': metrics, 'slow_queries': slow_queries, **sources}
+
+    def prometheus(self):
+        with self.__lock:
+            histograms = {key: (list(histogram.buckets), histogram.count, histogram.total) for key, histogram in self.__histograms.items()}
+        lines = ["# TYPE keyword_explore_latency_ms histogram"]
+        for (kind, store, name), (buckets, count, total) in sorted(histograms.items()):
+            labels = f'kind="{kind}",store="{store}",name="{name}"'
+            cumulative = 0
+            for bound, bucket in zip([str(bound) for bound in BUCKETS_MS] + ['+Inf'], buckets):
+                cumulative += bucket
+                lines.append(f'keyword_explore_latency_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"keyword_explore_latency_ms_sum{{{labels}}} {total}")
+            lines.append(f"keyword_explore_latency_ms_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry(metrics_config['slow_query_log_size'])
+
+def reset_locks():
+    metrics.reset_lock()
+
+@contextmanager
+def timer(kind, store, name):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        metrics.observe(kind, store, name, time.perf_counter() - start, error)
+
+## Decorator: time every call of a backend function (kind 'backend') or Dash callback (kind 'callback')
+def timed(store, name = None, kind = 'backend'):
+    def decorator(function):
+        label = name or function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(kind, store, label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+## Plan capture per store: function(text, parameters, mode) -> plan, registered by the store module
+explainers = {}
+
+def register_explainer(store, function):
+    explainers[store] = function
+
+READ_ONLY = re.compile(r"^\s*(SELECT|MATCH|OPTIONAL\s+MATCH|WITH|\[)", re.I)
+WRITES = re.compile(r"\b(CREATE|DELETE|DETACH|SET|MERGE|REMOVE|INSERT|UPDATE|REPLACE|ALTER|DROP|\$out|\$merge)\b", re.I)
+
+## True for a statement that only reads (SQL or Cypher text)
+def read_only(text):
+    return bool(READ_ONLY.match(text) and not WRITES.search(text))
+
+def _explain(entry, text, parameters):
+    mode = metrics_config['explain_mode']
+    try:
+        entry['plan'] = json.loads(json.dumps(explainers[entry['store']](text, parameters, mode), default = str))
+    except Exception as error:
+        entry['plan'] = f"plan capture failed: {error}"
+
+## Parameter values (e.g. favorites session ids) never leave the process: the slow-query log
+## keeps a short digest, enough to tell repeated calls with the same values apart
+def parameters_digest(parameters):
+    if not parameters:
+        return None
+    return hashlib.sha256(json.dumps(parameters, default = str, sort_keys = True).encode()).hexdigest()[:12]
+
+## Record one raw query. Slow ones go to the slow-query log (text and a parameter digest) and,
+## when enabled, have their plan captured in the background; writes are never re-run for a plan.
+def record_query(store, text, parameters, seconds, error = False):
+    metrics.observe('query', store, 'all', seconds, error)
+    if seconds * 1000 < metrics_config['slow_query_ms']:
+        return
+    query = text if isinstance(text, str) else json.dumps(text, default = str)
+    entry = {
+        'store': store,
+        'ms': seconds * 1000,
+        'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'query': " ".join(query.split()),
+        'parameters': parameters_digest(parameters),
+        'error': error
+    }
+    logging.warning(f"Slow {store} query ({entry['ms']:.1f} ms): {entry['query'][:500]} parameters={entry['parameters']}")
+    metrics.slow_query(entry)
+    if metrics_config['explain_slow_queries'] and store in explainers and not error:
+        if not isinstance(text, str) or read_only(text):
+            threading.Thread(target = _explain, args = (entry, text, parameters), daemon = True).start()
+
+@contextmanager
+def query_timer(store, text, parameters = None):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record_query(store, text, parameters, time.perf_counter() - start, error)
+
+## Add the metrics endpoint (JSON, or Prometheus text with ?format=prometheus; see
+## metrics_config['endpoint_enabled']) and end-to-end timing of Dash callback requests to the Flask server behind the Dash app
+def register_metrics_endpoint(server, path = '/metrics'):
+    from flask import Response, g, jsonify, request
+
+    @server.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def record_request_time(response):
+        start = getattr(g, 'metrics_start', None)
+        if start is not None and request.path.endswith('_dash-update-component'):
+            body = request.get_json(silent = True) or {}
+            metrics.observe('request', 'dash', body.get('output', 'unknown'), time.perf_counter() - start, response.status_code >= 500)
+        return response
+
+    def metrics_view():
+        token = metrics_config['token']
+        authorized = token and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+        if not authorized and request.remote_addr not in ('127.0.0.1', '::1'):
+            return Response("Forbidden", status = 403)
+        if request.args.get('format') == 'prometheus':
+            return Response(metrics.prometheus(), mimetype = 'text/plain; version=0.0.4')
+        return jsonify(metrics.snapshot())
+
+    if metrics_config['endpoint_enabled']:
+        server.add_url_rule(path, 'metrics', metrics_view)
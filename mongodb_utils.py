@@ -1,21 +1,262 @@
-from pymongo import MongoClient
-import pandas as pd
+import logging
+import threading
+import time
 
-mongodb_client = MongoClient("mongodb://localhost:27017")
-db = mongodb_client["academicworld"]
+from cache_utils import cached, invalidate
+from concurrency_utils import Overloaded, run_query
+from metrics_utils import query_timer, register_explainer, timed
 
-# Query 4: By selecting the time period (year), it shows the top 5 popular keywords of current year.
-def mongo_get_top_10_keywords(year = 1982):
-    query = [
-        {"$match": {"year": {"$eq": year}}},
+mongodb_config = {
+    'url': "mongodb://localhost:27017",
+    'database': "academicworld",
+    ## Seconds before a worker rebuilds its keyword/year cube in the background (None: never)
+    'cube_max_age': 3600,
+    ## Seconds before a failed first build of the cube is tried again
+    'cube_retry_seconds': 30
+}
+
+## The client is created on first use so importing this module stays cheap
+_mongodb_client = None
+_mongodb_client_lock = threading.Lock()
+
+def get_database():
+    global _mongodb_client
+    if _mongodb_client is None:
+        with _mongodb_client_lock:
+            if _mongodb_client is None:
+                from pymongo import MongoClient
+                _mongodb_client = MongoClient(mongodb_config['url'])
+    return _mongodb_client[mongodb_config['database']]
+
+def close_client():
+    global _mongodb_client
+    with _mongodb_client_lock:
+        if _mongodb_client is not None:
+            _mongodb_client.close()
+        _mongodb_client = None
+
+## In a forked child: forget the parent's client (MongoClient is not fork-safe) without closing it
+def reset_client():
+    global _mongodb_client, _mongodb_client_lock
+    _mongodb_client = None
+    _mongodb_client_lock = threading.Lock()
+
+## Year range covered by the publication-trend widget
+FIRST_YEAR = 1982
+LAST_YEAR = 2023
+
+def keyword_year_pipeline(first_year, last_year):
+    return [
+        {"$match": {"year": {"$gte": first_year, "$lte": last_year}}},
         {"$unwind": "$keywords"},
-        {"$group": {"_id": "$keywords.name", "publication count": {"$sum": 1}}},
-        {"$sort": {"publication count": -1}},
-        {"$limit": 10}
+        {"$group": {"_id": {"year": "$year", "keyword": "$keywords.name"}, "publication count": {"$sum": 1}}}
     ]
 
-    result = db["publications"].aggregate(query)
+## Bulk (year, keyword, publication count) rows; cached so other workers build their cube without a round trip.
+## None when the aggregation was shed or failed.
+@timed('mongodb')
+@cached('mongo')
+def mongo_keyword_year_counts(first_year, last_year):
+    query = keyword_year_pipeline(first_year, last_year)
+    try:
+        with query_timer('mongodb', {'aggregate': 'publications', 'pipeline': query}):
+            rows = run_query('mongodb', repr(query), lambda: list(get_database()["publications"].aggregate(query)))
+    except Overloaded as error:
+        logging.warning(f"Query shed: {error}")
+        return None
+    except Exception as error:
+        logging.error(f"Keyword/year aggregation failed: {error}")
+        return None
+    return [(row["_id"]["year"], row["_id"]["keyword"], row["publication count"])
+            for row in rows if row["_id"].get("keyword") is not None]
+
+## Query plan for the slow-query log: queryPlanner, or executionStats (runs the pipeline) in PROFILE mode
+def explain_aggregation(command, parameters = None, mode = 'EXPLAIN'):
+    verbosity = 'executionStats' if mode == 'PROFILE' else 'queryPlanner'
+    return get_database().command('explain', {'aggregate': command['aggregate'], 'pipeline': command['pipeline'], 'cursor': {}}, verbosity = verbosity)
+
+register_explainer('mongodb', explain_aggregation)
+
+## Indexes the aggregations filter on: {index name: [(field, direction)]}
+MONGODB_INDEXES = {
+    'year_1': [('year', 1)],
+}
+
+## Create missing indexes (same key pattern under any name counts). Returns {index name: 'exists' | 'created' | 'failed'}
+@timed('mongodb')
+def ensure_indexes():
+    collection = get_database()["publications"]
+    existing = [list(index['key']) for index in collection.index_information().values()]
+    status = {}
+    for name, keys in MONGODB_INDEXES.items():
+        if list(keys) in existing:
+            status[name] = 'exists'
+            continue
+        try:
+            collection.create_index(keys, name = name)
+            status[name] = 'created'
+        except Exception as error:
+            logging.error(f"Index {name} not created: {error}")
+            status[name] = 'failed'
+    return status
+
+def plan_stages(plan):
+    if isinstance(plan, dict):
+        stages = [plan['stage']] if isinstance(plan.get('stage'), str) else []
+        return stages + [stage for value in plan.values() for stage in plan_stages(value)]
+    if isinstance(plan, list):
+        return [stage for value in plan for stage in plan_stages(value)]
+    return []
+
+## Explain the widget aggregation and report a collection scan (COLLSCAN) instead of an index scan
+@timed('mongodb')
+def verify_query_plans(first_year = FIRST_YEAR, last_year = LAST_YEAR):
+    try:
+        plan = explain_aggregation({'aggregate': 'publications', 'pipeline': keyword_year_pipeline(first_year, last_year)})
+    except Exception as error:
+        return {'keyword_year_counts': {'indexed': False, 'full_scans': [], 'error': str(error)}}
+    scans = ['COLLSCAN publications' for stage in plan_stages(plan) if stage == 'COLLSCAN']
+    return {'keyword_year_counts': {'indexed': not scans, 'full_scans': scans}}
+
+## Year x keyword publication counts, built from one bulk aggregation and kept in memory.
+## counts[k, y] is the number of publications of year FIRST_YEAR + y labelled with keyword k,
+## prefix[k, y] is the cumulative sum so any year range is answered with one subtraction.
+## The first read builds the cube while concurrent readers wait for it; if that build fails they all
+## get no results and nobody retries for retry_seconds. Once the cube is older than max_age, the next
+## read starts one background rebuild and keeps answering from the current cube until it is swapped in.
+class KeywordYearCube:
+    def __init__(self, first_year = FIRST_YEAR, last_year = LAST_YEAR, max_age = None, retry_seconds = 30):
+        self.first_year = first_year
+        self.last_year = last_year
+        self.max_age = max_age
+        self.retry_seconds = retry_seconds
+        self.__lock = threading.Lock()
+        self.__build_lock = threading.Lock()
+        self.__data = None
+        self.__refreshed = None
+        self.__refreshing = False
+        self.__failed = None
+
+    def reset_lock(self):
+        self.__lock = threading.Lock()
+        self.__build_lock = threading.Lock()
+        self.__refreshing = False
+
+    ## Rebuild from the aggregation; False (keeping the current cube) when it was shed or failed
+    def refresh(self):
+        import numpy as np
+        rows = mongo_keyword_year_counts(self.first_year, self.last_year)
+        if rows is None:
+            return False
+
+        keywords = sorted({keyword for _, keyword, _ in rows})
+        keyword_index = {keyword: index for index, keyword in enumerate(keywords)}
+        counts = np.zeros((len(keywords), self.last_year - self.first_year + 1), dtype = np.int32)
+        for year, keyword, count in rows:
+            counts[keyword_index[keyword], year - self.first_year] += count
+        prefix = np.zeros((len(keywords), counts.shape[1] + 1), dtype = np.int64)
+        np.cumsum(counts, axis = 1, out = prefix[:, 1:])
+
+        with self.__lock:
+            self.__data = (np.array(keywords, dtype = object), counts, prefix)
+            self.__refreshed = time.monotonic()
+        return True
+
+    ## (keywords, counts, prefix), or None while the cube could not be built
+    def __loaded(self):
+        if self.__data is None:
+            with self.__build_lock:
+                if self.__data is None and (self.__failed is None or time.monotonic() - self.__failed >= self.retry_seconds):
+                    try:
+                        built = self.refresh()
+                    except Exception as error:
+                        logging.error(f"Keyword cube build failed: {error}")
+                        built = False
+                    self.__failed = None if built else time.monotonic()
+        elif self.max_age is not None and time.monotonic() - self.__refreshed >= self.max_age:
+            self.__refresh_in_background()
+        return self.__data
+
+    def __refresh_in_background(self):
+        with self.__lock:
+            if self.__refreshing:
+                return
+            self.__refreshing = True
+        def run():
+            try:
+                refreshed = self.refresh()
+            except Exception as error:
+                logging.warning(f"Keyword cube refresh failed: {error}")
+                refreshed = False
+            with self.__lock:
+                ## After a failure, keep the current cube and try again after another max_age
+                if not refreshed:
+                    self.__refreshed = time.monotonic()
+                self.__refreshing = False
+        threading.Thread(target = run, name = 'keyword-cube-refresh', daemon = True).start()
+
+    def top_keywords(self, first_year, last_year = None, limit = 10):
+        import numpy as np
+        data = self.__loaded()
+        if data is None:
+            return []
+        keywords, counts, prefix = data
+
+        last_year = first_year if last_year is None else last_year
+        start = max(first_year, self.first_year) - self.first_year
+        stop = min(last_year, self.last_year) - self.first_year + 1
+        if stop <= start or len(keywords) == 0:
+            return []
+
+        totals = prefix[:, stop] - prefix[:, start]
+        limit = min(limit, len(totals))
+        top = np.argpartition(-totals, limit - 1)[:limit]
+        top = top[np.argsort(-totals[top], kind = 'stable')]
+        return [{"keyword": keywords[index], "publication count": int(totals[index])} for index in top if totals[index] > 0]
+
+    ## Publication count of every keyword over all years
+    def totals(self):
+        data = self.__loaded()
+        if data is None:
+            return {}
+        keywords, counts, prefix = data
+        return dict(zip(keywords.tolist(), prefix[:, -1].tolist()))
+
+keyword_cube = KeywordYearCube(max_age = mongodb_config['cube_max_age'], retry_seconds = mongodb_config['cube_retry_seconds'])
+
+## In a forked child: the cube itself is shared copy-on-write, only its lock is replaced
+def reset_locks():
+    keyword_cube.reset_lock()
+
+## Rebuild the in-memory cube now, dropping the cached aggregation, e.g. from a script that changes
+## publications in the serving process. Other workers pick the change up within cube_max_age.
+@timed('mongodb')
+def refresh_keyword_cube():
+    invalidate('mongo')
+    return keyword_cube.refresh()
+
+# Query 4: By selecting the time period (year), it shows the top 5 popular keywords of current year.
+@timed('mongodb')
+def mongo_get_top_10_keywords(year = 1982):
+    return keyword_cube.top_keywords(year)
+
+# Query 4 (range mode): top keywords over an inclusive range of years
+@timed('mongodb')
+def mongo_get_top_10_keywords_range(first_year, last_year):
+    return keyword_cube.top_keywords(first_year, last_year)
 
-    result_keywords = pd.DataFrame(list(result)).rename(columns={"_id": "keyword", "publication count": "publication count"})
+## Keyword popularity (all-time publication count) for ranking search-as-you-type suggestions
+@timed('mongodb')
+def mongo_keyword_popularity():
+    return keyword_cube.totals()
 
-    return result_keywords.to_dict('records')
+if __name__ == '__main__':
+    ## Refresh command: python mongodb_utils.py refresh-cube (after publications change). Drops the shared
+    ## cached aggregation, so every serving worker rebuilds its cube from fresh counts within cube_max_age.
+    import sys
+    if sys.argv[1:] == ['refresh-cube']:
+        logging.basicConfig(level = logging.INFO)
+        print("Keyword cube refreshed" if refresh_keyword_cube() else "Keyword cube refresh failed")
+        close_client()
+    else:
+        print("Usage: python mongodb_utils.py refresh-cube")
@@ -1,6 +1,12 @@
 import mysql.connector
 import logging
-import pandas as pd
+import queue
+import threading
+import time
+
+from cache_utils import cached, cached_batch, invalidate
+from concurrency_utils import Overloaded, coalesced, shed
+from metrics_utils import query_timer, register_explainer, timed
 
 config = {
     'user': 'root',
@@ -10,37 +16,242 @@ config = {
     'raise_on_warnings': True
 }
 
+## Connection pool settings: bounded size, how long a caller may wait for a free
+## connection (then the query is shed with Overloaded), and how long an idle connection may sit
+## before it is pinged again.
+pool_config = {
+    'pool_size': 5,
+    'wait_timeout': 10,
+    'health_check_interval': 30
+}
+
+class CS411SQLConnectionPool:
+    def __init__(self, config, pool_size = 5, wait_timeout = 10, health_check_interval = 30):
+        self.config = config
+        self.pool_size = pool_size
+        self.wait_timeout = wait_timeout
+        self.health_check_interval = health_check_interval
+        self.__idle = queue.LifoQueue()
+        self.__slots = threading.BoundedSemaphore(pool_size)
+        self.__lock = threading.Lock()
+        self.__statements = {}
+        self.__created = 0
+        self.__in_use = 0
+        self.__wait_count = 0
+        self.__wait_total = 0.0
+        self.__wait_max = 0.0
+        self.__timed_out = 0
+
+    def acquire(self):
+        start = time.perf_counter()
+        if not self.__slots.acquire(timeout = self.wait_timeout):
+            with self.__lock:
+                self.__timed_out += 1
+            raise Overloaded(f"mysql: no connection available after {self.wait_timeout}s (pool size {self.pool_size})")
+        waited = time.perf_counter() - start
+        with self.__lock:
+            self.__in_use += 1
+            self.__wait_count += 1
+            self.__wait_total += waited
+            self.__wait_max = max(self.__wait_max, waited)
+        try:
+            return self.__checkout()
+        except Exception:
+            with self.__lock:
+                self.__in_use -= 1
+            self.__slots.release()
+            raise
+
+    def release(self, connection, broken = False):
+        try:
+            if connection is None:
+                return
+            if not broken:
+                try:
+                    ## End any read snapshot so the next borrower sees fresh data
+                    if connection.in_transaction:
+                        connection.rollback()
+                except mysql.connector.Error:
+                    broken = True
+            if broken:
+                self.__discard(connection)
+            else:
+                self.__idle.put((connection, time.monotonic()))
+        finally:
+            with self.__lock:
+                self.__in_use -= 1
+            self.__slots.release()
+
+    def statement(self, connection, query):
+        ## Prepared statements are cached per physical connection and reused across checkouts
+        statements = self.__statements.setdefault(id(connection), {})
+        cursor = statements.get(query)
+        if cursor is None:
+            cursor = connection.cursor(prepared = True)
+            statements[query] = cursor
+        return cursor
+
+    def stats(self):
+        with self.__lock:
+            return {
+                'pool_size': self.pool_size,
+                'connections': self.__created,
+                'in_use': self.__in_use,
+                'idle': self.__idle.qsize(),
+                'wait_count': self.__wait_count,
+                'wait_total': self.__wait_total,
+                'wait_avg': self.__wait_total / self.__wait_count if self.__wait_count else 0.0,
+                'wait_max': self.__wait_max,
+                'timed_out': self.__timed_out
+            }
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self.__idle.get_nowait()
+            except queue.Empty:
+                break
+            self.__discard(connection)
+
+    def __checkout(self):
+        while True:
+            try:
+                connection, idle_since = self.__idle.get_nowait()
+            except queue.Empty:
+                return self.__connect()
+            if time.monotonic() - idle_since < self.health_check_interval:
+                return connection
+            try:
+                connection.ping(reconnect = False)
+                return connection
+            except mysql.connector.Error:
+                logging.warning("Pooled connection failed health check, replacing it")
+                self.__discard(connection)
+
+    def __connect(self):
+        connection = mysql.connector.connect(**self.config)
+        with self.__lock:
+            self.__created += 1
+        return connection
+
+    def __discard(self, connection):
+        for cursor in self.__statements.pop(id(connection), {}).values():
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+        try:
+            connection.close()
+        except mysql.connector.Error:
+            pass
+        with self.__lock:
+            self.__created -= 1
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(config):
+    key = tuple(sorted(config.items()))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = CS411SQLConnectionPool(config, **pool_config)
+        return _pools[key]
+
+## Pool size and wait time for monitoring, one entry per database config
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [dict(database = pool.config.get('database'), **pool.stats()) for pool in pools]
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+## In a forked child: forget the parent's pools without closing their sockets, which the parent still owns
+def reset_pools():
+    global _pools, _pools_lock
+    _pools = {}
+    _pools_lock = threading.Lock()
+
 class CS411SQLDatabase:
     def __init__(self, config):
         self.config = config
+        self.pool = None
         self.connection = None
         self.cursor = None
 
     def __enter__(self):
-        self.connection = mysql.connector.connect(**self.config)
-        self.cursor = self.connection.cursor(buffered = True)
+        self.pool = get_pool(self.config)
+        self.connection = self.pool.acquire()
+        try:
+            self.cursor = self.connection.cursor(buffered = True)
+        except mysql.connector.Error:
+            self.pool.release(self.connection, broken = True)
+            raise
         return self
     
     def __exit__(self, execution_type, execution_val, execution_tb):
         if execution_type:
             logging.exception("Exeception Occured")
-        self.cursor.close()
-        self.connection.close()
+        broken = isinstance(execution_val, (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError))
+        try:
+            self.cursor.close()
+        except mysql.connector.Error:
+            broken = True
+        self.pool.release(self.connection, broken = broken)
+        self.connection = None
+        self.cursor = None
+
+    def __cursor_for(self, query, values, prepared = True):
+        ## Parameterized statements go through the pool's prepared statement cache
+        if values is None or not prepared:
+            return self.cursor
+        return self.pool.statement(self.connection, query)
 
     def query_execution(self, query, values = None):
         try:
-            self.cursor.execute(query, values)
-            self.connection.commit()
+            with query_timer('mysql', query, values):
+                self.__cursor_for(query, values).execute(query, values)
+                self.connection.commit()
             return True
         except mysql.connector.Error as error:
             logging.exception(f"Query Invalid: {error}")
             self.connection.rollback()
             return False
         
-    def retrieve_data(self, query, values = None):
-        self.cursor.execute(query, values)
-        return self.cursor.fetchall()
+    def retrieve_data(self, query, values = None, prepared = True):
+        cursor = self.__cursor_for(query, values, prepared)
+        with query_timer('mysql', query, values):
+            cursor.execute(query, values)
+            return cursor.fetchall()
+
+    ## Run several statements in one transaction; variable-length batches skip the prepared statement cache
+    def transaction_execution(self, statements):
+        try:
+            for query, values in statements:
+                with query_timer('mysql', query, values):
+                    self.cursor.execute(query, values)
+            self.connection.commit()
+            return True
+        except mysql.connector.Error as error:
+            logging.exception(f"Transaction Invalid: {error}")
+            self.connection.rollback()
+            return False
+
+## Query plan for the slow-query log: EXPLAIN, or EXPLAIN ANALYZE (executes the query) in PROFILE mode
+def explain_query(query, values = None, mode = 'EXPLAIN'):
+    prefix = "EXPLAIN ANALYZE" if mode == 'PROFILE' else "EXPLAIN"
+    with CS411SQLDatabase(config) as db:
+        return db.retrieve_data(f"{prefix} {query}", values, prepared = False)
+
+register_explainer('mysql', explain_query)
     
+@timed('mysql')
+@cached('mysql')
+@coalesced('mysql')
 def retrieve_all_keywords():
     with CS411SQLDatabase(config) as db:
         query = "SELECT name FROM keyword"
@@ -49,89 +260,529 @@ def retrieve_all_keywords():
         
     return keywords     
 
-def retrieve_all_favorite_keywords():
+@timed('mysql')
+@cached('favorite_keywords')
+@shed
+def retrieve_all_favorite_keywords(session_id = ''):
     with CS411SQLDatabase(config) as db:
         if not favorite_keyword_table(db):
             create_favorite_keywords_table(db)
         
-        query = "SELECT name FROM favorite_keywords"
-        result = db.retrieve_data(query)
+        query = "SELECT name FROM favorite_keywords WHERE session_id = %s"
+        result = db.retrieve_data(query, (session_id, ))
         favorite_keywords = [row[0] for row in result]
        
     return favorite_keywords
 
+## Version and favorites of one session read in the same snapshot
+@timed('mysql')
+@shed
+def retrieve_favorite_keywords_snapshot(session_id = ''):
+    with CS411SQLDatabase(config) as db:
+        if not favorite_keyword_table(db):
+            create_favorite_keywords_table(db)
+
+        result = db.retrieve_data("SELECT version FROM favorite_keywords_version WHERE session_id = %s", (session_id, ))
+        version = result[0][0] if result else 0
+        result = db.retrieve_data("SELECT name FROM favorite_keywords WHERE session_id = %s", (session_id, ))
+        favorite_keywords = [row[0] for row in result]
+
+    return version, favorite_keywords
+
+@timed('mysql')
+@shed
+def retrieve_favorite_keywords_version(session_id = ''):
+    with CS411SQLDatabase(config) as db:
+        if not favorite_keyword_table(db):
+            return 0
+        result = db.retrieve_data("SELECT version FROM favorite_keywords_version WHERE session_id = %s", (session_id, ))
+    return result[0][0] if result else 0
+
+## The tables are only created once, so a positive check is cached for the life of the process
+_favorite_keywords_table_exists = False
+
 def favorite_keyword_table (db):
+    global _favorite_keywords_table_exists
+    if _favorite_keywords_table_exists:
+        return True
     query = "SHOW TABLES LIKE 'favorite_keywords'"
-    return bool(db.retrieve_data(query))
+    if db.retrieve_data(query):
+        _favorite_keywords_table_exists = migrate_favorite_keywords_table(db)
+    return _favorite_keywords_table_exists
 
 def create_favorite_keywords_table(db):
     query = ("CREATE TABLE `favorite_keywords` ("
+             "`session_id` varchar(64) NOT NULL DEFAULT '',"
              "`name` varchar(512) NOT NULL,"
-             "PRIMARY KEY (`name`))")
-    if db.query_execution(query):
+             "PRIMARY KEY (`session_id`, `name`))")
+    global _favorite_keywords_table_exists
+    if db.query_execution(query) and create_favorite_keywords_version_table(db):
+        _favorite_keywords_table_exists = True
         logging.info("Successful: favorite_keywords table created")
 
-## Query 5: Users are able to add / delete favorite keyword(s) and display the favorite keyword table (MySql).
-def add_favorite_keywords(keyword):
+## updated_at records the last change of each session, for purge_abandoned_favorites
+def create_favorite_keywords_version_table(db):
+    if db.retrieve_data("SHOW TABLES LIKE 'favorite_keywords_version'"):
+        if db.retrieve_data("SHOW COLUMNS FROM favorite_keywords_version LIKE 'updated_at'"):
+            return True
+        query = ("ALTER TABLE `favorite_keywords_version` "
+                 "ADD COLUMN `updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, "
+                 "ADD INDEX `idx_favorite_keywords_version_updated` (`updated_at`)")
+        return db.query_execution(query)
+    query = ("CREATE TABLE `favorite_keywords_version` ("
+             "`session_id` varchar(64) NOT NULL,"
+             "`version` bigint NOT NULL,"
+             "`updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,"
+             "PRIMARY KEY (`session_id`),"
+             "INDEX `idx_favorite_keywords_version_updated` (`updated_at`))")
+    return db.query_execution(query)
+
+## Older single-user tables get a session_id column (existing rows belong to the default '' session)
+def migrate_favorite_keywords_table(db):
+    if not db.retrieve_data("SHOW COLUMNS FROM favorite_keywords LIKE 'session_id'"):
+        query = ("ALTER TABLE `favorite_keywords` "
+                 "ADD COLUMN `session_id` varchar(64) NOT NULL DEFAULT '' FIRST, "
+                 "DROP PRIMARY KEY, ADD PRIMARY KEY (`session_id`, `name`)")
+        if not db.query_execution(query):
+            return False
+        logging.info("Successful: favorite_keywords table migrated to per-session favorites")
+    return create_favorite_keywords_version_table(db)
+
+## Apply a batch of favorite inserts and deletes for one session in a single transaction
+## with one multi-row statement each, and return the session's new version (None on failure).
+@timed('mysql')
+@shed
+def apply_favorite_keyword_changes(session_id, inserts = (), deletes = ()):
+    inserts = list(dict.fromkeys(inserts))
+    deletes = list(dict.fromkeys(deletes))
+    if not inserts and not deletes:
+        return retrieve_favorite_keywords_version(session_id)
+
+    statements = []
+    if inserts:
+        statements.append(("INSERT INTO favorite_keywords (session_id, name) VALUES "
+                           + ", ".join(["(%s, %s)"] * len(inserts))
+                           + " ON DUPLICATE KEY UPDATE name = name",
+                           tuple(value for keyword in inserts for value in (session_id, keyword))))
+    if deletes:
+        statements.append(("DELETE FROM favorite_keywords WHERE session_id = %s AND name IN ("
+                           + ", ".join(["%s"] * len(deletes)) + ")",
+                           (session_id, *deletes)))
+    ## LAST_INSERT_ID(expr) hands the bumped version back without a second read
+    statements.append(("INSERT INTO favorite_keywords_version (session_id, version) VALUES (%s, LAST_INSERT_ID(1)) "
+                       "ON DUPLICATE KEY UPDATE version = LAST_INSERT_ID(version + 1)", (session_id, )))
+
     with CS411SQLDatabase(config) as db:
-        query = "INSERT INTO favorite_keywords (name) VALUES (%s)"
-        values = (keyword, )
-        if db.query_execution(query, values):
-            logging.info("Successful: Keyword added")
+        if not favorite_keyword_table(db):
+            create_favorite_keywords_table(db)
+        if not db.transaction_execution(statements):
+            return None
+        version = db.cursor.lastrowid
+    invalidate('favorite_keywords')
+    logging.info(f"Successful: {len(inserts)} favorite keyword(s) added, {len(deletes)} deleted")
+    return version
 
-def delete_favorite_keywords(keyword):
+## Delete per-session favorites (never the shared '' session) whose session has not changed for
+## max_age_days. Returns the number of sessions removed (None on failure).
+@timed('mysql')
+def purge_abandoned_favorites(max_age_days = 30):
     with CS411SQLDatabase(config) as db:
         if not favorite_keyword_table(db):
-            logging.error("Error: favorite_keywords table absent.")
-            return
-        query = "DELETE FROM favorite_keywords WHERE name = %s"
-        values = (keyword, )
-        if db.query_execution(query, values):
-            logging.info("Successful: keyword deleted from table")
+            return 0
+        sessions = [row[0] for row in db.retrieve_data(
+            "SELECT session_id FROM favorite_keywords_version WHERE session_id <> '' AND updated_at < NOW() - INTERVAL %s DAY", (max_age_days, ))]
+        for start in range(0, len(sessions), 1000):
+            batch = sessions[start:start + 1000]
+            placeholders = ", ".join(["%s"] * len(batch))
+            if not db.transaction_execution([
+                (f"DELETE FROM favorite_keywords WHERE session_id IN ({placeholders})", tuple(batch)),
+                (f"DELETE FROM favorite_keywords_version WHERE session_id IN ({placeholders})", tuple(batch)),
+            ]):
+                return None
+    invalidate('favorite_keywords')
+    logging.info(f"Successful: {len(sessions)} abandoned favorites session(s) purged")
+    return len(sessions)
+
+## Query 5: Users are able to add / delete favorite keyword(s) and display the favorite keyword table (MySql).
+def add_favorite_keywords(keyword, session_id = ''):
+    if apply_favorite_keyword_changes(session_id, inserts = [keyword]) is not None:
+        logging.info("Successful: Keyword added")
+
+def delete_favorite_keywords(keyword, session_id = ''):
+    if apply_favorite_keyword_changes(session_id, deletes = [keyword]) is not None:
+        logging.info("Successful: keyword deleted from table")
         
+## Per-keyword statistics (publication count and KRC) kept in keyword_stats. The table is
+## bulk-built once by provisioning (provision_utils.py) and then maintained incrementally by
+## triggers on publication_keyword, publication and keyword, so reading favorites' stats is an
+## indexed lookup per keyword. Missing citation counts count as 0.
+KEYWORD_STATS_BUILD_QUERY = ("INSERT INTO keyword_stats (keyword_id, name, publication_count, krc) "
+                             "SELECT keyword.id, keyword.name, COUNT(publication.id), COALESCE(SUM(publication_keyword.score * COALESCE(publication.num_citations, 0)), 0) "
+                             "FROM keyword "
+                             "LEFT JOIN publication_keyword ON publication_keyword.keyword_id = keyword.id "
+                             "LEFT JOIN publication ON publication.id = publication_keyword.publication_id "
+                             "{where}"
+                             "GROUP BY keyword.id, keyword.name")
+
+KEYWORD_STATS_TRIGGERS = {
+    'keyword_stats_publication_keyword_insert': (
+        "CREATE TRIGGER keyword_stats_publication_keyword_insert AFTER INSERT ON publication_keyword "
+        "FOR EACH ROW "
+        "INSERT INTO keyword_stats (keyword_id, name, publication_count, krc) "
+        "SELECT delta.keyword_id, delta.name, 1, delta.krc FROM ("
+        "SELECT keyword.id AS keyword_id, keyword.name AS name, NEW.score * COALESCE(publication.num_citations, 0) AS krc "
+        "FROM keyword JOIN publication ON publication.id = NEW.publication_id WHERE keyword.id = NEW.keyword_id) AS delta "
+        "ON DUPLICATE KEY UPDATE publication_count = keyword_stats.publication_count + 1, krc = keyword_stats.krc + delta.krc"),
+    'keyword_stats_publication_keyword_delete': (
+        "CREATE TRIGGER keyword_stats_publication_keyword_delete AFTER DELETE ON publication_keyword "
+        "FOR EACH ROW "
+        "UPDATE keyword_stats JOIN publication ON publication.id = OLD.publication_id "
+        "SET keyword_stats.publication_count = keyword_stats.publication_count - 1, "
+        "keyword_stats.krc = keyword_stats.krc - OLD.score * COALESCE(publication.num_citations, 0) "
+        "WHERE keyword_stats.keyword_id = OLD.keyword_id"),
+    'keyword_stats_publication_keyword_update': (
+        "CREATE TRIGGER keyword_stats_publication_keyword_update AFTER UPDATE ON publication_keyword "
+        "FOR EACH ROW "
+        "BEGIN "
+        "UPDATE keyword_stats JOIN publication ON publication.id = OLD.publication_id "
+        "SET keyword_stats.publication_count = keyword_stats.publication_count - 1, "
+        "keyword_stats.krc = keyword_stats.krc - OLD.score * COALESCE(publication.num_citations, 0) "
+        "WHERE keyword_stats.keyword_id = OLD.keyword_id; "
+        "UPDATE keyword_stats JOIN publication ON publication.id = NEW.publication_id "
+        "SET keyword_stats.publication_count = keyword_stats.publication_count + 1, "
+        "keyword_stats.krc = keyword_stats.krc + NEW.score * COALESCE(publication.num_citations, 0) "
+        "WHERE keyword_stats.keyword_id = NEW.keyword_id; "
+        "END"),
+    'keyword_stats_publication_update': (
+        "CREATE TRIGGER keyword_stats_publication_update AFTER UPDATE ON publication "
+        "FOR EACH ROW "
+        "UPDATE keyword_stats JOIN publication_keyword ON publication_keyword.keyword_id = keyword_stats.keyword_id "
+        "SET keyword_stats.krc = keyword_stats.krc + publication_keyword.score * (COALESCE(NEW.num_citations, 0) - COALESCE(OLD.num_citations, 0)) "
+        "WHERE publication_keyword.publication_id = NEW.id AND NOT (NEW.num_citations <=> OLD.num_citations)"),
+    'keyword_stats_keyword_update': (
+        "CREATE TRIGGER keyword_stats_keyword_update AFTER UPDATE ON keyword "
+        "FOR EACH ROW "
+        "UPDATE keyword_stats SET name = NEW.name WHERE keyword_id = NEW.id AND NOT (NEW.name <=> OLD.name)"),
+}
+
+_keyword_stats_table_exists = False
+
+def keyword_stats_table(db):
+    global _keyword_stats_table_exists
+    if not _keyword_stats_table_exists:
+        _keyword_stats_table_exists = bool(db.retrieve_data("SHOW TABLES LIKE 'keyword_stats'"))
+    return _keyword_stats_table_exists
+
+## Create keyword_stats, attach its triggers, then bulk-load it in one transaction. The triggers go
+## first: a write landing during the load waits on the load's locks and then applies on top of it.
+## A failed load drops the triggers and the table again, so an existing table is always a built one.
+def create_keyword_stats_table(db):
+    global _keyword_stats_table_exists
+    query = ("CREATE TABLE IF NOT EXISTS `keyword_stats` ("
+             "`keyword_id` int NOT NULL,"
+             "`name` varchar(512) NOT NULL,"
+             "`publication_count` int NOT NULL DEFAULT 0,"
+             "`krc` double NOT NULL DEFAULT 0,"
+             "PRIMARY KEY (`keyword_id`),"
+             "INDEX `idx_keyword_stats_name` (`name`))")
+    if not db.query_execution(query):
+        return False
+    built = True
+    for name, trigger in KEYWORD_STATS_TRIGGERS.items():
+        exists = db.retrieve_data("SELECT TRIGGER_NAME FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = %s", (name, ))
+        if not exists and not db.query_execution(trigger):
+            built = False
+            break
+    built = built and db.transaction_execution([
+        ("DELETE FROM keyword_stats", None),
+        (KEYWORD_STATS_BUILD_QUERY.format(where = ""), None),
+    ])
+    if not built:
+        for name in KEYWORD_STATS_TRIGGERS:
+            db.query_execution(f"DROP TRIGGER IF EXISTS `{name}`")
+        db.query_execution("DROP TABLE IF EXISTS `keyword_stats`")
+        return False
+    _keyword_stats_table_exists = True
+    logging.info("Successful: keyword_stats table created and populated")
+    return True
+
+## Provisioning step: build keyword_stats if it is absent. A MySQL named lock keeps concurrent
+## provisioning runs from building it twice. Returns 'exists', 'created' or 'failed'.
+def ensure_keyword_stats():
+    with CS411SQLDatabase(config) as db:
+        if not db.retrieve_data("SELECT GET_LOCK('keyword_stats_build', 600)", prepared = False)[0][0]:
+            logging.error("Error: keyword_stats build lock not acquired.")
+            return 'failed'
+        try:
+            if keyword_stats_table(db):
+                return 'exists'
+            return 'created' if create_keyword_stats_table(db) else 'failed'
+        finally:
+            db.retrieve_data("SELECT RELEASE_LOCK('keyword_stats_build')", prepared = False)
+
+## Recompute keyword_stats rows from the base tables: all of them, or only the given keyword ids
+## (e.g. after bulk loads done with triggers disabled or publication deletes that cascade).
+@timed('mysql')
+def refresh_keyword_stats(keyword_ids = None):
+    with CS411SQLDatabase(config) as db:
+        if not keyword_stats_table(db):
+            refreshed = create_keyword_stats_table(db)
+        elif keyword_ids is None:
+            refreshed = db.transaction_execution([
+                ("DELETE FROM keyword_stats", None),
+                (KEYWORD_STATS_BUILD_QUERY.format(where = ""), None),
+            ])
+        else:
+            keyword_ids = list(keyword_ids)
+            if not keyword_ids:
+                return True
+            placeholders = ", ".join(["%s"] * len(keyword_ids))
+            refreshed = db.transaction_execution([
+                (f"DELETE FROM keyword_stats WHERE keyword_id IN ({placeholders})", tuple(keyword_ids)),
+                (KEYWORD_STATS_BUILD_QUERY.format(where = f"WHERE keyword.id IN ({placeholders}) "), tuple(keyword_ids)),
+            ])
+    invalidate('keyword_stats')
+    invalidate('favorite_keywords')
+    return refreshed
+
+KEYWORD_STATS_LOOKUP_QUERY = ("SELECT name, SUM(publication_count), SUM(krc) FROM keyword_stats "
+                              "WHERE name IN ({placeholders}) AND publication_count > 0 "
+                              "GROUP BY name")
+
+## Same figures from the base tables, read while keyword_stats has not been provisioned
+KEYWORD_STATS_FALLBACK_QUERY = ("SELECT keyword.name, COUNT(publication.id), COALESCE(SUM(publication_keyword.score * COALESCE(publication.num_citations, 0)), 0) "
+                                "FROM keyword "
+                                "JOIN publication_keyword ON publication_keyword.keyword_id = keyword.id "
+                                "JOIN publication ON publication.id = publication_keyword.publication_id "
+                                "WHERE keyword.name IN ({placeholders}) "
+                                "GROUP BY keyword.name")
+
+## Stats for a list of keyword names: one indexed lookup per keyword not already cached. Never
+## builds keyword_stats; until provisioning has, the stats are aggregated from the base tables.
+@cached_batch('keyword_stats')
+@coalesced('mysql')
+def retrieve_keyword_stats(keywords):
+    with CS411SQLDatabase(config) as db:
+        lookup = KEYWORD_STATS_LOOKUP_QUERY if keyword_stats_table(db) else KEYWORD_STATS_FALLBACK_QUERY
+        query = lookup.format(placeholders = ", ".join(["%s"] * len(keywords)))
+        ## Variable-length IN lists would bloat the prepared statement cache, so use the plain cursor
+        result = db.retrieve_data(query, tuple(keywords), prepared = False)
+    return {keyword: {"Keyword": keyword, "Publication Count": int(count), "KRC": float(krc)} for keyword, count, krc in result}
+
 ## Query 6: Display line graph to show trend of each favorite keywords from 1982 to 2022 
 ##          using score of each keyword (MySql).
-def favorite_keywords_score():
+@timed('mysql')
+def keyword_stats_records(keywords):
+    if not keywords:
+        return []
+    stats = retrieve_keyword_stats(keywords)
+    if stats is None:
+        return None
+    return [stats[keyword] for keyword in dict.fromkeys(keywords) if stats.get(keyword) is not None]
+
+@timed('mysql')
+@cached('favorite_keywords')
+@shed
+def favorite_keywords_score_records(session_id = ''):
     with CS411SQLDatabase(config) as db:
         if not favorite_keyword_table(db):
             logging.error("Error: favorite_keywords table absent.")
             return 
-        ## for each keyword, count occurancy and display score
-        query = ("SELECT favorite_keywords.name AS keyword, COUNT(*) AS count, SUM(publication_keyword.score * publication.num_citations) AS krc "
-                 "FROM favorite_keywords, keyword, publication_keyword, publication "
-                 "WHERE favorite_keywords.name = keyword.name AND keyword.id = publication_keyword.keyword_id AND publication_keyword.publication_id = publication.id "
-                 "GROUP BY keyword "
-                )
-        result = db.retrieve_data(query)
-        favorite_keywords_stats = pd.DataFrame(list(result)).rename(columns={0: "Keyword", 1: "Publication Count", 2: 'KRC'})
-    return favorite_keywords_stats
+        query = "SELECT name FROM favorite_keywords WHERE session_id = %s"
+        favorite_keywords = [row[0] for row in db.retrieve_data(query, (session_id, ))]
+    return keyword_stats_records(favorite_keywords)
+
+def favorite_keywords_score(session_id = ''):
+    import pandas as pd
+    favorite_keywords_stats = favorite_keywords_score_records(session_id)
+    if favorite_keywords_stats is None:
+        return None
+    return pd.DataFrame(favorite_keywords_stats, columns = ["Keyword", "Publication Count", "KRC"])
+
+## Keyword co-occurrence neighbors: the top-k most similar keywords of every keyword, built by
+## recommend_utils from publication_keyword and persisted in keyword_neighbors.
+KEYWORD_WEIGHTS_QUERY = ("SELECT publication_keyword.keyword_id, publication_keyword.publication_id, "
+                         "publication_keyword.score, publication.num_citations "
+                         "FROM publication_keyword JOIN publication ON publication.id = publication_keyword.publication_id")
+
+KEYWORD_NEIGHBORS_LOOKUP_QUERY = ("SELECT keyword.name, neighbor.name, keyword_neighbors.similarity FROM keyword "
+                                  "JOIN keyword_neighbors ON keyword_neighbors.keyword_id = keyword.id "
+                                  "JOIN keyword neighbor ON neighbor.id = keyword_neighbors.neighbor_id "
+                                  "WHERE keyword.name IN ({placeholders}) "
+                                  "ORDER BY keyword_neighbors.keyword_id, keyword_neighbors.similarity DESC")
+
+## Rows per multi-row INSERT when writing neighbors
+KEYWORD_NEIGHBORS_BATCH_SIZE = 1000
+
+_keyword_neighbors_table_exists = False
+
+def keyword_neighbors_table(db):
+    global _keyword_neighbors_table_exists
+    if not _keyword_neighbors_table_exists:
+        _keyword_neighbors_table_exists = bool(db.retrieve_data("SHOW TABLES LIKE 'keyword_neighbors'"))
+    return _keyword_neighbors_table_exists
+
+def create_keyword_neighbors_table(db):
+    global _keyword_neighbors_table_exists
+    query = ("CREATE TABLE IF NOT EXISTS `keyword_neighbors` ("
+             "`keyword_id` int NOT NULL,"
+             "`neighbor_id` int NOT NULL,"
+             "`similarity` double NOT NULL,"
+             "PRIMARY KEY (`keyword_id`, `neighbor_id`),"
+             "INDEX `idx_keyword_neighbors_neighbor` (`neighbor_id`))")
+    _keyword_neighbors_table_exists = db.query_execution(query)
+    return _keyword_neighbors_table_exists
+
+## True once keyword_neighbors exists and holds rows
+def keyword_neighbors_built():
+    with CS411SQLDatabase(config) as db:
+        return keyword_neighbors_table(db) and bool(db.retrieve_data("SELECT 1 FROM keyword_neighbors LIMIT 1"))
+
+## (keyword_id, publication_id, score, num_citations) for every publication_keyword row
+@timed('mysql')
+@coalesced('mysql')
+def retrieve_keyword_weights():
+    with CS411SQLDatabase(config) as db:
+        return db.retrieve_data(KEYWORD_WEIGHTS_QUERY)
+
+## Ids of the keywords currently listing any of the given keyword ids as a neighbor
+@timed('mysql')
+def retrieve_keyword_neighbor_sources(keyword_ids):
+    keyword_ids = list(keyword_ids)
+    if not keyword_ids:
+        return []
+    with CS411SQLDatabase(config) as db:
+        if not keyword_neighbors_table(db):
+            return []
+        query = f"SELECT DISTINCT keyword_id FROM keyword_neighbors WHERE neighbor_id IN ({', '.join(['%s'] * len(keyword_ids))})"
+        return [row[0] for row in db.retrieve_data(query, tuple(keyword_ids), prepared = False)]
+
+## Replace the neighbor rows of the given keyword ids (all rows when keyword_ids is None) in one transaction
+@timed('mysql')
+def replace_keyword_neighbors(rows, keyword_ids = None):
+    rows = list(rows)
+    with CS411SQLDatabase(config) as db:
+        if not keyword_neighbors_table(db) and not create_keyword_neighbors_table(db):
+            logging.error("Error: keyword_neighbors table absent.")
+            return False
+        if keyword_ids is None:
+            statements = [("DELETE FROM keyword_neighbors", None)]
+        else:
+            keyword_ids = list(keyword_ids)
+            statements = [(f"DELETE FROM keyword_neighbors WHERE keyword_id IN ({', '.join(['%s'] * len(batch))})", tuple(batch))
+                          for start in range(0, len(keyword_ids), KEYWORD_NEIGHBORS_BATCH_SIZE)
+                          for batch in [keyword_ids[start:start + KEYWORD_NEIGHBORS_BATCH_SIZE]]]
+        for start in range(0, len(rows), KEYWORD_NEIGHBORS_BATCH_SIZE):
+            batch = rows[start:start + KEYWORD_NEIGHBORS_BATCH_SIZE]
+            query = "INSERT INTO keyword_neighbors (keyword_id, neighbor_id, similarity) VALUES " + ", ".join(["(%s, %s, %s)"] * len(batch))
+            statements.append((query, tuple(value for row in batch for value in row)))
+        replaced = db.transaction_execution(statements)
+    invalidate('keyword_neighbors')
+    return replaced
+
+## Neighbors for a list of keyword names: {name: [(neighbor name, similarity), ...]} by similarity descending.
+## Returns None while the table has not been built yet.
+@cached_batch('keyword_neighbors')
+@coalesced('mysql')
+def retrieve_keyword_neighbors(keywords):
+    with CS411SQLDatabase(config) as db:
+        if not keyword_neighbors_table(db):
+            return None
+        query = KEYWORD_NEIGHBORS_LOOKUP_QUERY.format(placeholders = ", ".join(["%s"] * len(keywords)))
+        result = db.retrieve_data(query, tuple(keywords), prepared = False)
+    neighbors = {keyword: [] for keyword in keywords}
+    for keyword, neighbor, similarity in result:
+        neighbors[keyword].append((neighbor, float(similarity)))
+    return neighbors
+
+## Indexes the hot paths need: {index name: (table, leading columns)}
+##  * keyword.name: keyword lookups by name (R13)
+##  * publication_keyword(keyword_id, publication_id): per-keyword joins such as the keyword_stats refresh
+MYSQL_INDEXES = {
+    'idx_keyword_name': ('keyword', ('name', )),
+    'idx_publication_keyword_keyword': ('publication_keyword', ('keyword_id', 'publication_id')),
+}
+
+## Create missing indexes; any index whose leading columns match counts as present.
+## Returns {index name: 'exists' | 'created' | 'failed'}.
+@timed('mysql')
+def ensure_indexes():
+    status = {}
+    with CS411SQLDatabase(config) as db:
+        for name, (table, columns) in MYSQL_INDEXES.items():
+            rows = db.retrieve_data("SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+                                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY INDEX_NAME, SEQ_IN_INDEX", (table, ))
+            existing = {}
+            for index_name, column in rows:
+                existing.setdefault(index_name, []).append(column)
+            if any(tuple(index_columns[:len(columns)]) == columns for index_columns in existing.values()):
+                status[name] = 'exists'
+                continue
+            query = f"ALTER TABLE `{table}` ADD INDEX `{name}` (" + ", ".join(f"`{column}`" for column in columns) + ")"
+            status[name] = 'created' if db.query_execution(query) else 'failed'
+    return status
+
+## Hot-path statements checked by verify_query_plans: {name: (query, sample values)}
+MYSQL_PLAN_CHECKS = {
+    'keyword_by_name': ("SELECT id FROM keyword WHERE name = %s", ('machine learning', )),
+    'keyword_stats_lookup': (KEYWORD_STATS_LOOKUP_QUERY.format(placeholders = "%s"), ('machine learning', )),
+    'keyword_stats_refresh': (KEYWORD_STATS_BUILD_QUERY[KEYWORD_STATS_BUILD_QUERY.index("SELECT"):].format(where = "WHERE keyword.id IN (%s) "), (1, )),
+    'favorite_keywords': ("SELECT name FROM favorite_keywords WHERE session_id = %s", ('', )),
+    'keyword_neighbors_lookup': (KEYWORD_NEIGHBORS_LOOKUP_QUERY.format(placeholders = "%s"), ('machine learning', )),
+}
+
+## access_type ALL is a table scan and index a full index scan
+SCAN_ACCESS_TYPES = ('ALL', 'index')
+
+def plan_scans(plan):
+    if isinstance(plan, dict):
+        scans = [f"{plan['table_name']} ({plan['access_type']})"] if plan.get('access_type') in SCAN_ACCESS_TYPES and 'table_name' in plan else []
+        return scans + [table for value in plan.values() for table in plan_scans(value)]
+    if isinstance(plan, list):
+        return [table for value in plan for table in plan_scans(value)]
+    return []
+
+## EXPLAIN the hot-path statements and report the tables each one scans instead of reading through an index
+@timed('mysql')
+def verify_query_plans():
+    import json
+    report = {}
+    with CS411SQLDatabase(config) as db:
+        for name, (query, values) in MYSQL_PLAN_CHECKS.items():
+            try:
+                plan = json.loads(db.retrieve_data(f"EXPLAIN FORMAT=JSON {query}", values, prepared = False)[0][0])
+                scans = plan_scans(plan)
+                report[name] = {'indexed': not scans, 'full_scans': scans}
+            except mysql.connector.Error as error:
+                report[name] = {'indexed': False, 'full_scans': [], 'error': str(error)}
+    return report
 
 ## R13: Add Indexing into the keyword table
 def add_index_to_keyword_table():
-    with CS411SQLDatabase(config) as db:
-        query = "ALTER TABLE faculty_keyword ADD INDEX idx_keyword_name (name);"
-        if db.execute_query(query):
-            logging.info("Successful: Index added to keyword table")
+    if ensure_indexes().get('idx_keyword_name') in ('exists', 'created'):
+        logging.info("Successful: Index added to keyword table")
 
 ## R14: Add trigger on faculty_keyword to make sure score is non-negative
 def add_trigger_to_faculty_keyword():
     with CS411SQLDatabase(config) as db:
-        query = ("CREATE TRIGGER faculty_keyword_score_check BEFORE INSERT ON faculty_keyword"
-                 "FOR EACH ROW"
-                 "BEGIN"
-                 "IF NEW.score < 0 THEN"
-                 "SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'score cannot be negative';"
-                 "END IF;"
+        exists = db.retrieve_data("SELECT TRIGGER_NAME FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = %s",
+                                  ('faculty_keyword_score_check', ))
+        query = ("CREATE TRIGGER faculty_keyword_score_check BEFORE INSERT ON faculty_keyword "
+                 "FOR EACH ROW "
+                 "BEGIN "
+                 "IF NEW.score < 0 THEN "
+                 "SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'score cannot be negative'; "
+                 "END IF; "
                  "END")
-        if db.execute_query(query):
+        if exists or db.query_execution(query):
             logging.info("Successful: Trigger added to faculty_keyword table ensure non-negative score")
 
 ## R15: Create view from faculty and university to show faculty from 'University of Illinois at Urbana Champaign'
 def show_faculty_from_uiuc():
     with CS411SQLDatabase(config) as db:
-        query = ("CREATE VIEW facutly_uiuc AS"
-                 "SELECT faculty.name"
-                 "FROM faculty, university"
-                 "WHERE faculty.university_id == university.id AND university.name = 'University of Illinois at Urbana Champaign'")
-        if db.execute_query(query):
+        query = ("CREATE OR REPLACE VIEW faculty_uiuc AS "
+                 "SELECT faculty.name "
+                 "FROM faculty JOIN university ON faculty.university_id = university.id "
+                 "WHERE university.name = 'University of Illinois at Urbana Champaign'")
+        if db.query_execution(query):
             logging.info("Successful: View created for faculty from UIUC")
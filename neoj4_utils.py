@@ -1,98 +1,601 @@
-from neo4j import GraphDatabase
-import pandas as pd
+import logging
+import threading
+import time
+
+from cache_utils import cached, cached_batch, invalidate
+from concurrency_utils import Overloaded, run_query
+from metrics_utils import read_only, record_query, register_explainer, timed
+
+## Driver pool settings sized for many concurrent Dash workers/threads
+driver_config = {
+    'max_connection_pool_size': 50,
+    'connection_acquisition_timeout': 10,
+    'max_connection_lifetime': 3600,
+    'keep_alive': True
+}
 
 class Neo4jConnect:
-    def __init__(self, url, user, password):
+    def __init__(self, url, user, password, **config):
         self.__url = url
         self.__user = user
         self.__password = password
         self.__driver = None
         try:
-            self.__driver = GraphDatabase.driver(self.__url, auth = (self.__user, self.__password))
+            from neo4j import GraphDatabase
+            self.__driver = GraphDatabase.driver(self.__url, auth = (self.__user, self.__password), **{**driver_config, **config})
         except Exception as e:
             print("Failed to create the driver: ", e)
         
     def close(self):
         if self.__driver is not None:
             self.__driver.close()
+
+    ## Sessions are cheap and per call; the driver pools the underlying connections
+    def __run(self, query, db, parameters):
+        with self.__driver.session(database = db, fetch_size = -1) as session:
+            return list(session.run(query, parameters))
     
-    def query_validation(self, query, db = None):
+    def query_validation(self, query, db = None, parameters = None):
         assert self.__driver is not None, "Initialize dirver fail"
-        session = None
         respond = None
+        start = time.perf_counter()
         try:
-            if db is not None:
-                session = self.__driver.session(database = db)
-            else:
-                self.__driver.session()
-            respond = list(session.run(query))
+            ## Identical reads in flight are run once; writes and DDL always run, each waiting for a Neo4j slot
+            key = (db, query, repr(sorted((parameters or {}).items()))) if read_only(query) else None
+            respond = run_query('neo4j', key, self.__run, query, db, parameters)
+        except Overloaded as e:
+            logging.warning(f"Query shed: {e}")
         except Exception as e:
-            print("Query not valid: ", e)
-        finally:
-            if session is not None:
-                session.close()
+            logging.error(f"Query not valid: {e}")
+        record_query('neo4j', query, parameters, time.perf_counter() - start, error = respond is None)
         return respond
+
+    ## Query plan (EXPLAIN) or executed profile (PROFILE) for the slow-query log
+    def explain(self, query, db = None, parameters = None, mode = 'EXPLAIN'):
+        assert self.__driver is not None, "Initialize dirver fail"
+        with self.__driver.session(database = db) as session:
+            summary = session.run(f"{mode} {query}", parameters).consume()
+            return summary.profile if mode == 'PROFILE' else summary.plan
     
 ## Connect to neo4j local server (change user name and password)
-connection = Neo4jConnect(url = 'bolt://localhost:7687', user = 'neo4j', password = 'test_root')
+neo4j_config = {
+    'url': 'bolt://localhost:7687',
+    'user': 'neo4j',
+    'password': 'test_root'
+}
+
+## The driver is created on first use so importing this module stays cheap
+_connection = None
+_connection_lock = threading.Lock()
+
+def get_connection():
+    global _connection
+    if _connection is None:
+        with _connection_lock:
+            if _connection is None:
+                _connection = Neo4jConnect(**neo4j_config)
+    return _connection
+
+register_explainer('neo4j', lambda query, parameters, mode: get_connection().explain(query, 'academicworld', parameters, mode))
+
+def close_connection():
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+        _connection = None
+
+## In a forked child: forget the parent's driver without closing it; the next call creates a new one
+def reset_connection():
+    global _connection, _connection_lock
+    _connection = None
+    _connection_lock = threading.Lock()
+
+## KRC index: keyword x faculty and keyword x institute score aggregates materialized as
+## FACULTY_KRC / INSTITUTE_KRC relationships, plus the per-label citation total used by Query 1
+## stored on LABEL_BY as krcCitations. Each indexed faculty keeps the institute ids its rows were
+## counted under (krcInstitutes), so an update also fixes institutes it has since left. A KRC_INDEX
+## node records when it was last refreshed; it only exists while the index is complete.
+KRC_DROP_MARKER_QUERY = '''
+    MATCH (m:KRC_INDEX {name: 'krc'}) DETACH DELETE m
+'''
+
+KRC_CLEAR_QUERIES = [
+    '''
+    MATCH ()-[r:FACULTY_KRC|INSTITUTE_KRC]->()
+    CALL { WITH r DELETE r } IN TRANSACTIONS OF 10000 ROWS
+    ''',
+    '''
+    MATCH (f:FACULTY) WHERE f.krcInstitutes IS NOT NULL
+    CALL { WITH f REMOVE f.krcInstitutes } IN TRANSACTIONS OF 10000 ROWS
+    ''',
+]
+
+KRC_BUILD_QUERIES = [
+    '''
+    MATCH (f:FACULTY) WHERE (f)-[:AFFILIATION_WITH]->(:INSTITUTE)
+    CALL {
+        WITH f
+        SET f.krcInstitutes = [(f) - [:AFFILIATION_WITH] -> (i:INSTITUTE) | i.id]
+        WITH f
+        MATCH (f) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k:KEYWORD)
+        WITH f, k, SUM(l.score * p.numCitations) AS score
+        CREATE (f) - [:FACULTY_KRC {score: score}] -> (k)
+    } IN TRANSACTIONS OF 500 ROWS
+    ''',
+    '''
+    MATCH (i:INSTITUTE)
+    CALL {
+        WITH i
+        MATCH (i) <- [:AFFILIATION_WITH] - (:FACULTY) - [r:FACULTY_KRC] -> (k:KEYWORD)
+        WITH i, k, SUM(r.score) AS score
+        CREATE (i) - [:INSTITUTE_KRC {score: score}] -> (k)
+    } IN TRANSACTIONS OF 50 ROWS
+    ''',
+    '''
+    MATCH (p:PUBLICATION)
+    CALL {
+        WITH p
+        OPTIONAL MATCH (i:INSTITUTE) <- [:AFFILIATION_WITH] - (:FACULTY) - [:PUBLISH] -> (p)
+        WITH p, COUNT(i) AS paths
+        MATCH (p) - [l:LABEL_BY] -> (:KEYWORD)
+        SET l.krcCitations = CASE WHEN paths > 0 THEN p.numCitations * paths END
+    } IN TRANSACTIONS OF 1000 ROWS
+    ''',
+    '''
+    MERGE (m:KRC_INDEX {name: 'krc'})
+    SET m.refreshedAt = datetime()
+    ''',
+]
+
+## Incremental refresh: recompute whole FACULTY_KRC rows for faculty touching the changed
+## publications (so removed labels drop out), then the institute rows those faculty feed now or fed
+## when last indexed (krcInstitutes), then record the faculty's current institutes.
+KRC_UPDATE_QUERIES = [
+    '''
+    OPTIONAL MATCH (pf:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) WHERE p.id IN $publication_ids
+    WITH COLLECT(DISTINCT pf) AS published
+    OPTIONAL MATCH (ff:FACULTY) WHERE ff.id IN $faculty_ids
+    WITH published + COLLECT(DISTINCT ff) AS faculty
+    UNWIND faculty AS f
+    WITH DISTINCT f
+    CALL { WITH f MATCH (f) - [r:FACULTY_KRC] -> () DELETE r }
+    WITH f WHERE (f)-[:AFFILIATION_WITH]->(:INSTITUTE)
+    MATCH (f) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k:KEYWORD)
+    WITH f, k, SUM(l.score * p.numCitations) AS score
+    CREATE (f) - [:FACULTY_KRC {score: score}] -> (k)
+    ''',
+    '''
+    OPTIONAL MATCH (pi:INSTITUTE) <- [:AFFILIATION_WITH] - (:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) WHERE p.id IN $publication_ids
+    WITH COLLECT(DISTINCT pi) AS published
+    OPTIONAL MATCH (fi:INSTITUTE) <- [:AFFILIATION_WITH] - (f:FACULTY) WHERE f.id IN $faculty_ids
+    WITH published + COLLECT(DISTINCT fi) AS institutes
+    OPTIONAL MATCH (f:FACULTY) WHERE f.id IN $faculty_ids
+    OPTIONAL MATCH (oi:INSTITUTE) WHERE oi.id IN f.krcInstitutes
+    WITH institutes + COLLECT(DISTINCT oi) AS institutes
+    UNWIND institutes AS i
+    WITH DISTINCT i
+    CALL { WITH i MATCH (i) - [r:INSTITUTE_KRC] -> () DELETE r }
+    MATCH (i) <- [:AFFILIATION_WITH] - (:FACULTY) - [r:FACULTY_KRC] -> (k:KEYWORD)
+    WITH i, k, SUM(r.score) AS score
+    CREATE (i) - [:INSTITUTE_KRC {score: score}] -> (k)
+    ''',
+    '''
+    MATCH (p:PUBLICATION)
+    WHERE p.id IN $publication_ids OR EXISTS { MATCH (f:FACULTY) - [:PUBLISH] -> (p) WHERE f.id IN $faculty_ids }
+    OPTIONAL MATCH (i:INSTITUTE) <- [:AFFILIATION_WITH] - (:FACULTY) - [:PUBLISH] -> (p)
+    WITH p, COUNT(i) AS paths
+    MATCH (p) - [l:LABEL_BY] -> (:KEYWORD)
+    SET l.krcCitations = CASE WHEN paths > 0 THEN p.numCitations * paths END
+    ''',
+    '''
+    MATCH (f:FACULTY) WHERE f.id IN $faculty_ids
+    SET f.krcInstitutes = [(f) - [:AFFILIATION_WITH] -> (i:INSTITUTE) | i.id]
+    ''',
+    '''
+    MERGE (m:KRC_INDEX {name: 'krc'})
+    SET m.refreshedAt = datetime()
+    ''',
+]
+
+## Seconds before the KRC_INDEX marker is looked up again, so a missing index costs one query per
+## interval rather than one per widget call, and a rebuild started elsewhere is noticed
+KRC_INDEX_RECHECK_SECONDS = 30
+
+_krc_index_ready = False
+_krc_index_checked = None
+
+def krc_index_ready():
+    global _krc_index_ready, _krc_index_checked
+    now = time.monotonic()
+    if _krc_index_checked is None or now - _krc_index_checked >= KRC_INDEX_RECHECK_SECONDS:
+        _krc_index_checked = now
+        query = "MATCH (m:KRC_INDEX {name: 'krc'}) RETURN m.refreshedAt AS refreshed"
+        _krc_index_ready = bool(get_connection().query_validation(query, db = 'academicworld'))
+    return _krc_index_ready
+
+## Rebuild the whole KRC index (run after bulk loads). The marker is deleted first, then the rows
+## are only cleared once every serving process has rechecked it (KRC_INDEX_RECHECK_SECONDS, plus
+## grace for queries already running), so the widgets use the traversal queries until the rebuild
+## is complete.
+@timed('neo4j')
+def refresh_krc_index(grace = 5):
+    global _krc_index_ready, _krc_index_checked
+    _krc_index_ready = False
+    _krc_index_checked = time.monotonic()
+    if get_connection().query_validation(KRC_DROP_MARKER_QUERY, db = 'academicworld') is None:
+        return False
+    logging.info(f"KRC index marker dropped; waiting {KRC_INDEX_RECHECK_SECONDS + grace}s for the serving processes to notice")
+    time.sleep(KRC_INDEX_RECHECK_SECONDS + grace)
+    for query in KRC_CLEAR_QUERIES + KRC_BUILD_QUERIES:
+        if get_connection().query_validation(query, db = 'academicworld') is None:
+            return False
+    _krc_index_ready = True
+    _krc_index_checked = time.monotonic()
+    invalidate('neo4j')
+    return True
+
+## Refresh only the rows affected by changed publications (labels, citations) or faculty (affiliations)
+@timed('neo4j')
+def update_krc_index(publication_ids = (), faculty_ids = ()):
+    parameters = {'publication_ids': list(publication_ids), 'faculty_ids': list(faculty_ids)}
+    for query in KRC_UPDATE_QUERIES:
+        if get_connection().query_validation(query, db = 'academicworld', parameters = parameters) is None:
+            return False
+    invalidate('neo4j')
+    return True
+
+## Widget queries: 'krc' reads the KRC index, 'traversal' is the fallback before the index is built.
+## Kept together so provisioning can EXPLAIN every variant (verify_query_plans).
+WIDGET_QUERIES = {
+    'top_papers': {
+        'krc': '''
+            MATCH (k:KEYWORD {name: $keyword}) <- [l:LABEL_BY] - (p:PUBLICATION)
+            WHERE l.krcCitations IS NOT NULL
+            RETURN p.title AS publication, SUM(l.krcCitations) AS count
+            ORDER BY count DESC
+            LIMIT 10
+            ''',
+        'traversal': '''
+            MATCH (i1:INSTITUTE) <- [:AFFILIATION_WITH] - (f1:FACULTY) -[:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k:KEYWORD)
+            WHERE k.name = $keyword
+            RETURN p.title AS publication, SUM(p.numCitations) AS count
+            ORDER BY count DESC
+            LIMIT 10
+            ''',
+    },
+    'top_faculty': {
+        'krc': '''
+            MATCH (k:KEYWORD {name: $keyword}) <- [r:FACULTY_KRC] - (f:FACULTY) - [:AFFILIATION_WITH] -> (i:INSTITUTE)
+            RETURN f.name AS faculty, i.name AS school, SUM(r.score) AS total_score
+            ORDER BY total_score DESC
+            LIMIT 10
+            ''',
+        'traversal': '''
+            MATCH (i:INSTITUTE) <- [:AFFILIATION_WITH] - (f:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k:KEYWORD)
+            WHERE k.name = $keyword
+            RETURN f.name AS faculty, i.name AS school, SUM(l.score * p.numCitations) AS total_score
+            ORDER BY total_score DESC
+            LIMIT 10
+            ''',
+    },
+    'school_keywords': {
+        'krc': '''
+            MATCH (i1:INSTITUTE {name: $university}) - [r:INSTITUTE_KRC] -> (k:KEYWORD)
+            RETURN k.name AS keyword, SUM(r.score) AS `krc score`
+            ORDER BY `krc score` DESC
+            LIMIT 10
+            ''',
+        'traversal': '''
+            MATCH (i1:INSTITUTE) <- [:AFFILIATION_WITH] - (f1:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k:KEYWORD)
+            WHERE i1.name = $university
+            RETURN k.name AS keyword, SUM(l.score * p.numCitations) AS `krc score`
+            ORDER BY `krc score` DESC
+            LIMIT 10
+            ''',
+    },
+    'keyword_details': {
+        'krc': '''
+            MATCH (k:KEYWORD {name: $keyword})
+            CALL {
+                WITH k
+                MATCH (k) <- [l:LABEL_BY] - (p:PUBLICATION)
+                WHERE l.krcCitations IS NOT NULL
+                WITH p.title AS publication, SUM(l.krcCitations) AS count
+                ORDER BY count DESC
+                LIMIT 10
+                RETURN COLLECT({publication: publication, count: count}) AS papers
+            }
+            CALL {
+                WITH k
+                MATCH (k) <- [r:FACULTY_KRC] - (f:FACULTY) - [:AFFILIATION_WITH] -> (i:INSTITUTE)
+                WITH f.name AS faculty, i.name AS school, SUM(r.score) AS total_score
+                ORDER BY total_score DESC
+                LIMIT 10
+                RETURN COLLECT({faculty: faculty, school: school, total_score: total_score}) AS faculty
+            }
+            RETURN papers, faculty
+            ''',
+        'traversal': '''
+            MATCH (k:KEYWORD {name: $keyword})
+            CALL {
+                WITH k
+                MATCH (i1:INSTITUTE) <- [:AFFILIATION_WITH] - (f1:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k)
+                WITH p.title AS publication, SUM(p.numCitations) AS count
+                ORDER BY count DESC
+                LIMIT 10
+                RETURN COLLECT({publication: publication, count: count}) AS papers
+            }
+            CALL {
+                WITH k
+                MATCH (i:INSTITUTE) <- [:AFFILIATION_WITH] - (f:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k)
+                WITH f.name AS faculty, i.name AS school, SUM(l.score * p.numCitations) AS total_score
+                ORDER BY total_score DESC
+                LIMIT 10
+                RETURN COLLECT({faculty: faculty, school: school, total_score: total_score}) AS faculty
+            }
+            RETURN papers, faculty
+            ''',
+    },
+    ## Batched over $keywords: one round trip returns the top 10 per keyword
+    'batch_papers': {
+        'krc': '''
+            UNWIND $keywords AS keyword
+            MATCH (k:KEYWORD {name: keyword})
+            CALL {
+                WITH k
+                MATCH (k) <- [l:LABEL_BY] - (p:PUBLICATION)
+                WHERE l.krcCitations IS NOT NULL
+                WITH p.title AS publication, SUM(l.krcCitations) AS count
+                ORDER BY count DESC
+                LIMIT 10
+                RETURN COLLECT({publication: publication, count: count}) AS papers
+            }
+            RETURN keyword, papers
+            ''',
+        'traversal': '''
+            UNWIND $keywords AS keyword
+            MATCH (k:KEYWORD {name: keyword})
+            CALL {
+                WITH k
+                MATCH (i1:INSTITUTE) <- [:AFFILIATION_WITH] - (f1:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k)
+                WITH p.title AS publication, SUM(p.numCitations) AS count
+                ORDER BY count DESC
+                LIMIT 10
+                RETURN COLLECT({publication: publication, count: count}) AS papers
+            }
+            RETURN keyword, papers
+            ''',
+    },
+    'batch_faculty': {
+        'krc': '''
+            UNWIND $keywords AS keyword
+            MATCH (k:KEYWORD {name: keyword})
+            CALL {
+                WITH k
+                MATCH (k) <- [r:FACULTY_KRC] - (f:FACULTY) - [:AFFILIATION_WITH] -> (i:INSTITUTE)
+                WITH f.name AS faculty, i.name AS school, SUM(r.score) AS total_score
+                ORDER BY total_score DESC
+                LIMIT 10
+                RETURN COLLECT({faculty: faculty, school: school, total_score: total_score}) AS faculty
+            }
+            RETURN keyword, faculty
+            ''',
+        'traversal': '''
+            UNWIND $keywords AS keyword
+            MATCH (k:KEYWORD {name: keyword})
+            CALL {
+                WITH k
+                MATCH (i:INSTITUTE) <- [:AFFILIATION_WITH] - (f:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k)
+                WITH f.name AS faculty, i.name AS school, SUM(l.score * p.numCitations) AS total_score
+                ORDER BY total_score DESC
+                LIMIT 10
+                RETURN COLLECT({faculty: faculty, school: school, total_score: total_score}) AS faculty
+            }
+            RETURN keyword, faculty
+            ''',
+    },
+}
 
 ## Query 1: Display the 10 most cited research paper with selected keyword.
+@timed('neo4j')
+@cached('neo4j')
+def get_top_10_cited_research_paper_by_keyword_records(keyword):
+    query = WIDGET_QUERIES['top_papers']['krc' if krc_index_ready() else 'traversal']
+    result = get_connection().query_validation(query, db = 'academicworld', parameters = {'keyword': keyword})
+    return None if result is None else [dict(record) for record in result]
+
 def get_top_10_cited_research_paper_by_keyword(keyword):
-    query = f'''
-        MATCH (i1:INSTITUTE) <- [:AFFILIATION_WITH] - (f1:FACULTY) -[:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k:KEYWORD)
-        WHERE k.name = "{keyword}"
-        RETURN p.title, SUM(p.numCitations) AS count
-        ORDER BY count DESC
-        LIMIT 10
-    '''
-    result = connection.query_validation(query, db = 'academicworld')
-    dataframe = pd.DataFrame([dict(_) for _ in result]).rename(columns = {'p.title': 'publication'})
-    return dataframe
+    import pandas as pd
+    return pd.DataFrame(get_top_10_cited_research_paper_by_keyword_records(keyword), columns = ['publication', 'count'])
 
 ## Query 2: By selecting the keyword, display the top professor that has highest KRC score.
+@timed('neo4j')
+@cached('neo4j')
+def get_top_10_faculty_by_keywords_records(keyword):
+    query = WIDGET_QUERIES['top_faculty']['krc' if krc_index_ready() else 'traversal']
+    result = get_connection().query_validation(query, db = 'academicworld', parameters = {'keyword': keyword})
+    return None if result is None else [dict(record) for record in result]
+
 def get_top_10_faculty_by_keywords(keyword):
-    query = f'''
-        MATCH (i:INSTITUTE) <- [:AFFILIATION_WITH] - (f:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k:KEYWORD)
-        WHERE k.name = '{keyword}'
-        RETURN f.name, i.name, SUM(l.score * p.numCitations) AS total_score
-        ORDER BY total_score DESC
-        LIMIT 10
-        '''
-    result = connection.query_validation(query, db = 'academicworld')
-    dataframe = pd.DataFrame([dict(_) for _ in result]).rename(columns = {'f.name': 'faculty', 'i.name': 'school'})
-    return dataframe
+    import pandas as pd
+    return pd.DataFrame(get_top_10_faculty_by_keywords_records(keyword), columns = ['faculty', 'school', 'total_score'])
 
 ## Query 3: By selecting the university, it will display the top 10 keywords of the school and the KRC score into pie chart.
+@timed('neo4j')
+@cached('neo4j')
+def get_top_10_keywords_by_School_records(university):
+    query = WIDGET_QUERIES['school_keywords']['krc' if krc_index_ready() else 'traversal']
+    result = get_connection().query_validation(query, db = 'academicworld', parameters = {'university': university})
+    return None if result is None else [dict(record) for record in result]
+
 def get_top_10_keywords_by_School(university):
-    query = f'''
-        MATCH (i1:INSTITUTE) <- [:AFFILIATION_WITH] - (f1:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k:KEYWORD)
-        WHERE i1.name = '{university}'
-        RETURN k.name, SUM(l.score * p.numCitations) AS total_score
-        ORDER BY total_score DESC
-        LIMIT 10
-        '''
-    result = connection.query_validation(query, db = 'academicworld')
-    dataframe = pd.DataFrame([dict(_) for _ in result]).rename(columns = {'k.name': 'keyword', 'total_score': 'krc score'})
-    return dataframe
+    import pandas as pd
+    return pd.DataFrame(get_top_10_keywords_by_School_records(university), columns = ['keyword', 'krc score'])
+
+## Query 1 + 2: Top papers and top faculty for one keyword in a single round trip.
+@timed('neo4j')
+@cached('neo4j')
+def get_keyword_details_records(keyword):
+    query = WIDGET_QUERIES['keyword_details']['krc' if krc_index_ready() else 'traversal']
+    result = get_connection().query_validation(query, db = 'academicworld', parameters = {'keyword': keyword})
+    if result is None:
+        return None
+    papers = result[0]['papers'] if result else []
+    faculty = result[0]['faculty'] if result else []
+    return papers, faculty
+
+def get_keyword_details(keyword):
+    import pandas as pd
+    papers, faculty = get_keyword_details_records(keyword) or ([], [])
+    return pd.DataFrame(papers, columns = ['publication', 'count']), pd.DataFrame(faculty, columns = ['faculty', 'school', 'total_score'])
+
+## Batched Query 1 / Query 2 for comparing several keywords: {keyword: top 10 records} from one
+## UNWIND query instead of one traversal per keyword. Keywords already cached are not re-queried;
+## keywords the query returned no row for are left out, so they are neither cached nor reported as empty.
+def _batch_records(name, field, keywords):
+    query = WIDGET_QUERIES[name]['krc' if krc_index_ready() else 'traversal']
+    result = get_connection().query_validation(query, db = 'academicworld', parameters = {'keywords': list(keywords)})
+    if result is None:
+        return None
+    records = {}
+    for record in result:
+        records[record['keyword']] = records.get(record['keyword']) or record[field]
+    return records
+
+@timed('neo4j')
+@cached_batch('neo4j')
+def get_top_10_cited_research_paper_by_keyword_batch(keywords):
+    return _batch_records('batch_papers', 'papers', keywords)
+
+@timed('neo4j')
+@cached_batch('neo4j')
+def get_top_10_faculty_by_keyword_batch(keywords):
+    return _batch_records('batch_faculty', 'faculty', keywords)
 
 ## Get all keywords for selection
+@timed('neo4j')
+@cached('neo4j')
 def get_all_keywords():
     query = '''
             MATCH (k:KEYWORD)
             RETURN k.name as name
             ORDER BY name
             '''
-    result = connection.query_validation(query, db = 'academicworld')
+    result = get_connection().query_validation(query, db = 'academicworld')
+    if result is None:
+        return None
     keywords = [keyword['name'] for keyword in result]
     return keywords
 
 ## Get all universities for selection 
+@timed('neo4j')
+@cached('neo4j')
 def get_all_universities():
     query = '''
             MATCH (n:INSTITUTE)
             RETURN n.name as name
             ORDER BY name
             '''
-    result = connection.query_validation(query, db='academicworld')
+    result = get_connection().query_validation(query, db='academicworld')
+    if result is None:
+        return None
     universities = [record['name'] for record in result]
     return universities
+
+## University popularity (affiliated faculty count) for ranking search-as-you-type suggestions
+@timed('neo4j')
+@cached('neo4j')
+def get_university_popularity():
+    query = '''
+            MATCH (i:INSTITUTE)
+            OPTIONAL MATCH (i) <- [:AFFILIATION_WITH] - (f:FACULTY)
+            RETURN i.name AS name, COUNT(f) AS faculty
+            '''
+    result = get_connection().query_validation(query, db='academicworld')
+    return None if result is None else {record['name']: record['faculty'] for record in result}
+
+## Raw relations for the columnar snapshot (snapshot_utils), one flat row per node or relationship
+SNAPSHOT_QUERIES = {
+    'keywords': "MATCH (k:KEYWORD) RETURN k.id AS id, k.name AS name",
+    'institutes': "MATCH (i:INSTITUTE) RETURN i.id AS id, i.name AS name",
+    'faculty': "MATCH (f:FACULTY) RETURN f.id AS id, f.name AS name",
+    'publications': "MATCH (p:PUBLICATION) RETURN p.id AS id, p.title AS title, p.year AS year, p.numCitations AS citations",
+    'affiliations': "MATCH (f:FACULTY) - [:AFFILIATION_WITH] -> (i:INSTITUTE) RETURN f.id AS faculty, i.id AS institute",
+    'publishes': "MATCH (f:FACULTY) - [:PUBLISH] -> (p:PUBLICATION) RETURN f.id AS faculty, p.id AS publication",
+    'labels': "MATCH (p:PUBLICATION) - [l:LABEL_BY] -> (k:KEYWORD) RETURN p.id AS publication, k.id AS keyword, l.score AS score",
+}
+
+@timed('neo4j')
+def get_snapshot_relations():
+    relations = {}
+    for name, query in SNAPSHOT_QUERIES.items():
+        result = get_connection().query_validation(query, db = 'academicworld')
+        if result is None:
+            return None
+        relations[name] = [dict(record) for record in result]
+    return relations
+
+
+## Indexes the widget queries seek on: {index name: (label, property)}
+NEO4J_INDEXES = {
+    'keyword_name': ('KEYWORD', 'name'),
+    'institute_name': ('INSTITUTE', 'name'),
+}
+
+## Create missing indexes (an index on the same label and property under any name counts)
+## and wait for them to come online. Returns {index name: 'exists' | 'created' | 'failed'}.
+@timed('neo4j')
+def ensure_indexes(timeout = 300):
+    connection = get_connection()
+    existing = connection.query_validation("SHOW INDEXES YIELD labelsOrTypes, properties", db = 'academicworld')
+    if existing is None:
+        return {name: 'failed' for name in NEO4J_INDEXES}
+    existing = {(label, tuple(record['properties'] or ())) for record in existing for label in record['labelsOrTypes'] or ()}
+    status = {}
+    for name, (label, field) in NEO4J_INDEXES.items():
+        if (label, (field, )) in existing:
+            status[name] = 'exists'
+            continue
+        query = f"CREATE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{field})"
+        status[name] = 'failed' if connection.query_validation(query, db = 'academicworld') is None else 'created'
+    if 'created' in status.values():
+        connection.query_validation(f"CALL db.awaitIndexes({int(timeout)})", db = 'academicworld')
+    return status
+
+## Operators that read every node (of a label) instead of seeking an index
+SCAN_OPERATORS = ('AllNodesScan', 'NodeByLabelScan')
+
+def plan_scans(plan):
+    ## Driver 5 returns the plan as a dict; older drivers return Plan objects
+    if isinstance(plan, dict):
+        operator, arguments, children = plan.get('operatorType', ''), plan.get('arguments', {}), plan.get('children', [])
+    else:
+        operator, arguments, children = getattr(plan, 'operator_type', ''), getattr(plan, 'arguments', {}), getattr(plan, 'children', [])
+    operator = operator.split('@')[0]
+    scans = [f"{operator} {arguments.get('Details', '')}".strip()] if operator in SCAN_OPERATORS else []
+    for child in children or []:
+        scans += plan_scans(child)
+    return scans
+
+## EXPLAIN every widget query variant and report the ones that scan nodes instead of seeking an index
+@timed('neo4j')
+def verify_query_plans(keyword = 'machine learning', university = 'University of Illinois at Urbana Champaign'):
+    parameters = {'keyword': keyword, 'keywords': [keyword], 'university': university}
+    report = {}
+    for name, variants in WIDGET_QUERIES.items():
+        for variant, query in variants.items():
+            try:
+                scans = plan_scans(get_connection().explain(query, 'academicworld', parameters, 'EXPLAIN'))
+                report[f"{name}.{variant}"] = {'indexed': not scans, 'full_scans': scans}
+            except Exception as error:
+                report[f"{name}.{variant}"] = {'indexed': False, 'full_scans': [], 'error': str(error)}
+    return report
+
+
+if __name__ == '__main__':
+    ## Refresh command: python neoj4_utils.py refresh-krc
+    import sys
+    if sys.argv[1:] == ['refresh-krc']:
+        print("KRC index refreshed" if refresh_krc_index() else "KRC index refresh failed")
+        close_connection()
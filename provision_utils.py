@@ -0,0 +1,97 @@
+import argparse
+import json
+import logging
+import sys
+
+## Schema and index provisioning across the three stores. Each store module declares the indexes
+## its hot paths need (MYSQL_INDEXES, NEO4J_INDEXES, MONGODB_INDEXES) and exposes
+## ensure_indexes() (idempotent) and verify_query_plans() (EXPLAIN every widget query and list
+## the ones that fall back to a full scan). Derived tables the widgets read (DERIVED_TABLES) are
+## built here too when absent, never on a request. Run once after loading academicworld:
+##     python provision_utils.py [--stores mysql,neo4j,mongodb] [--no-verify]
+STORES = ('mysql', 'neo4j', 'mongodb')
+
+## {table: (store, module, function)}; the function builds the table if it is absent and returns
+## 'exists', 'created' or 'failed'
+DERIVED_TABLES = {
+    'keyword_stats': ('mysql', 'mysql_utils', 'ensure_keyword_stats'),
+    'keyword_neighbors': ('mysql', 'recommend_utils', 'ensure_keyword_neighbors'),
+}
+
+def ensure_derived_tables(store):
+    import importlib
+    status = {}
+    for table, (table_store, module, function) in DERIVED_TABLES.items():
+        if table_store != store:
+            continue
+        try:
+            status[table] = getattr(importlib.import_module(module), function)()
+        except Exception as error:
+            logging.error(f"Building {table} failed: {error}")
+            status[table] = 'failed'
+    return status
+
+def store_module(store):
+    if store == 'mysql':
+        import mysql_utils
+        return mysql_utils
+    if store == 'neo4j':
+        import neoj4_utils
+        return neoj4_utils
+    if store == 'mongodb':
+        import mongodb_utils
+        return mongodb_utils
+    raise ValueError(f"Unknown store {store}")
+
+## Returns {'indexes': {store: {index: status}}, 'tables': {store: {table: status}},
+## 'plans': {store: {query: plan summary}}, 'full_scans': [...]}
+def provision(stores = STORES, verify = True):
+    report = {'indexes': {}, 'tables': {}, 'plans': {}, 'full_scans': []}
+    for store in stores:
+        module = store_module(store)
+        try:
+            report['indexes'][store] = module.ensure_indexes()
+        except Exception as error:
+            logging.error(f"Index provisioning failed for {store}: {error}")
+            report['indexes'][store] = {'error': str(error)}
+            continue
+        report['tables'][store] = ensure_derived_tables(store)
+        if not verify:
+            continue
+        try:
+            report['plans'][store] = module.verify_query_plans()
+        except Exception as error:
+            logging.error(f"Plan verification failed for {store}: {error}")
+            report['plans'][store] = {'error': str(error)}
+            continue
+        for name, plan in report['plans'][store].items():
+            if not plan['indexed']:
+                report['full_scans'].append({'store': store, 'query': name, 'scans': plan['full_scans'], 'error': plan.get('error')})
+    return report
+
+def close_clients(stores = STORES):
+    for store in stores:
+        module = store_module(store)
+        for name in ('close_pools', 'close_connection', 'close_client'):
+            if hasattr(module, name):
+                getattr(module, name)()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Create the indexes and derived tables the widget queries need and verify their plans.")
+    parser.add_argument('--stores', default = ",".join(STORES), help = f"comma separated stores from {', '.join(STORES)}")
+    parser.add_argument('--no-verify', action = 'store_true', help = "only create indexes, skip the EXPLAIN checks")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level = logging.INFO)
+
+    stores = [store for store in args.stores.split(',') if store]
+    report = provision(stores, not args.no_verify)
+    close_clients(stores)
+    print(json.dumps(report, indent = 2, default = str))
+    for scan in report['full_scans']:
+        logging.warning(f"{scan['store']} query {scan['query']} does not use an index: {scan['error'] or ', '.join(scan['scans'])}")
+    failed = any(status == 'failed' or index == 'error' for statuses in [*report['indexes'].values(), *report['tables'].values()]
+                 for index, status in statuses.items())
+    return 1 if failed or report['full_scans'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
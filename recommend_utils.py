@@ -0,0 +1,160 @@
+import logging
+import threading
+
+from array_utils import csr_offsets, expand_rows, group_sum, top_k_per_group
+from metrics_utils import timed
+
+## Keyword recommendations from publication co-occurrence. Every keyword is a sparse vector over
+## publications weighted by score * log2(2 + citations); the cosine similarity of two keywords is
+## the dot product of their vectors over the publications they share, divided by both norms.
+## Similarities are computed a block of keywords at a time by walking keyword -> publications ->
+## co-keywords (CSR arrays), so memory follows the number of co-occurring pairs in one block and
+## never an N x N matrix. The top-k neighbors of each keyword are persisted in MySQL
+## (keyword_neighbors); recommendations for a set of favorites are then one indexed lookup that
+## sums the favorites' neighbor similarities.
+recommend_config = {
+    ## Neighbors kept per keyword
+    'neighbors': 50,
+    ## Keywords per similarity block
+    'block_size': 512,
+    ## Recommendations returned
+    'limit': 10
+}
+
+class CooccurrenceMatrix:
+    ## Keyword x publication weights as CSR in both directions, from (keyword_id, publication_id, score, num_citations) rows
+    def __init__(self, rows):
+        import numpy as np
+        columns = np.array([row[:2] for row in rows], dtype = np.int64).reshape(-1, 2)
+        score = np.array([row[2] or 0 for row in rows], dtype = np.float64)
+        citations = np.array([row[3] or 0 for row in rows], dtype = np.float64)
+        self.keyword_ids, keywords = np.unique(columns[:, 0], return_inverse = True)
+        publication_ids, publications = np.unique(columns[:, 1], return_inverse = True)
+        weights = score * np.log2(2 + np.maximum(citations, 0))
+        keywords, publications = keywords.ravel(), publications.ravel()
+        self.norms = np.sqrt(np.bincount(keywords, weights = weights ** 2, minlength = len(self.keyword_ids)))
+
+        order = np.argsort(keywords, kind = 'stable')
+        self.keyword_offsets = csr_offsets(keywords, len(self.keyword_ids))
+        self.keyword_publications, self.keyword_weights = publications[order], weights[order]
+        order = np.argsort(publications, kind = 'stable')
+        self.publication_offsets = csr_offsets(publications, len(publication_ids))
+        self.publication_keywords, self.publication_weights = keywords[order], weights[order]
+
+    def __len__(self):
+        return len(self.keyword_ids)
+
+    ## Row codes of the given keyword ids (ids without publications are skipped)
+    def codes(self, keyword_ids):
+        import numpy as np
+        keyword_ids = np.asarray(list(keyword_ids), dtype = np.int64)
+        if not len(self) or not len(keyword_ids):
+            return np.zeros(0, dtype = np.int64)
+        positions = np.minimum(np.searchsorted(self.keyword_ids, keyword_ids), len(self) - 1)
+        return np.unique(positions[self.keyword_ids[positions] == keyword_ids])
+
+    ## Codes of every keyword sharing a publication with one of the given codes
+    def cooccurring(self, codes):
+        import numpy as np
+        _, positions = expand_rows(self.keyword_offsets, codes)
+        _, positions = expand_rows(self.publication_offsets, self.keyword_publications[positions])
+        return np.unique(self.publication_keywords[positions])
+
+    ## Top-k cosine neighbors of a block of keyword codes as (keyword_id, neighbor_id, similarity) arrays
+    def neighbors(self, codes, k):
+        import numpy as np
+        repeat, positions = expand_rows(self.keyword_offsets, codes)
+        weights = self.keyword_weights[positions]
+        pairs, positions = expand_rows(self.publication_offsets, self.keyword_publications[positions])
+        rows, others = repeat[pairs], self.publication_keywords[positions]
+        distinct = codes[rows] != others
+        (rows, others), dots = group_sum((rows[distinct], others[distinct]), (len(codes), len(self)),
+                                         weights[pairs[distinct]] * self.publication_weights[positions[distinct]])
+        keywords = codes[rows]
+        norms = self.norms[keywords] * self.norms[others]
+        similarity = np.divide(dots, norms, out = np.zeros_like(dots), where = norms > 0)
+        positive = np.flatnonzero(similarity > 0)
+        keep = positive[top_k_per_group(rows[positive], similarity[positive], k)]
+        return self.keyword_ids[keywords[keep]], self.keyword_ids[others[keep]], similarity[keep]
+
+def neighbor_rows(matrix, codes, k, block_size):
+    for start in range(0, len(codes), block_size):
+        keywords, neighbors, similarity = matrix.neighbors(codes[start:start + block_size], k)
+        yield from zip(keywords.tolist(), neighbors.tolist(), similarity.tolist())
+
+_refresh_lock = threading.RLock()
+
+## In a forked child: a refresh running in the parent never finishes here
+def reset_locks():
+    global _refresh_lock
+    _refresh_lock = threading.RLock()
+
+## Rebuild keyword_neighbors: everything, or only the rows a change to the given keyword ids can affect
+## (those keywords, every keyword sharing a publication with them and every keyword listing them as a
+## neighbor). Call it after publication_keyword or publication citations change.
+@timed('recommend')
+def refresh_keyword_neighbors(keyword_ids = None):
+    import numpy as np
+    from mysql_utils import replace_keyword_neighbors, retrieve_keyword_neighbor_sources, retrieve_keyword_weights
+    with _refresh_lock:
+        matrix = CooccurrenceMatrix(retrieve_keyword_weights())
+        if keyword_ids is None:
+            codes, replaced = np.arange(len(matrix)), None
+        else:
+            keyword_ids = list(keyword_ids)
+            if not keyword_ids:
+                return True
+            codes = matrix.codes(keyword_ids)
+            codes = np.union1d(codes, matrix.cooccurring(codes))
+            codes = np.union1d(codes, matrix.codes(retrieve_keyword_neighbor_sources(keyword_ids)))
+            replaced = sorted(set(keyword_ids) | set(matrix.keyword_ids[codes].tolist()))
+        rows = neighbor_rows(matrix, codes, recommend_config['neighbors'], recommend_config['block_size'])
+        refreshed = replace_keyword_neighbors(rows, replaced)
+    logging.info(f"keyword_neighbors refreshed for {len(codes)} of {len(matrix)} keywords")
+    return refreshed
+
+## Provisioning step (provision_utils.py): build keyword_neighbors unless it already holds rows.
+## Returns 'exists', 'created' or 'failed'.
+def ensure_keyword_neighbors():
+    from mysql_utils import keyword_neighbors_built
+    with _refresh_lock:
+        if keyword_neighbors_built():
+            return 'exists'
+        return 'created' if refresh_keyword_neighbors() else 'failed'
+
+## Recommended keywords for a set of favorites: neighbor similarities summed over the favorites,
+## favorites themselves excluded. Empty until keyword_neighbors has been built by provisioning or
+## the refresh command; the callback never builds it.
+@timed('recommend')
+def recommend_keywords(favorites, limit = None):
+    from mysql_utils import retrieve_keyword_neighbors
+    favorites = list(dict.fromkeys(keyword for keyword in favorites if keyword))
+    if not favorites:
+        return []
+    neighbors = retrieve_keyword_neighbors(favorites)
+    if neighbors is None:
+        return []
+
+    excluded = set(favorites)
+    scores = {}
+    related = {}
+    for favorite in favorites:
+        for neighbor, similarity in neighbors.get(favorite) or []:
+            if neighbor in excluded:
+                continue
+            scores[neighbor] = scores.get(neighbor, 0) + similarity
+            related.setdefault(neighbor, []).append(favorite)
+    ranked = sorted(scores, key = lambda keyword: (-scores[keyword], keyword))[:limit or recommend_config['limit']]
+    return [{'Keyword': keyword, 'Score': round(scores[keyword], 3), 'Related To': ", ".join(related[keyword])} for keyword in ranked]
+
+if __name__ == '__main__':
+    ## Refresh command: python recommend_utils.py refresh [keyword_id ...] (no ids rebuilds every keyword)
+    import sys
+    if sys.argv[1:2] == ['refresh']:
+        from mysql_utils import close_pools
+        logging.basicConfig(level = logging.INFO)
+        keyword_ids = [int(keyword_id) for keyword_id in sys.argv[2:]] or None
+        print("keyword_neighbors refreshed" if refresh_keyword_neighbors(keyword_ids) else "keyword_neighbors refresh failed")
+        close_pools()
+    else:
+        print("Usage: python recommend_utils.py refresh [keyword_id ...]")
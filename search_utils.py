@@ -0,0 +1,323 @@
+import bisect
+import logging
+import math
+import re
+import threading
+import time
+
+from metrics_utils import timed
+
+## Full-text publication search over titles, keyword names and faculty names. The index is an
+## inverted index held in process: a term dictionary plus CSR postings (document positions and
+## field-weighted term frequencies as NumPy arrays), built in bulk from the academicworld relations.
+## Ranking is BM25 multiplied by a citation boost, 1 + citation_boost * log(1 + numCitations).
+## The last query term also matches as a prefix, so results follow the user's typing.
+## Updates go to a small pending segment scored directly and folded into the postings arrays once
+## it reaches merge_threshold documents; until then removed documents are only masked out, and
+## document frequencies still count them. Terms first seen in pending documents are kept in a small
+## sorted side list so the prefix expansion finds them before the next merge.
+search_config = {
+    'enabled': True,
+    'limit': 10,
+    'k1': 1.2,
+    'b': 0.75,
+    'citation_boost': 0.1,
+    ## Term frequency weight per field
+    'fields': {'title': 1.0, 'keywords': 0.5, 'faculty': 0.5},
+    ## Most frequent vocabulary terms a trailing prefix expands to
+    'prefix_expansions': 10,
+    'merge_threshold': 512,
+    ## Seconds to wait after a failed build before trying again
+    'retry_seconds': 60
+}
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("a an and are as at be by for from in into is of on or the to with".split())
+
+def tokenize(text):
+    return [token for token in TOKEN.findall((text or "").lower()) if token not in STOPWORDS]
+
+class PublicationIndex:
+    def __init__(self, documents = (), fields = None, k1 = 1.2, b = 0.75, citation_boost = 0.1, prefix_expansions = 10, merge_threshold = 512):
+        import numpy as np
+        self.fields = fields or search_config['fields']
+        self.k1 = k1
+        self.b = b
+        self.citation_boost = citation_boost
+        self.prefix_expansions = prefix_expansions
+        self.merge_threshold = merge_threshold
+        self.__lock = threading.Lock()
+        self.terms = {}
+        self.ids, self.titles, self.years, self.citations, self.lengths = [], [], [], [], []
+        self.position = {}
+        self.pending = {}
+        ## Sorted tokens added since the last freeze; None during the bulk build
+        self.pending_vocabulary = None
+        terms, positions, frequencies = [], [], []
+        for document in documents:
+            analyzed = self.__analyze(document)
+            position = self.__append(document, analyzed)
+            for term, frequency in analyzed.items():
+                terms.append(term)
+                positions.append(position)
+                frequencies.append(frequency)
+        self.live = np.ones(len(self.ids), dtype = bool)
+        self.__freeze(np.array(terms, dtype = np.int64), np.array(positions, dtype = np.int64), np.array(frequencies, dtype = np.float32))
+
+    def __len__(self):
+        return len(self.position)
+
+    def reset_lock(self):
+        self.__lock = threading.Lock()
+
+    ## {term id: field-weighted frequency} for one document, new terms added to the dictionary
+    def __analyze(self, document):
+        frequencies = {}
+        for field, weight in self.fields.items():
+            values = document.get(field) or ()
+            for value in [values] if isinstance(values, str) else values:
+                for token in tokenize(value):
+                    term = self.terms.get(token)
+                    if term is None:
+                        term = self.terms[token] = len(self.terms)
+                        if self.pending_vocabulary is not None:
+                            bisect.insort(self.pending_vocabulary, token)
+                    frequencies[term] = frequencies.get(term, 0.0) + weight
+        return frequencies
+
+    ## Store a document's fields; its length is the field-weighted token count
+    def __append(self, document, analyzed):
+        position = len(self.ids)
+        self.ids.append(document['id'])
+        self.titles.append(document.get('title') or "")
+        self.years.append(document.get('year'))
+        self.citations.append(document.get('citations') or 0)
+        self.lengths.append(sum(analyzed.values()))
+        self.position[document['id']] = position
+        return position
+
+    ## Sort (term, position, frequency) triples into CSR postings and refresh the per-document arrays
+    def __freeze(self, terms, positions, frequencies):
+        import numpy as np
+        order = np.lexsort((positions, terms))
+        self.offsets = np.zeros(len(self.terms) + 1, dtype = np.int64)
+        np.cumsum(np.bincount(terms, minlength = len(self.terms)), out = self.offsets[1:])
+        self.postings = positions[order].astype(np.int32)
+        self.frequencies = frequencies[order]
+        self.frozen = len(self.ids)
+        self.document_lengths = np.array(self.lengths, dtype = np.float32)
+        self.boosts = (1 + self.citation_boost * np.log1p(np.maximum(np.array(self.citations, dtype = np.float64), 0))).astype(np.float32)
+        self.vocabulary = sorted(self.terms)
+        self.pending_vocabulary = []
+        self.vocabulary_terms = np.array([self.terms[token] for token in self.vocabulary], dtype = np.int64)
+        self.document_frequencies = np.diff(self.offsets)
+
+    ## Add or replace a publication ({'id', 'title', 'year', 'citations', 'keywords': [...], 'faculty': [...]})
+    def upsert(self, document):
+        with self.__lock:
+            self.__remove(document['id'])
+            analyzed = self.__analyze(document)
+            self.pending[self.__append(document, analyzed)] = analyzed
+            if len(self.pending) >= self.merge_threshold:
+                self.__merge()
+
+    def remove(self, publication_id):
+        with self.__lock:
+            self.__remove(publication_id)
+
+    def __remove(self, publication_id):
+        position = self.position.pop(publication_id, None)
+        if position is None:
+            return
+        if position < self.frozen:
+            self.live[position] = False
+        else:
+            self.pending.pop(position, None)
+
+    ## Fold the pending documents into the postings arrays and drop removed documents
+    def merge(self):
+        with self.__lock:
+            self.__merge()
+
+    def __merge(self):
+        import numpy as np
+        terms = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        keep = self.live[self.postings]
+        terms, positions, frequencies = [terms[keep]], [self.postings[keep].astype(np.int64)], [self.frequencies[keep]]
+        for position, document_frequencies in self.pending.items():
+            terms.append(np.fromiter(document_frequencies.keys(), dtype = np.int64, count = len(document_frequencies)))
+            positions.append(np.full(len(document_frequencies), position, dtype = np.int64))
+            frequencies.append(np.fromiter(document_frequencies.values(), dtype = np.float32, count = len(document_frequencies)))
+        ## Renumber the surviving documents densely
+        survivors = sorted(self.position.values())
+        remap = np.full(len(self.ids), -1, dtype = np.int64)
+        remap[survivors] = np.arange(len(survivors))
+        self.ids = [self.ids[position] for position in survivors]
+        self.titles = [self.titles[position] for position in survivors]
+        self.years = [self.years[position] for position in survivors]
+        self.citations = [self.citations[position] for position in survivors]
+        self.lengths = [self.lengths[position] for position in survivors]
+        self.position = {publication_id: position for position, publication_id in enumerate(self.ids)}
+        self.pending = {}
+        self.live = np.ones(len(self.ids), dtype = bool)
+        self.__freeze(np.concatenate(terms), remap[np.concatenate(positions)], np.concatenate(frequencies))
+
+    ## Term ids for a query; the last token also expands to the most frequent terms it prefixes
+    def __query_terms(self, query):
+        import numpy as np
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        terms = {self.terms[token] for token in tokens if token in self.terms}
+        ## Only a last word still being typed (no trailing space) is expanded
+        if query == query.rstrip() and TOKEN.findall(query.lower())[-1] == tokens[-1]:
+            prefix = tokens[-1]
+            start = bisect.bisect_left(self.vocabulary, prefix)
+            stop = bisect.bisect_left(self.vocabulary, prefix + "\x7f", start)
+            candidates = self.vocabulary_terms[start:stop]
+            if len(candidates) > self.prefix_expansions:
+                candidates = candidates[np.argpartition(-self.document_frequencies[candidates], self.prefix_expansions - 1)[:self.prefix_expansions]]
+            terms.update(candidates.tolist())
+            start = bisect.bisect_left(self.pending_vocabulary, prefix)
+            stop = bisect.bisect_left(self.pending_vocabulary, prefix + "\x7f", start)
+            terms.update(self.terms[token] for token in self.pending_vocabulary[start:min(stop, start + self.prefix_expansions)])
+        return sorted(terms)
+
+    def search(self, query, limit = 10):
+        import numpy as np
+        with self.__lock:
+            terms = self.__query_terms(query)
+            if not terms or not self.position:
+                return []
+            count = len(self.position)
+            average_length = max(sum(self.lengths[position] for position in self.pending) + float(self.document_lengths[self.live].sum()), 1.0) / count
+            pending_frequencies = {term: sum(term in frequencies for frequencies in self.pending.values()) for term in terms}
+            idf = {}
+            for term in terms:
+                frequency = (int(self.document_frequencies[term]) if term < len(self.document_frequencies) else 0) + pending_frequencies[term]
+                idf[term] = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+
+            ## Frozen postings: one vectorized BM25 pass over the matching postings
+            positions, contributions = [], []
+            for term in terms:
+                if term >= len(self.offsets) - 1:
+                    continue
+                start, stop = self.offsets[term], self.offsets[term + 1]
+                documents = self.postings[start:stop]
+                frequencies = self.frequencies[start:stop]
+                norms = self.k1 * (1 - self.b + self.b * self.document_lengths[documents] / average_length)
+                positions.append(documents)
+                contributions.append(idf[term] * frequencies * (self.k1 + 1) / (frequencies + norms))
+            results = []
+            if positions:
+                ## Dense accumulator: linear in documents plus postings, no sort of the matches
+                scores = np.bincount(np.concatenate(positions), weights = np.concatenate(contributions), minlength = self.frozen)
+                scores *= self.boosts
+                scores[~self.live] = 0
+                candidates = np.argpartition(-scores, limit - 1)[:limit] if len(scores) > limit else np.arange(len(scores))
+                results = [(float(scores[position]), int(position)) for position in candidates if scores[position] > 0]
+
+            ## Pending documents are few, so they are scored directly
+            for position, frequencies in self.pending.items():
+                score = 0.0
+                for term in terms:
+                    frequency = frequencies.get(term)
+                    if frequency:
+                        norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / average_length)
+                        score += idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+                if score > 0:
+                    results.append((score * (1 + self.citation_boost * math.log1p(max(self.citations[position], 0))), position))
+
+            results.sort(key = lambda result: (-result[0], self.titles[result[1]]))
+            return [{'id': self.ids[position], 'title': self.titles[position], 'year': self.years[position],
+                     'citations': self.citations[position], 'score': round(score, 3)} for score, position in results[:limit]]
+
+## Publication documents from the relations neoj4_utils.get_snapshot_relations() returns
+def publication_documents(relations):
+    keyword_names = {keyword['id']: keyword['name'] for keyword in relations['keywords']}
+    faculty_names = {faculty['id']: faculty['name'] for faculty in relations['faculty']}
+    keywords, faculty = {}, {}
+    for label in relations['labels']:
+        keywords.setdefault(label['publication'], []).append(keyword_names.get(label['keyword']))
+    for publish in relations['publishes']:
+        faculty.setdefault(publish['publication'], []).append(faculty_names.get(publish['faculty']))
+    for publication in relations['publications']:
+        yield {
+            'id': publication['id'],
+            'title': publication['title'],
+            'year': publication['year'],
+            'citations': publication['citations'],
+            'keywords': [name for name in keywords.get(publication['id'], ()) if name],
+            'faculty': [name for name in faculty.get(publication['id'], ()) if name]
+        }
+
+_index = None
+_index_lock = threading.Lock()
+_index_failed = None
+
+## In a forked child: the index is shared copy-on-write, only the locks are replaced
+def reset_locks():
+    global _index_lock
+    _index_lock = threading.Lock()
+    if _index is not None:
+        _index.reset_lock()
+
+## Build the index from the given relations, the columnar snapshot when one is configured, or Neo4j,
+## and swap it in
+@timed('search')
+def build_publication_index(relations = None):
+    global _index, _index_failed
+    from snapshot_utils import get_engine, snapshot_config
+    if relations is not None:
+        documents = publication_documents(relations)
+    elif snapshot_config['path']:
+        documents = get_engine().publication_documents()
+    else:
+        from neoj4_utils import get_snapshot_relations
+        relations = get_snapshot_relations()
+        if relations is None:
+            _index_failed = time.monotonic()
+            return None
+        documents = publication_documents(relations)
+    index = PublicationIndex(documents, search_config['fields'], search_config['k1'], search_config['b'],
+                             search_config['citation_boost'], search_config['prefix_expansions'], search_config['merge_threshold'])
+    _index, _index_failed = index, None
+    return index
+
+## Built on first use by one caller; the others get None (no results) instead of queueing behind the
+## build, and after a failed build nobody retries for retry_seconds
+def get_publication_index():
+    global _index_failed
+    if _index is None and (_index_failed is None or time.monotonic() - _index_failed >= search_config['retry_seconds']):
+        if _index_lock.acquire(blocking = False):
+            try:
+                if _index is None:
+                    try:
+                        build_publication_index()
+                    except Exception as error:
+                        logging.error(f"Publication index build failed: {error}")
+                        _index_failed = time.monotonic()
+            finally:
+                _index_lock.release()
+    return _index
+
+## Publications matching free text, best first: [{'id', 'title', 'year', 'citations', 'score'}]
+@timed('search')
+def search_publications(query, limit = None):
+    if not search_config['enabled'] or not (query or "").strip():
+        return []
+    index = get_publication_index()
+    if index is None:
+        return []
+    return index.search(query, limit or search_config['limit'])
+
+## Incremental updates, e.g. after a publication is added or edited in the graph
+def upsert_publication(document):
+    index = get_publication_index()
+    if index is not None:
+        index.upsert(document)
+
+def remove_publication(publication_id):
+    index = get_publication_index()
+    if index is not None:
+        index.remove(publication_id)
@@ -0,0 +1,67 @@
+import gc
+import logging
+import os
+
+## Multi-process serving. The app module is imported once in the server's master process, so the
+## startup data (dropdown options, suggestion indexes, keyword cube, snapshot mappings) is built
+## before the workers fork and shared copy-on-write. Database clients are not fork-safe: the master
+## closes its own before forking and every worker starts with fresh, lazily created clients.
+serving_config = {
+    'bind': os.environ.get('KEYWORD_EXPLORE_BIND', '0.0.0.0:8050'),
+    'workers': int(os.environ.get('KEYWORD_EXPLORE_WORKERS', os.cpu_count() or 1)),
+    'threads': int(os.environ.get('KEYWORD_EXPLORE_THREADS', 4)),
+    'timeout': int(os.environ.get('KEYWORD_EXPLORE_TIMEOUT', 60))
+}
+
+## Parent side of a fork: close the clients the startup queries opened, stop the fan-out threads,
+## and move the preloaded objects out of the collector's reach so reference counting in the
+## workers doesn't copy their pages
+def before_fork():
+    from fanout_utils import shutdown_executor
+    from mongodb_utils import close_client
+    from mysql_utils import close_pools
+    from neoj4_utils import close_connection
+    for close in (close_pools, close_connection, close_client, shutdown_executor):
+        try:
+            close()
+        except Exception as error:
+            logging.warning(f"{close.__name__} failed before fork: {error}")
+    gc.freeze()
+
+## Modules whose module-level locks are replaced in each worker (reset_locks())
+LOCK_MODULES = ('metrics_utils', 'cache_utils', 'mongodb_utils', 'favorites_utils', 'suggest_utils', 'search_utils', 'snapshot_utils', 'recommend_utils')
+
+## Child side: drop any inherited client state so each worker connects on first use, and replace
+## every module lock, since one held by another thread at fork time would never be released here
+def after_fork():
+    import importlib
+    from concurrency_utils import reset_concurrency
+    from fanout_utils import reset_executor
+    from mongodb_utils import reset_client
+    from mysql_utils import reset_pools
+    from neoj4_utils import reset_connection
+    reset_pools()
+    reset_connection()
+    reset_client()
+    reset_executor()
+    reset_concurrency()
+    for module in LOCK_MODULES:
+        importlib.import_module(module).reset_locks()
+    logging.info(f"Worker {os.getpid()} initialized")
+
+## Master side, once the app is imported: build what the workers should share instead of each
+## building it on first use. Plain imports of the app (scripts, the debug reloader) skip this and
+## build the publication index lazily.
+def preload():
+    from search_utils import get_publication_index, search_config
+    if search_config['enabled']:
+        get_publication_index()
+
+_hooks_installed = False
+
+## Run the hooks around every os.fork(), so any pre-forking server (gunicorn, uWSGI) is covered
+def install_fork_hooks():
+    global _hooks_installed
+    if not _hooks_installed:
+        os.register_at_fork(before = before_fork, after_in_child = after_fork)
+        _hooks_installed = True
@@ -0,0 +1,408 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from array_utils import csr_offsets, expand_rows, group_sum
+from metrics_utils import timed
+
+## Embedded analytics mode. The publication, keyword score (LABEL_BY), faculty and institute
+## relations are exported from the academicworld graph into a directory of integer-encoded NumPy
+## columns (strings as one UTF-8 blob plus offsets) that is memory-mapped at startup. Rankings per
+## keyword and per school are aggregated and sorted at export time, so those widgets read a slice;
+## year ranges use prefix sums and argpartition. Every worker process mapping the same snapshot
+## shares its pages through the OS page cache, and no database is touched to serve the widgets.
+snapshot_config = {
+    'path': os.environ.get('KEYWORD_EXPLORE_SNAPSHOT', ''),
+    'limit': 10,
+    ## Exported versions kept next to the snapshot symlink
+    'keep': 2
+}
+
+SNAPSHOT_VERSION = 2
+
+class StringColumn:
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+    def tolist(self):
+        data = bytes(self.data)
+        offsets = self.offsets.tolist()
+        return [data[start:stop].decode('utf-8') for start, stop in zip(offsets, offsets[1:])]
+
+## Distinct values in first-seen order and the value -> code lookup
+def _encode(values):
+    codes = {}
+    for value in values:
+        codes.setdefault(value, len(codes))
+    return list(codes), codes
+
+## CSR rows per group, each row sorted by value descending so its top-k is a prefix
+def _ranked(groups, group_count, members, values):
+    import numpy as np
+    order = np.lexsort((-values, groups))
+    return csr_offsets(groups, group_count), [member[order].astype(np.int32) for member in members], values[order]
+
+## Integer-encode the raw relations and precompute the per-widget aggregates.
+## Returns (numeric columns, string columns, manifest).
+def build_columns(relations):
+    import numpy as np
+
+    keyword_names, keyword_code = _encode(record['name'] for record in relations['keywords'])
+    keyword_of = {record['id']: keyword_code[record['name']] for record in relations['keywords']}
+    school_names, school_code = _encode(record['name'] for record in relations['institutes'])
+    school_of = {record['id']: school_code[record['name']] for record in relations['institutes']}
+    faculty_names, faculty_name_code = _encode(record['name'] for record in relations['faculty'])
+    faculty_of = {record['id']: index for index, record in enumerate(relations['faculty'])}
+    faculty_name = np.array([faculty_name_code[record['name']] for record in relations['faculty']], dtype = np.int64)
+    publication_of = {record['id']: index for index, record in enumerate(relations['publications'])}
+    titles, title_code = _encode(record['title'] or '' for record in relations['publications'])
+    publication_title = np.array([title_code[record['title'] or ''] for record in relations['publications']], dtype = np.int64)
+    publication_year = np.array([record['year'] or 0 for record in relations['publications']], dtype = np.int64)
+    citations = np.array([record['citations'] or 0 for record in relations['publications']], dtype = np.int64)
+    K, S, F, P = len(keyword_names), len(school_names), len(faculty_names), len(publication_of)
+
+    def edges(name, *fields):
+        lookups = {'faculty': faculty_of, 'institute': school_of, 'publication': publication_of, 'keyword': keyword_of}
+        rows = [[lookups[field].get(record[field]) for field in fields] for record in relations[name]]
+        keep = [index for index, row in enumerate(rows) if None not in row]
+        arrays = [np.array([rows[index][column] for index in keep], dtype = np.int64) for column in range(len(fields))]
+        return arrays, keep
+
+    (affiliation_faculty, affiliation_school), _ = edges('affiliations', 'faculty', 'institute')
+    (publish_faculty, publish_publication), _ = edges('publishes', 'faculty', 'publication')
+    (label_publication, label_keyword), kept = edges('labels', 'publication', 'keyword')
+    label_score = np.array([relations['labels'][index]['score'] or 0.0 for index in kept], dtype = np.float64)
+    label_krc = label_score * citations[label_publication]
+
+    ## Query 1: per keyword and title, citations counted once per (institute, faculty) path
+    degree = np.bincount(affiliation_faculty, minlength = len(faculty_of))
+    paths = np.bincount(publish_publication, weights = degree[publish_faculty], minlength = P).astype(np.int64)
+    linked = paths[label_publication] > 0
+    (paper_keyword, paper_title), paper_count = group_sum(
+        (label_keyword[linked], publication_title[label_publication[linked]]), (K, len(titles)),
+        (citations * paths)[label_publication[linked]])
+    paper_offsets, (paper_title, ), paper_count = _ranked(paper_keyword, K, (paper_title, ), paper_count.round().astype(np.int64))
+
+    ## Faculty x keyword KRC: publish edges joined with the labels of each publication
+    label_order = np.argsort(label_publication, kind = 'stable')
+    repeat, positions = expand_rows(csr_offsets(label_publication, P), publish_publication)
+    joined = label_order[positions]
+    (krc_faculty, krc_keyword), krc_score = group_sum((publish_faculty[repeat], label_keyword[joined]), (len(faculty_of), K), label_krc[joined])
+
+    ## ... then joined with affiliations for Query 2 (by faculty name and school) and Query 3 (by school)
+    affiliation_order = np.argsort(affiliation_faculty, kind = 'stable')
+    repeat, positions = expand_rows(csr_offsets(affiliation_faculty, len(faculty_of)), krc_faculty)
+    krc_school = affiliation_school[affiliation_order[positions]]
+    (expert_keyword, expert_name, expert_school), expert_score = group_sum(
+        (krc_keyword[repeat], faculty_name[krc_faculty[repeat]], krc_school), (K, F, S), krc_score[repeat])
+    expert_offsets, (expert_name, expert_school), expert_score = _ranked(expert_keyword, K, (expert_name, expert_school), expert_score)
+    (school, school_keyword), school_score = group_sum((krc_school, krc_keyword[repeat]), (S, K), krc_score[repeat])
+    school_offsets, (school_keyword, ), school_score = _ranked(school, S, (school_keyword, ), school_score)
+
+    ## Per publication keywords and authors (CSR), for the full-text search index
+    publish_order = np.argsort(publish_publication, kind = 'stable')
+
+    ## Query 4: publications per keyword and year, with prefix sums over years
+    years = publication_year[publication_year > 0]
+    first_year, last_year = (int(years.min()), int(years.max())) if len(years) else (0, -1)
+    dated = publication_year[label_publication] > 0
+    year_counts = np.bincount(label_keyword[dated] * (last_year - first_year + 1) + publication_year[label_publication[dated]] - first_year,
+                              minlength = K * (last_year - first_year + 1)).astype(np.int32).reshape(K, last_year - first_year + 1)
+    year_prefix = np.zeros((K, year_counts.shape[1] + 1), dtype = np.int64)
+    np.cumsum(year_counts, axis = 1, out = year_prefix[:, 1:])
+
+    columns = {
+        'keyword_papers.offsets': paper_offsets,
+        'keyword_papers.title': paper_title,
+        'keyword_papers.count': paper_count,
+        'keyword_faculty.offsets': expert_offsets,
+        'keyword_faculty.faculty': expert_name,
+        'keyword_faculty.school': expert_school,
+        'keyword_faculty.score': expert_score,
+        'school_keywords.offsets': school_offsets,
+        'school_keywords.keyword': school_keyword,
+        'school_keywords.score': school_score,
+        'keyword_year.counts': year_counts,
+        'keyword_year.prefix': year_prefix,
+        ## Query 6 and dropdown popularity
+        'keyword_stats.publications': np.bincount(label_keyword, minlength = K).astype(np.int64),
+        'keyword_stats.krc': np.bincount(label_keyword, weights = label_krc, minlength = K),
+        'school_stats.faculty': np.bincount(affiliation_school, minlength = S).astype(np.int64),
+        ## Publication search documents
+        'publications.id': np.array([record['id'] for record in relations['publications']], dtype = np.int64),
+        'publications.title': publication_title,
+        'publications.year': publication_year,
+        'publications.citations': citations,
+        'publication_keywords.offsets': csr_offsets(label_publication, P),
+        'publication_keywords.keyword': label_keyword[label_order],
+        'publication_faculty.offsets': csr_offsets(publish_publication, P),
+        'publication_faculty.name': faculty_name[publish_faculty[publish_order]],
+    }
+    strings = {'keywords': keyword_names, 'schools': school_names, 'faculty': faculty_names, 'titles': titles}
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'first_year': first_year,
+        'last_year': last_year,
+        'rows': {name: len(records) for name, records in relations.items()},
+        'columns': sorted(columns),
+        'strings': sorted(strings)
+    }
+    return columns, strings, manifest
+
+def write_snapshot(path, columns, strings, manifest):
+    import numpy as np
+    os.makedirs(path)
+    for name, array in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+    for name, values in strings.items():
+        encoded = [value.encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+        np.cumsum([len(value) for value in encoded], out = offsets[1:])
+        np.save(os.path.join(path, f"{name}.offsets.npy"), offsets)
+        np.save(os.path.join(path, f"{name}.bytes.npy"), np.frombuffer(b"".join(encoded), dtype = np.uint8))
+    ## The manifest goes last: a directory without one is an incomplete export
+    with open(os.path.join(path, 'manifest.json'), 'w') as output:
+        json.dump(manifest, output, indent = 2)
+
+## Dump the relations from Neo4j into a new versioned directory next to path, then point the path
+## symlink at it with one os.replace, so readers always find a complete snapshot. Processes still
+## mapping an older version keep reading it until they reload; versions beyond the newest 'keep'
+## are deleted. A plain directory left at path by an older export is moved aside once.
+@timed('snapshot')
+def export_snapshot(path = None):
+    from neoj4_utils import get_snapshot_relations
+    path = os.path.abspath(path or snapshot_config['path'])
+    relations = get_snapshot_relations()
+    if relations is None:
+        logging.error("Error: snapshot export failed to read the academicworld relations.")
+        return False
+    version = f"{path}.v{time.time_ns():020d}-{os.getpid()}"
+    write_snapshot(version, *build_columns(relations))
+    if os.path.isdir(path) and not os.path.islink(path):
+        os.replace(path, f"{path}.v{0:020d}-legacy")
+    link = f"{path}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, path)
+    prune_snapshots(path)
+    return True
+
+## Delete all but the newest 'keep' versions of the snapshot at path (never the current one)
+def prune_snapshots(path, keep = None):
+    keep = snapshot_config['keep'] if keep is None else keep
+    directory, name = os.path.split(path)
+    current = os.path.realpath(path)
+    versions = sorted(entry for entry in os.listdir(directory) if entry.startswith(f"{name}.v"))
+    for entry in versions[:max(len(versions) - keep, 0)]:
+        if os.path.join(directory, entry) != current:
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors = True)
+
+class SnapshotEngine:
+    def __init__(self, path):
+        import numpy as np
+        ## Resolve the symlink once so every file comes from the same version
+        path = os.path.realpath(path)
+        with open(os.path.join(path, 'manifest.json')) as manifest:
+            self.manifest = json.load(manifest)
+        if self.manifest.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot {path} has version {self.manifest.get('version')}, expected {SNAPSHOT_VERSION}")
+        self.path = path
+        self.first_year = self.manifest['first_year']
+        self.last_year = self.manifest['last_year']
+        self.columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode = 'r') for name in self.manifest['columns']}
+        self.strings = {name: StringColumn(np.load(os.path.join(path, f"{name}.bytes.npy"), mmap_mode = 'r'),
+                                           np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode = 'r'))
+                        for name in self.manifest['strings']}
+        ## Keyword and school names are small and looked up on every request, so decode them once
+        self.keyword_names = self.strings['keywords'].tolist()
+        self.school_names = self.strings['schools'].tolist()
+        self.keyword_code = {name: code for code, name in enumerate(self.keyword_names)}
+        self.school_code = {name: code for code, name in enumerate(self.school_names)}
+
+    def __slice(self, name, group, limit):
+        offsets = self.columns[f"{name}.offsets"]
+        start = int(offsets[group])
+        return slice(start, min(int(offsets[group + 1]), start + limit))
+
+    def keywords(self):
+        return sorted(self.keyword_names)
+
+    def universities(self):
+        return sorted(self.school_names)
+
+    def top_papers(self, keyword, limit = 10):
+        code = self.keyword_code.get(keyword)
+        if code is None:
+            return []
+        rows = self.__slice('keyword_papers', code, limit)
+        titles = self.strings['titles']
+        return [{'publication': titles[title], 'count': count}
+                for title, count in zip(self.columns['keyword_papers.title'][rows].tolist(), self.columns['keyword_papers.count'][rows].tolist())]
+
+    def top_faculty(self, keyword, limit = 10):
+        code = self.keyword_code.get(keyword)
+        if code is None:
+            return []
+        rows = self.__slice('keyword_faculty', code, limit)
+        names = self.strings['faculty']
+        return [{'faculty': names[faculty], 'school': self.school_names[school], 'total_score': score}
+                for faculty, school, score in zip(self.columns['keyword_faculty.faculty'][rows].tolist(),
+                                                  self.columns['keyword_faculty.school'][rows].tolist(),
+                                                  self.columns['keyword_faculty.score'][rows].tolist())]
+
+    def school_keywords(self, university, limit = 10):
+        code = self.school_code.get(university)
+        if code is None:
+            return []
+        rows = self.__slice('school_keywords', code, limit)
+        return [{'keyword': self.keyword_names[keyword], 'krc score': score}
+                for keyword, score in zip(self.columns['school_keywords.keyword'][rows].tolist(), self.columns['school_keywords.score'][rows].tolist())]
+
+    def top_keywords(self, first_year, last_year = None, limit = 10):
+        import numpy as np
+        last_year = first_year if last_year is None else last_year
+        start = max(first_year, self.first_year) - self.first_year
+        stop = min(last_year, self.last_year) - self.first_year + 1
+        prefix = self.columns['keyword_year.prefix']
+        if stop <= start or len(prefix) == 0:
+            return []
+        totals = prefix[:, stop] - prefix[:, start]
+        limit = min(limit, len(totals))
+        top = np.argpartition(-totals, limit - 1)[:limit]
+        top = top[np.argsort(-totals[top], kind = 'stable')]
+        return [{"keyword": self.keyword_names[index], "publication count": int(totals[index])} for index in top if totals[index] > 0]
+
+    def keyword_stats(self, keywords):
+        publications = self.columns['keyword_stats.publications']
+        krc = self.columns['keyword_stats.krc']
+        records = []
+        for keyword in dict.fromkeys(keywords):
+            code = self.keyword_code.get(keyword)
+            if code is not None and publications[code] > 0:
+                records.append({"Keyword": keyword, "Publication Count": int(publications[code]), "KRC": float(krc[code])})
+        return records
+
+    def keyword_popularity(self):
+        return dict(zip(self.keyword_names, self.columns['keyword_stats.publications'].tolist()))
+
+    def university_popularity(self):
+        return dict(zip(self.school_names, self.columns['school_stats.faculty'].tolist()))
+
+    ## Search documents in the search_utils.publication_documents format
+    def publication_documents(self):
+        titles, faculty_names = self.strings['titles'], self.strings['faculty']
+        keyword_offsets = self.columns['publication_keywords.offsets'].tolist()
+        keywords = self.columns['publication_keywords.keyword'].tolist()
+        faculty_offsets = self.columns['publication_faculty.offsets'].tolist()
+        faculty = self.columns['publication_faculty.name'].tolist()
+        for index, (publication_id, title, year, citations) in enumerate(zip(
+                self.columns['publications.id'].tolist(), self.columns['publications.title'].tolist(),
+                self.columns['publications.year'].tolist(), self.columns['publications.citations'].tolist())):
+            yield {
+                'id': publication_id,
+                'title': titles[title],
+                'year': year or None,
+                'citations': citations,
+                'keywords': [self.keyword_names[keyword] for keyword in keywords[keyword_offsets[index]:keyword_offsets[index + 1]]],
+                'faculty': [faculty_names[name] for name in faculty[faculty_offsets[index]:faculty_offsets[index + 1]]]
+            }
+
+## The snapshot is mapped on first use; reload_engine() picks up a fresh export
+_engine = None
+_engine_lock = threading.Lock()
+
+## In a forked child: the mapped engine is kept, only the lock is replaced
+def reset_locks():
+    global _engine_lock
+    _engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = SnapshotEngine(snapshot_config['path'])
+    return _engine
+
+def reload_engine():
+    global _engine
+    engine = SnapshotEngine(snapshot_config['path'])
+    with _engine_lock:
+        _engine = engine
+
+def close_engine():
+    global _engine
+    with _engine_lock:
+        _engine = None
+
+## Drop-in replacements for the store query functions the dashboard uses, served from the snapshot
+@timed('snapshot')
+def get_all_keywords():
+    return get_engine().keywords()
+
+@timed('snapshot')
+def get_all_universities():
+    return get_engine().universities()
+
+@timed('snapshot')
+def get_university_popularity():
+    return get_engine().university_popularity()
+
+@timed('snapshot')
+def get_keyword_details_records(keyword):
+    engine = get_engine()
+    return engine.top_papers(keyword, snapshot_config['limit']), engine.top_faculty(keyword, snapshot_config['limit'])
+
+@timed('snapshot')
+def get_top_10_cited_research_paper_by_keyword_batch(keywords):
+    engine = get_engine()
+    return {keyword: engine.top_papers(keyword, snapshot_config['limit']) for keyword in dict.fromkeys(keywords)}
+
+@timed('snapshot')
+def get_top_10_faculty_by_keyword_batch(keywords):
+    engine = get_engine()
+    return {keyword: engine.top_faculty(keyword, snapshot_config['limit']) for keyword in dict.fromkeys(keywords)}
+
+@timed('snapshot')
+def get_top_10_keywords_by_School_records(university):
+    return get_engine().school_keywords(university, snapshot_config['limit'])
+
+@timed('snapshot')
+def mongo_get_top_10_keywords(year = 1982):
+    return get_engine().top_keywords(year, limit = snapshot_config['limit'])
+
+@timed('snapshot')
+def mongo_get_top_10_keywords_range(first_year, last_year):
+    return get_engine().top_keywords(first_year, last_year, snapshot_config['limit'])
+
+@timed('snapshot')
+def mongo_keyword_popularity():
+    return get_engine().keyword_popularity()
+
+@timed('snapshot')
+def keyword_stats_records(keywords):
+    return get_engine().keyword_stats(keywords)
+
+
+if __name__ == '__main__':
+    ## Export command: python snapshot_utils.py export [path] (defaults to $KEYWORD_EXPLORE_SNAPSHOT)
+    import sys
+    if sys.argv[1:2] == ['export'] and (sys.argv[2:3] or snapshot_config['path']):
+        from neoj4_utils import close_connection
+        path = sys.argv[2] if len(sys.argv) > 2 else snapshot_config['path']
+        print(f"Snapshot written to {path}" if export_snapshot(path) else "Snapshot export failed")
+        close_connection()
+    else:
+        print("Usage: python snapshot_utils.py export [path]")
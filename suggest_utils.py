@@ -0,0 +1,164 @@
+import bisect
+import heapq
+import logging
+import re
+import threading
+import time
+
+## Search-as-you-type index for dropdown options. Matches are ranked by match kind
+## (start of name, start of a word, anywhere) and then by popularity.
+##  * prefixes up to cached_prefix_length characters map straight to their precomputed top-N,
+##  * longer prefixes binary-search a sorted array of word-start suffixes,
+##  * mid-word substrings scan the rarest trigram's postings (popularity order) until enough verify.
+## Lookups touch a bounded number of entries, so latency stays flat as the vocabulary grows.
+## Once the indexes are max_age seconds old (None: never), the next lookup rebuilds them in the
+## background through the registered refresher; lookups keep using the old indexes meanwhile.
+suggest_config = {
+    'enabled': True,
+    'limit': 20,
+    'cached_prefix_length': 6,
+    'max_age': 3600
+}
+
+WORD_START = re.compile(r"(?:^|(?<=[\s\-_/(.,]))\w")
+
+class PrefixIndex:
+    def __init__(self, names, popularity = None, limit = 20, cached_prefix_length = 6):
+        popularity = popularity or {}
+        self.limit = limit
+        self.cached_prefix_length = cached_prefix_length
+        self.names = list(dict.fromkeys(name for name in names if name))
+        self.lowered = [name.lower() for name in self.names]
+        ## rank[i] < rank[j] means names[i] is more popular (ties broken alphabetically)
+        order = sorted(range(len(self.names)), key = lambda index: (-popularity.get(self.names[index], 0), self.lowered[index]))
+        self.order = order
+        self.rank = [0] * len(self.names)
+        for position, index in enumerate(order):
+            self.rank[index] = position
+
+        ## (suffix, is_name_start, id) for every word start of every name, sorted for binary search
+        entries = []
+        for index, lowered in enumerate(self.lowered):
+            for match in WORD_START.finditer(lowered):
+                entries.append((lowered[match.start():], match.start() == 0, index))
+        entries.sort()
+        self.suffixes = [entry[0] for entry in entries]
+        self.entries = entries
+
+        ## Top-N per short prefix, name starts ahead of word starts, then by popularity
+        self.top = {}
+        for suffix, is_name_start, index in sorted(entries, key = lambda entry: (not entry[1], self.rank[entry[2]])):
+            for length in range(1, min(len(suffix), cached_prefix_length) + 1):
+                bucket = self.top.setdefault(suffix[:length], [])
+                if len(bucket) < limit and index not in bucket:
+                    bucket.append(index)
+
+        ## Trigram postings in popularity order, so substring scans can stop after the first hits
+        self.grams = {}
+        for index in order:
+            lowered = self.lowered[index]
+            for gram in {lowered[start:start + 3] for start in range(len(lowered) - 2)}:
+                self.grams.setdefault(gram, []).append(index)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __prefix_matches(self, query, limit):
+        if len(query) <= self.cached_prefix_length:
+            return list(self.top.get(query, []))[:limit]
+        start = bisect.bisect_left(self.suffixes, query)
+        stop = bisect.bisect_left(self.suffixes, query + "\U0010ffff", start)
+        ranked = heapq.nsmallest(limit * 2, self.entries[start:stop], key = lambda entry: (not entry[1], self.rank[entry[2]]))
+        return list(dict.fromkeys(entry[2] for entry in ranked))[:limit]
+
+    def __substring_matches(self, query, limit, exclude):
+        grams = [query[start:start + 3] for start in range(len(query) - 2)]
+        if not grams:
+            return []
+        matches = []
+        for index in min((self.grams.get(gram, []) for gram in set(grams)), key = len):
+            if index not in exclude and query in self.lowered[index]:
+                matches.append(index)
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def search(self, query, limit = None):
+        limit = limit or self.limit
+        query = (query or "").strip().lower()
+        if not query:
+            return self.popular(limit)
+        matches = self.__prefix_matches(query, limit)
+        if len(matches) < limit:
+            matches += self.__substring_matches(query, limit - len(matches), set(matches))
+        return [self.names[index] for index in matches]
+
+    def popular(self, limit = None):
+        limit = limit or self.limit
+        return [self.names[index] for index in self.order[:limit]]
+
+## Named indexes (e.g. 'keywords', 'universities'), swapped atomically on refresh
+_indexes = {}
+_indexes_lock = threading.Lock()
+_refresher = None
+_refreshed = None
+_refreshing = False
+
+## In a forked child: the indexes are shared copy-on-write, only the lock is replaced
+## (a refresh running in the parent does not exist in the child)
+def reset_locks():
+    global _indexes_lock, _refreshing
+    _indexes_lock = threading.Lock()
+    _refreshing = False
+
+## The function that rebuilds every index from fresh data (the app's refresh_suggestions),
+## registered right after it has built them
+def register_refresher(function):
+    global _refresher, _refreshed
+    _refresher = function
+    _refreshed = time.monotonic()
+
+def stale():
+    return (_refresher is not None and suggest_config['max_age'] is not None
+            and time.monotonic() - _refreshed >= suggest_config['max_age'])
+
+def _refresh():
+    global _refreshed, _refreshing
+    try:
+        _refresher()
+    except Exception as error:
+        logging.warning(f"Refreshing the suggestion indexes failed: {error}")
+    finally:
+        ## A failed refresh waits another max_age as well, instead of retrying on every keystroke
+        with _indexes_lock:
+            _refreshed = time.monotonic()
+            _refreshing = False
+
+## Start one background rebuild, unless one is already running
+def refresh_in_background():
+    global _refreshing
+    with _indexes_lock:
+        if _refreshing or _refresher is None:
+            return False
+        _refreshing = True
+    threading.Thread(target = _refresh, name = 'suggest-refresh', daemon = True).start()
+    return True
+
+def build_index(name, names, popularity = None):
+    index = PrefixIndex(names, popularity, suggest_config['limit'], suggest_config['cached_prefix_length'])
+    with _indexes_lock:
+        _indexes[name] = index
+    return index
+
+def get_index(name):
+    return _indexes.get(name)
+
+## Dropdown options for a search string, always including the currently selected value
+def search_options(name, search_value, selected = None, limit = None):
+    if stale():
+        refresh_in_background()
+    index = get_index(name)
+    matches = index.search(search_value, limit) if index is not None else []
+    if selected and selected not in matches:
+        matches = [selected] + matches
+    return [{'label': match, 'value': match} for match in matches]
@@ -0,0 +1,12 @@
+## WSGI entry point for production serving with several worker processes and threads:
+##     gunicorn -c gunicorn.conf.py wsgi:server
+## Importing this module loads the app and its startup data; with the server preloading it in the
+## master process, the workers fork from there and reinitialize their database clients.
+from serving_utils import install_fork_hooks, preload
+
+install_fork_hooks()
+
+from app import app
+
+preload()
+server = app.server